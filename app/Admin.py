@@ -1,8 +1,12 @@
-import bcrypt
 import re
-from sqlalchemy import select
-from typing import Optional
-
+from functools import lru_cache
+from sqlalchemy import event, select
+from sqlalchemy.orm import make_transient_to_detached
+from typing import Any, Dict, Optional
+
+from app.cache import LRUCache
+from app.database.config import get_settings
+from app.hashing import get_password_hasher
 from app.models.User import User
 
 class UserNotFound(Exception):
@@ -20,29 +24,71 @@ class AuthenticationFail(Exception):
     pass
 
 
+@lru_cache()
+def get_user_cache() -> LRUCache[Dict[str, Any]]:
+    """Кэш данных пользователей по id: пользователь нужен при каждом аутентифицированном
+    запросе, а меняются его данные редко. Хранятся только поля _CACHED_FIELDS, а не ORM
+    объекты, поэтому каждая сессия получает собственный экземпляр User. Кэш локален
+    для процесса: изменение пользователя в другом процессе становится видно здесь
+    не позже, чем через USER_CACHE_TTL секунд"""
+    settings = get_settings()
+    return LRUCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+# Поля, нужные аутентифицированным запросам и странице пользователя. Хэш пароля
+# в кэш не попадает: он нужен только при входе, где пользователь читается из БД
+_CACHED_FIELDS = ("id", "username", "email", "fullname")
+
+
+def _cached_fields(user: User) -> Dict[str, Any]:
+    """Возвращает значения кэшируемых полей пользователя"""
+    return {field: getattr(user, field) for field in _CACHED_FIELDS}
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target: User) -> None:
+    """Удаляет пользователя из кэша при любом изменении его записи через ORM
+    в этом процессе"""
+    get_user_cache().pop(target.id)
+
+
 class Admin:
     """Класс, обеспечивающий работу с учетными записями пользователей"""
 
-    def find_by_id(self, id: int):
+    async def find_by_id(self, id: int):
         """Ищет пользователя по заданному id. Если пользователя с таким id нет,
         выбрасывает исключение UserNotFound"""
-        q = select(User).filter_by(id=id)
-        user = self.__session.scalars(q).first()
+        columns = get_user_cache().get(id)
+        if columns is not None:
+            # Новый экземпляр из кэшированных значений привязывается к сессии
+            # как уже сохраненный, без запроса к БД. Некэшированные поля остаются
+            # незагруженными и в асинхронной сессии недоступны
+            user = User(**columns)
+            make_transient_to_detached(user)
+            return await self.__session.merge(user, load=False)
+        user = await self.__session.get(User, id)
         if not user:
             raise UserNotFound(f"Пользователь с user_id={id} не найден")
+        get_user_cache().put(id, _cached_fields(user))
         return user
 
-    def signin(self, username: str, password: str) -> User:
+    async def signin(self, username: str, password: str) -> User:
         """Если заданы верные имя пользователя и пароль, возвращает соответсвующий
         экземпляр User. В ином случае выбрасывает исключение ValueError"""
         q = select(User).filter_by(username=username)
-        user = self.__session.scalars(q).first()
-        if user and bcrypt.checkpw(password.encode("utf-8"), user.hashed_password):
-            return user
-        else:
+        user = (await self.__session.scalars(q)).first()
+        hasher = get_password_hasher()
+        if not (user and await hasher.check(password, user.hashed_password)):
             raise AuthenticationFail("Неверные имя пользователя и/или пароль")
+        # Открытый пароль доступен только при входе, поэтому хэши, полученные
+        # с прежним cost factor, пересчитываются здесь
+        if hasher.needs_rehash(user.hashed_password):
+            user.hashed_password = await hasher.hash(password)
+            await self.__session.commit()
+        return user
 
-    def __validate_username(self, username: str) -> None:
+    async def __validate_username(self, username: str) -> None:
         """Проверяет корректность имени пользователя (не менее 3 символов, включает
         только буквы, числа или символ _), а также его уникальность (в базе данных
         не может быть два пользователя с одним именем). Если имя некорректно или уже
@@ -53,7 +99,7 @@ class Admin:
                 + "буквы, числа или символ _"
             )
         q = select(User).filter_by(username=username)
-        user = self.__session.scalars(q).first()
+        user = (await self.__session.scalars(q)).first()
         if user is not None:
             raise IncorectUserData("Пользователь с заданным именем уже существует")
 
@@ -69,20 +115,16 @@ class Admin:
         if len(password) < 8:
             raise IncorectUserData("Пароль должен содержать более 8 символов")
 
-    def __hash_password(self, password: str) -> bytes:
-        """Хэширует пароль пользователя для его сохранения в базе данных"""
-        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-
-    def signup(
+    async def signup(
         self, username: str, password: str, email: str, fullname: Optional[str] = None
     ) -> User:
         """Регистрирует нового пользователя, предварительно валидируя данные"""
 
-        self.__validate_username(username)
+        await self.__validate_username(username)
         self.__validate_email(email)
         self.__validate_password(password)
 
-        hashed_password = self.__hash_password(password)
+        hashed_password = await get_password_hasher().hash(password)
 
         new_user = User(
             username=username,
@@ -91,7 +133,7 @@ class Admin:
             fullname=fullname,
         )
         self.__session.add(new_user)
-        self.__session.commit()
+        await self.__session.commit()
         return new_user
 
     def __init__(self, session):
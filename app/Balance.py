@@ -1,11 +1,34 @@
+from collections import defaultdict
 from datetime import datetime, date, time
 from decimal import Decimal
-from sqlalchemy import select
-from typing import List, Optional
+from sqlalchemy import Row, RowMapping, Select, Update, insert, select, tuple_, update
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
+from app.database.database import dialect_insert
+from app.export import EXPORT_BATCH_SIZE
+from app.HoldStatus import HoldStatus
+from app.models.AccountBalance import AccountBalance
+from app.models.BalanceHold import BalanceHold
 from app.models.User import User
 from app.models.Transaction import Transaction
 
+def _period(
+    start_date: Optional[date], end_date: Optional[date]
+) -> Tuple[datetime, datetime]:
+    """Возвращает границы периода для выборки истории"""
+    if start_date is None:
+        # Произвольная дата, ранее которой точно не может быть транзакций в БД
+        start_date = date(2025, 1, 1)
+    if end_date is None:
+        end_date = datetime.now()
+    # Если не установить время, то при вызове between будут взяты 00 час 00 мин
+    # последней даты, то есть записи последнего дня не будут учтены
+    end_date = datetime.combine(
+        end_date, time(hour=23, minute=59, second=59, microsecond=999999)
+    )
+    return datetime.combine(start_date, time()), end_date
+
+
 class BalanceError(Exception):
     """Специальное исключение для ошибок, связанных с выполнением операций с балансом"""
     pass
@@ -13,83 +36,346 @@ class BalanceError(Exception):
 class Balance:
     """Класс представлят методы для работы с хранилищем транзакций всех пользователей"""
 
-    def replenish(self, user: User, amount: Decimal) -> Transaction:
+    async def replenish(self, user: User, amount: Decimal) -> Transaction:
         """Пополняет баланс пользователя на заданную сумму и возвращает экземпляр
         Transaction. При невозможности пополнения генерирует исключение
         BalanceError"""
         if amount <= 0:
             raise BalanceError("Баланс может быть пополнен только на сумму > 0")
-        transaction = Transaction(
-            user_id=user.id,
-            timestamp=datetime.now(),
-            amount=amount,
-            balance=self[user] + amount,
-        )
-        self.__session.add(transaction)
-        self.__session.commit()
-        return transaction
+        return await self.__record(user, amount)
 
-    def pay(self, user: User, amount: Decimal) -> Transaction:
+    async def pay(self, user: User, amount: Decimal) -> Transaction:
         """Списывает деньги с баланса пользователя на выполнение запроса и возвращает
         экземпляр Transaction. При недостаточности денег генерирует исключение
         BalanceError"""
         if amount <= 0:
             raise BalanceError("Сумма платежа должна быть > 0")
-        if self[user] < amount:
-            raise BalanceError("Недостаточно средств на балансе пользователя")
+        return await self.__record(user, amount * (-1))
+
+    async def hold(self, user: User, holds: List[Tuple[int, Decimal]]) -> None:
+        """Резервирует средства под запросы: holds - пары (id записи журнала, цена).
+        Изменения не фиксируются: вызывающий код фиксирует их вместе с записями журнала.
+        При недостаточности средств генерирует исключение BalanceError"""
+        await self.reserve(user, sum(amount for _, amount in holds))
+        await self.add_holds(user, holds)
+
+    async def reserve(self, user: User, total: Decimal) -> None:
+        """Увеличивает зарезервированную сумму пользователя одним условным UPDATE,
+        поэтому параллельные запросы не могут зарезервировать больше доступного
+        остатка (balance - held). При недостаточности средств генерирует исключение
+        BalanceError; в этом случае баланс не меняется, и откатывать транзакцию
+        не нужно. Изменения не фиксируются"""
+        q = (
+            update(AccountBalance)
+            .where(
+                AccountBalance.user_id == user.id,
+                AccountBalance.balance - AccountBalance.held >= total,
+            )
+            .values(held=AccountBalance.held + total, updated_at=datetime.now())
+            .returning(AccountBalance.held)
+        )
+        if await self.__update_account(user, q) is None:
+            raise BalanceError("Недостаточно денег на балансе для выполнения запроса!")
+
+    async def add_holds(self, user: User, holds: List[Tuple[int, Decimal]]) -> None:
+        """Записывает резервы под запросы, сумма которых уже зарезервирована
+        методом reserve. Изменения не фиксируются"""
+        now = datetime.now()
+        await self.__session.execute(
+            insert(BalanceHold),
+            [
+                {
+                    "user_id": user.id,
+                    "mllog_id": query_log_id,
+                    "amount": amount,
+                    "status": HoldStatus.ACTIVE,
+                    "created_at": now,
+                }
+                for query_log_id, amount in holds
+            ],
+        )
+
+    async def capture(self, user: User, query_log_id: int) -> Optional[Transaction]:
+        """Списывает зарезервированную под запрос сумму и возвращает экземпляр
+        Transaction. Достаточность средств проверена при резервировании, поэтому
+        баланс повторно не проверяется. Если активного резерва нет (он уже списан,
+        снят по таймауту или запрос отправлен до появления резервов), возвращает None.
+        Изменения не фиксируются: вызывающий код фиксирует их вместе с изменением
+        статуса запроса"""
+        now = datetime.now()
+        q = (
+            update(BalanceHold)
+            .where(
+                BalanceHold.mllog_id == query_log_id,
+                BalanceHold.status == HoldStatus.ACTIVE,
+            )
+            .values(status=HoldStatus.CAPTURED, resolved_at=now)
+            .returning(BalanceHold.amount)
+        )
+        amount = (await self.__session.execute(q)).scalar_one_or_none()
+        if amount is None:
+            return None
+        q = (
+            update(AccountBalance)
+            .where(AccountBalance.user_id == user.id)
+            .values(
+                balance=AccountBalance.balance - amount,
+                held=AccountBalance.held - amount,
+                updated_at=now,
+            )
+            .returning(AccountBalance.balance)
+        )
+        new_balance = (await self.__session.execute(q)).scalar_one()
         transaction = Transaction(
-            user_id=user.id,
-            timestamp=datetime.now(),
-            amount=amount * (-1),
-            balance=self[user] - amount,
+            user_id=user.id, timestamp=now, amount=-amount, balance=new_balance
         )
         self.__session.add(transaction)
-        self.__session.commit()
+        await self.__session.flush()
+        return transaction
+
+    async def hold_status(self, query_log_id: int) -> Optional[HoldStatus]:
+        """Возвращает статус резерва под запрос или None, если резерва не было"""
+        q = select(BalanceHold.status).filter_by(mllog_id=query_log_id)
+        return (await self.__session.scalars(q)).first()
+
+    async def capture_batch(self, query_log_ids: List[int]) -> Dict[int, Transaction]:
+        """Списывает резервы под несколько запросов: резервы отмечаются одним UPDATE,
+        баланс каждого пользователя меняется одним UPDATE на общую сумму, транзакции
+        добавляются пачкой. Возвращает транзакции по id записей журнала; запросы
+        без активного резерва в результат не попадают. Изменения не фиксируются:
+        вызывающий код фиксирует их вместе с изменениями журнала"""
+        now = datetime.now()
+        q = (
+            update(BalanceHold)
+            .where(
+                BalanceHold.mllog_id.in_(query_log_ids),
+                BalanceHold.status == HoldStatus.ACTIVE,
+            )
+            .values(status=HoldStatus.CAPTURED, resolved_at=now)
+            .returning(BalanceHold.mllog_id, BalanceHold.user_id, BalanceHold.amount)
+        )
+        holds_by_user = defaultdict(list)
+        for hold in (await self.__session.execute(q)).all():
+            holds_by_user[hold.user_id].append(hold)
+
+        transactions = {}
+        for user_id, holds in holds_by_user.items():
+            total = sum(hold.amount for hold in holds)
+            q = (
+                update(AccountBalance)
+                .where(AccountBalance.user_id == user_id)
+                .values(
+                    balance=AccountBalance.balance - total,
+                    held=AccountBalance.held - total,
+                    updated_at=now,
+                )
+                .returning(AccountBalance.balance)
+            )
+            # Остаток после каждой транзакции восстанавливаем от итогового баланса
+            balance = (await self.__session.execute(q)).scalar_one() + total
+            for hold in sorted(holds, key=lambda hold: hold.mllog_id):
+                balance -= hold.amount
+                transactions[hold.mllog_id] = Transaction(
+                    user_id=user_id, timestamp=now, amount=-hold.amount, balance=balance
+                )
+        self.__session.add_all(transactions.values())
+        await self.__session.flush()
+        return transactions
+
+    async def release(self, query_log_id: int) -> bool:
+        """Снимает резерв под запрос, возвращая сумму в доступный остаток.
+        Возвращает False, если активного резерва нет"""
+        now = datetime.now()
+        try:
+            q = (
+                update(BalanceHold)
+                .where(
+                    BalanceHold.mllog_id == query_log_id,
+                    BalanceHold.status == HoldStatus.ACTIVE,
+                )
+                .values(status=HoldStatus.RELEASED, resolved_at=now)
+                .returning(BalanceHold.user_id, BalanceHold.amount)
+            )
+            hold = (await self.__session.execute(q)).one_or_none()
+            if hold is None:
+                return False
+            await self.__session.execute(
+                update(AccountBalance)
+                .where(AccountBalance.user_id == hold.user_id)
+                .values(held=AccountBalance.held - hold.amount, updated_at=now)
+            )
+            await self.__session.commit()
+        except Exception:
+            await self.__session.rollback()
+            raise
+        return True
+
+    async def expired_holds(self, created_before: datetime, limit: int = 100) -> List[int]:
+        """Возвращает id записей журнала, резервы под которые активны с момента
+        раньше created_before"""
+        q = (
+            select(BalanceHold.mllog_id)
+            .filter(
+                BalanceHold.status == HoldStatus.ACTIVE,
+                BalanceHold.created_at < created_before,
+            )
+            .order_by(BalanceHold.created_at)
+            .limit(limit)
+        )
+        return (await self.__session.scalars(q)).all()
+
+    async def __record(self, user: User, amount: Decimal) -> Transaction:
+        """Изменяет баланс на amount и записывает транзакцию в одной транзакции БД.
+        При недостаточности средств условный UPDATE ничего не меняет, поэтому
+        BalanceError генерируется без отката: откат сессии сделал бы устаревшими
+        все загруженные вызывающим кодом объекты. Если что-то пошло не так при
+        записи, изменения откатываются целиком, поэтому операцию можно безопасно
+        повторить"""
+        try:
+            new_balance = await self.__change_balance(user, amount)
+        except Exception:
+            await self.__session.rollback()
+            raise
+        if new_balance is None:
+            raise BalanceError("Недостаточно средств на балансе пользователя")
+        try:
+            transaction = Transaction(
+                user_id=user.id,
+                timestamp=datetime.now(),
+                amount=amount,
+                balance=new_balance,
+            )
+            self.__session.add(transaction)
+            await self.__session.commit()
+        except Exception:
+            await self.__session.rollback()
+            raise
         return transaction
 
-    def __getitem__(self, user: User) -> Decimal:
+    async def __change_balance(self, user: User, amount: Decimal) -> Optional[Decimal]:
+        """Атомарно изменяет баланс на amount одним запросом UPDATE ... RETURNING.
+        Для списаний (amount < 0) достаточность средств проверяется условием того же
+        запроса, поэтому параллельные списания не могут увести баланс в минус.
+        Возвращает новый баланс или None, если средств недостаточно"""
+        q = update(AccountBalance).where(AccountBalance.user_id == user.id)
+        if amount < 0:
+            # Зарезервированные под запросы средства списывать нельзя
+            q = q.where(AccountBalance.balance - AccountBalance.held >= -amount)
+        q = q.values(
+            balance=AccountBalance.balance + amount, updated_at=datetime.now()
+        ).returning(AccountBalance.balance)
+        return await self.__update_account(user, q)
+
+    async def __update_account(self, user: User, q: Update) -> Optional[Decimal]:
+        """Выполняет UPDATE ... RETURNING строки account_balance пользователя.
+        Если строки еще нет, создает ее и повторяет запрос. Возвращает None, если
+        условие запроса не выполнено"""
+        value = (await self.__session.execute(q)).scalar_one_or_none()
+        if value is None and not await self.__account_exists(user):
+            # Строки баланса еще не было - создаем ее и повторяем запрос. Строку мог
+            # одновременно создать другой запрос, поэтому UPDATE повторяется в любом случае
+            await self.__create_account(user)
+            value = (await self.__session.execute(q)).scalar_one_or_none()
+        return value
+
+    async def __account_exists(self, user: User) -> bool:
+        """Проверяет, есть ли у пользователя строка account_balance"""
+        q = select(AccountBalance.user_id).filter_by(user_id=user.id)
+        return (await self.__session.scalars(q)).first() is not None
+
+    async def __create_account(self, user: User) -> None:
+        """Создает строку account_balance пользователя по данным журнала транзакций.
+        Если строка уже существует, ничего не делает"""
+        insert = dialect_insert(self.__session)
+        q = (
+            insert(AccountBalance)
+            .values(
+                user_id=user.id,
+                balance=await self.__ledger_balance(user),
+                updated_at=datetime.now(),
+            )
+            .on_conflict_do_nothing(index_elements=[AccountBalance.user_id])
+        )
+        await self.__session.execute(q)
+
+    async def __getitem__(self, user: User) -> Decimal:
         """Для получения текущего баланса пользователя реализуем поддержку
-        синтаксиса [...]"""
+        синтаксиса [...] (await balance[user])"""
+        q = select(AccountBalance.balance).filter_by(user_id=user.id)
+        user_balance = (await self.__session.scalars(q)).first()
+        if user_balance is None:
+            user_balance = await self.__ledger_balance(user)
+        return user_balance
+
+    async def __ledger_balance(self, user: User) -> Decimal:
+        """Возвращает баланс по последней транзакции пользователя. Используется,
+        только если для пользователя еще нет строки в account_balance"""
         q = (
             select(Transaction.balance)
             .filter_by(user_id=user.id)
             .order_by(Transaction.id.desc())
+            .limit(1)
         )
-        user_balance = self.__session.scalars(q).first()
+        user_balance = (await self.__session.scalars(q)).first()
         if user_balance is None:
             # Если в таблице ничего не нашлось, то пользователь никогда
             # не пополнял баланс, значит он равен 0
             user_balance = Decimal(0)
         return user_balance
 
-    def transactions_history(
+    async def transactions_history(
         self,
         user: User,
         start_date: Optional[date] = None,
         end_date: Optional[date] = None,
-    ) -> List[Transaction]:
+        cursor: Optional[Tuple[datetime, int]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Row]:
         """Возвращает историю транзакций пользователя между заданными датами.
         Если start_date не задана, возвращаются транзакции, начиная с самой ранней.
-        Если end_date не задана, возвращаются все транзакции до момента вызова метода"""
-        if start_date is None:
-            # Произвольная дата, ранее которой точно не может быть транзакций в БД
-            start_date = date(2025, 1, 1)
-        if end_date is None:
-            end_date = datetime.now()
-        # Если не установить время, то при вызове between будут взяты 00 час 00 мин
-        # последней даты, то есть записи последнего дня не будут учтены
-        end_date = datetime.combine(
-            end_date, time(hour=23, minute=59, second=59, microsecond=999999)
+        Если end_date не задана, возвращаются все транзакции до момента вызова метода.
+        Для постраничного вывода задаются limit и cursor - ключ (timestamp, id)
+        последней транзакции предыдущей страницы. Возвращаются строки только
+        с колонками транзакции, без загрузки ORM объектов"""
+        q = self.__history_query(user, start_date, end_date)
+        if cursor is not None:
+            q = q.filter(tuple_(Transaction.timestamp, Transaction.id) > cursor)
+        if limit is not None:
+            q = q.limit(limit)
+        return (await self.__session.execute(q)).all()
+
+    async def stream_transactions_history(
+        self,
+        user: User,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+    ) -> AsyncIterator[RowMapping]:
+        """Возвращает историю транзакций пользователя между заданными датами
+        построчно, читая ее из серверного курсора порциями по EXPORT_BATCH_SIZE"""
+        q = self.__history_query(user, start_date, end_date).execution_options(
+            yield_per=EXPORT_BATCH_SIZE
         )
-        q = (
-            select(Transaction)
+        result = await self.__session.stream(q)
+        async for row in result.mappings():
+            yield row
+
+    def __history_query(
+        self, user: User, start_date: Optional[date], end_date: Optional[date]
+    ) -> Select:
+        """Формирует запрос истории транзакций пользователя за период"""
+        return (
+            select(
+                Transaction.id,
+                Transaction.timestamp,
+                Transaction.amount,
+                Transaction.balance,
+            )
             .filter(
                 Transaction.user_id == user.id,
-                Transaction.timestamp.between(start_date, end_date),
+                Transaction.timestamp.between(*_period(start_date, end_date)),
             )
-            .order_by(Transaction.id)
+            .order_by(Transaction.timestamp, Transaction.id)
         )
-        return self.__session.scalars(q).all()
 
     def __init__(self, session):
         self.__session = session
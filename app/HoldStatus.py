@@ -0,0 +1,14 @@
+from enum import Enum
+
+
+class HoldStatus(Enum):
+    """Перечисление, представляющее возможные состояния резерва средств под запрос"""
+
+    # Средства зарезервированы при отправке запроса и недоступны для других запросов
+    ACTIVE = 0
+
+    # Запрос выполнен, зарезервированная сумма списана с баланса
+    CAPTURED = 1
+
+    # Запрос не выполнен (ошибка или истекло время ожидания), резерв снят
+    RELEASED = 2
@@ -1,12 +1,24 @@
 from decimal import Decimal
+from itertools import islice
 import re
 
+CHAR_PRICE = Decimal(0.5)  # Цена за единицу сложности
+MIN_TEXT_LENGTH = 10  # Минимальное количество символов
+MIN_LETTERS = 5  # Минимальное количество букв
+MIN_PRICE = Decimal('5.00')
+MAX_PRICE = Decimal('500.00')
+
+# Шаблоны компилируются один раз при импорте, а не при каждом запросе
+LETTER_PATTERN = re.compile(r'[a-zA-Zа-яА-Я]')
+SENTENCE_END_PATTERN = re.compile(r'[.!?]+')
+
+
 class IncorrectML(Exception):
     """Исключение для некорректного текста запроса"""
 
 
 class ML:
-    """Класс, представляющий запрос пользователя - задачу для ML модели 
+    """Класс, представляющий запрос пользователя - задачу для ML модели
     по генерации заголовков на основе текста."""
 
     @property
@@ -19,65 +31,56 @@ class ML:
         """Цена выполнения запроса (определяется по количеству символов в тексте)"""
         return self.__price
 
-    def __count_complexity(self, text):
-        """Оценивает сложность текста на основе количества символов и предложений"""
-        # Убираем лишние пробелы и переносы строк
-        cleaned_text = re.sub(r'\s+', ' ', text.strip())
-
-        # Считаем количество символов (без пробелов)
-        char_count = len(re.sub(r'\s', '', cleaned_text))
-
-        # Считаем количество предложений (по точкам, восклицательным и вопросительным знакам)
-        sentence_count = len(re.findall(r'[.!?]+', cleaned_text))
-        if sentence_count == 0:
-            sentence_count = 1  # Минимум одно предложение
-
-        # Сложность = символы * коэффициент сложности предложений
-        complexity = char_count * (1 + sentence_count * 0.1)
-        return max(complexity, 1)  # Минимум 1
-
     def __repr__(self):
         return f"Query(text='{self.__text[:50]}...')" if len(self.__text) > 50 else f"Query(text='{self.__text}')"
 
     def __init__(self, text):
         """Принимает текст, состоящий хотя бы из 10 символов (без учета пробелов).
-        Если текст не соответствует данному критерию, выбрасывается исключение ValueError"""
-        CHAR_PRICE = Decimal(0.5)  # Цена за единицу сложности
-        MIN_TEXT_LENGTH = 10  # Минимальное количество символов
-
+        Если текст не соответствует данному критерию, выбрасывается исключение IncorrectML.
+        Текст просматривается тремя проходами, каждый из которых выполняется на C:
+        split() для слов и символов, поиск букв (останавливается после MIN_LETTERS
+        совпадений) и подсчет концов предложений. Все счетчики вычисляются один раз"""
         self.__text = text.strip()
+        self.__stats = None
 
         # Проверяем, что текст не пустой
         if not self.__text:
-            raise IncorrectQuery("Текст не может быть пустым")
+            raise IncorrectML("Текст не может быть пустым")
+
+        # split() без аргументов делит текст по любым пробельным символам, поэтому
+        # дает и количество слов, и количество символов без пробелов
+        words = self.__text.split()
+        self.__word_count = len(words)
+        self.__char_count = sum(map(len, words))
 
         # Проверяем минимальную длину текста (без пробелов)
-        text_without_spaces = re.sub(r'\s', '', self.__text)
-        if len(text_without_spaces) < MIN_TEXT_LENGTH:
-            raise IncorrectQuery(f"Текст должен содержать хотя бы {MIN_TEXT_LENGTH} символов (без учета пробелов)")
+        if self.__char_count < MIN_TEXT_LENGTH:
+            raise IncorrectML(f"Текст должен содержать хотя бы {MIN_TEXT_LENGTH} символов (без учета пробелов)")
 
-        # Проверяем, что текст содержит осмысленный контент (не только спецсимволы/цифры)
-        meaningful_chars = re.findall(r'[a-zA-Zа-яА-Я]', self.__text)
-        if len(meaningful_chars) < 5:  # Хотя бы 5 букв
-            raise IncorrectQuery("Текст должен содержать осмысленное содержание")
+        # Проверяем, что текст содержит осмысленный контент (не только спецсимволы/цифры);
+        # поиск букв прекращается, как только найдено необходимое количество
+        if len(list(islice(LETTER_PATTERN.finditer(self.__text), MIN_LETTERS))) < MIN_LETTERS:
+            raise IncorrectML("Текст должен содержать осмысленное содержание")
 
-        # Рассчитываем цену на основе сложности текста
-        complexity = self.__count_complexity(self.__text)
-        self.__price = Decimal(complexity * float(CHAR_PRICE)).quantize(Decimal('0.01'))
+        # Считаем количество предложений (по точкам, восклицательным и вопросительным знакам)
+        self.__sentence_count = len(SENTENCE_END_PATTERN.findall(self.__text)) or 1
+
+        # Сложность = символы * коэффициент сложности предложений
+        self.__complexity = max(self.__char_count * (1 + self.__sentence_count * 0.1), 1)
 
-        # Устанавливаем минимальную и максимальную цену
-        MIN_PRICE = Decimal('5.00')
-        MAX_PRICE = Decimal('500.00')
-        self.__price = max(min(self.__price, MAX_PRICE), MIN_PRICE)
+        # Рассчитываем цену на основе сложности текста и ограничиваем ее
+        price = Decimal(self.__complexity * float(CHAR_PRICE)).quantize(Decimal('0.01'))
+        self.__price = max(min(price, MAX_PRICE), MIN_PRICE)
 
     def get_text_stats(self) -> dict:
         """Возвращает статистику текста для отладки"""
-        cleaned_text = re.sub(r'\s+', ' ', self.__text.strip())
-        return {
-            'total_chars': len(self.__text),
-            'chars_without_spaces': len(re.sub(r'\s', '', self.__text)),
-            'word_count': len(cleaned_text.split()),
-            'sentence_count': len(re.findall(r'[.!?]+', cleaned_text)) or 1,
-            'complexity_score': self.__count_complexity(self.__text),
-            'price': float(self.__price)
-        }
\ No newline at end of file
+        if self.__stats is None:
+            self.__stats = {
+                'total_chars': len(self.__text),
+                'chars_without_spaces': self.__char_count,
+                'word_count': self.__word_count,
+                'sentence_count': self.__sentence_count,
+                'complexity_score': self.__complexity,
+                'price': float(self.__price)
+            }
+        return dict(self.__stats)
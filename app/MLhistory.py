@@ -1,17 +1,52 @@
+from collections import defaultdict
 from dataclasses import asdict
-from datetime import datetime, date, time
-from sqlalchemy import select
-from typing import List, Optional, Dict, Any
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import Row, RowMapping, Select, func, insert, select, tuple_, update
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.database.database import dialect_insert
+from app.export import EXPORT_BATCH_SIZE
 from app.models.Mllog import Mllog
+from app.models.MllogDailyStats import MllogDailyStats
 from app.models.User import User
 from app.models.Transaction import Transaction
 from app.ML import ML
 from app.MLstatus import MLstatus
+from app.notifications import get_notifier
 from app.Prediction import Prediction
 
 
+# Статусы, из которых запрос может перейти в данный статус. Завершенные
+# (выполненные или отмененные) запросы свой статус больше не меняют
+_PREVIOUS_STATUSES = {
+    MLstatus.RUNNING: (MLstatus.WAITING,),
+    MLstatus.COMPLETED: (MLstatus.WAITING, MLstatus.RUNNING),
+    MLstatus.CANCELED: (MLstatus.WAITING, MLstatus.RUNNING),
+}
+
+
+def _history_item(row: Row) -> Dict[str, Any]:
+    """Преобразует строку выборки истории в словарь с вложенной транзакцией"""
+    transaction = None
+    if row.transaction_id is not None:
+        transaction = {
+            "id": row.transaction_id,
+            "timestamp": row.transaction_timestamp,
+            "amount": row.transaction_amount,
+            "balance": row.transaction_balance,
+        }
+    return {
+        "id": row.id,
+        "transaction": transaction,
+        "timestamp": row.timestamp,
+        "query_text": row.query_text,
+        "status": row.status.value,
+        "result_dict": row.result_dict,
+        "generated_title": row.generated_title,
+    }
+
+
 class MLhistory:
     """Класс, обеспечивающий работу с журналом запросов генерации заголовков"""
 
@@ -20,20 +55,108 @@ class MLhistory:
             user: User,
             query: ML,
     ) -> Mllog:
-        """Добавляет запись о новом запросе на генерацию заголовка в журнал"""
+        """Добавляет запись о новом запросе на генерацию заголовка в журнал.
+        Изменения не фиксируются: вызывающий код фиксирует их вместе с резервом средств"""
         query_log_item = Mllog(
             user_id=user.id,
             timestamp=datetime.now(),
             query_text=query.text,
             status=MLstatus.WAITING,
             query_type="title_generation",  # Тип запроса для фильтрации
-            price=float(query.price)  # Сохраняем стоимость запроса
+            price=query.price  # Сохраняем стоимость запроса
         )
         self.__session.add(query_log_item)
-        await self.__session.commit()
-        await self.__session.refresh(query_log_item)
+        await self.__session.flush()
+        await self.__bump_daily_stats(query_log_item, total_queries=1)
         return query_log_item
 
+    async def add_batch(
+            self,
+            user: User,
+            queries: List[ML],
+            batch_id: str,
+    ) -> List[int]:
+        """Добавляет в журнал записи о пакете запросов одним INSERT с несколькими
+        наборами параметров и возвращает их id в порядке запросов. Изменения
+        не фиксируются: вызывающий код фиксирует их вместе с резервом средств"""
+        timestamp = datetime.now()
+        q = insert(Mllog).returning(Mllog.id, sort_by_parameter_order=True)
+        result = await self.__session.scalars(
+            q,
+            [
+                {
+                    "user_id": user.id,
+                    "timestamp": timestamp,
+                    "query_text": query.text,
+                    "status": MLstatus.WAITING,
+                    "query_type": "title_generation",
+                    "price": query.price,
+                    "batch_id": batch_id,
+                }
+                for query in queries
+            ],
+        )
+        query_log_ids = result.all()
+        await self.__bump_daily_stats_for(
+            user.id, "title_generation", timestamp.date(), total_queries=len(queries)
+        )
+        return query_log_ids
+
+    async def complete_batch(
+            self, results: Dict[int, Tuple[str, Transaction]]
+    ) -> List[Mllog]:
+        """Отмечает выполненными несколько запросов: results - заголовок и транзакция
+        оплаты по id записи журнала. Записи читаются одним запросом, а дневная
+        статистика увеличивается один раз на пользователя и день. Уже выполненные
+        и отмененные запросы не меняются. Изменения не фиксируются: вызывающий код
+        фиксирует их вместе с оплатой"""
+        q = select(Mllog).filter(
+            Mllog.id.in_(results), Mllog.status.in_(_PREVIOUS_STATUSES[MLstatus.COMPLETED])
+        )
+        query_log_items = (await self.__session.scalars(q)).all()
+        completed_at = datetime.now()
+        daily_stats = defaultdict(lambda: {"completed": 0, "total_cost": 0, "confidence_sum": 0.0})
+        for query_log_item in query_log_items:
+            generated_title, transaction = results[query_log_item.id]
+            query_log_item.status = MLstatus.COMPLETED
+            query_log_item.completed_at = completed_at
+            query_log_item.generated_title = generated_title
+            query_log_item.transaction_id = transaction.id
+            counters = daily_stats[
+                (query_log_item.user_id, query_log_item.query_type, query_log_item.timestamp.date())
+            ]
+            counters["completed"] += 1
+            counters["total_cost"] += query_log_item.price or 0
+            counters["confidence_sum"] += query_log_item.confidence_score or 0.0
+        for (user_id, query_type, day), counters in daily_stats.items():
+            await self.__bump_daily_stats_for(user_id, query_type, day, **counters)
+        return query_log_items
+
+    async def get_statuses(self, query_log_ids: List[int]) -> Dict[int, MLstatus]:
+        """Возвращает статусы записей журнала по id одним запросом; id, которых
+        нет в журнале, в результат не попадают"""
+        q = select(Mllog.id, Mllog.status).filter(Mllog.id.in_(query_log_ids))
+        return {row.id: row.status for row in (await self.__session.execute(q)).all()}
+
+    async def notify(self, query_log_items: List[Mllog]) -> None:
+        """Сообщает подписчикам об изменении статуса записей, зафиксированных
+        вызывающим кодом"""
+        for query_log_item in query_log_items:
+            await self.__notify(query_log_item)
+
+    async def get_batch_progress(self, user: User, batch_id: str) -> Dict[str, int]:
+        """Возвращает количество запросов пакета в каждом статусе"""
+        q = (
+            select(Mllog.status, func.count().label("count"))
+            .filter(Mllog.user_id == user.id, Mllog.batch_id == batch_id)
+            .group_by(Mllog.status)
+        )
+        result = await self.__session.execute(q)
+        counts = {row.status: row.count for row in result.all()}
+        progress = {status.name.lower(): counts.get(status, 0) for status in MLstatus}
+        progress["total"] = sum(counts.values())
+        return progress
+
     async def update(
             self,
             query_log_id: int,
@@ -43,23 +166,26 @@ class MLhistory:
             generated_title: Optional[str] = None,
             confidence: Optional[float] = None,
             model_version: Optional[str] = None
-    ) -> None:
-        """Обновляет запись в журнале полученными данными"""
+    ) -> bool:
+        """Обновляет запись в журнале полученными данными. Статус меняется условным
+        UPDATE, поэтому повторная доставка того же статуса (или результат для уже
+        отмененного запроса) не меняет запись и не увеличивает счетчики статистики.
+        Возвращает False, если статус не изменился"""
+        if status == MLstatus.COMPLETED and not transaction:
+            raise RuntimeError(
+                "Запрос имеет статус исполненного, но не задана транзакция оплаты"
+            )
+
         query_log_item = await self.get_by_id(query_log_id)
+        if not await self.__change_status(query_log_item, status):
+            return False
 
         if status == MLstatus.RUNNING:
-            query_log_item.status = status
             query_log_item.started_at = datetime.now()
 
         elif status == MLstatus.COMPLETED:
-            query_log_item.status = status
             query_log_item.completed_at = datetime.now()
 
-            if not transaction:
-                raise RuntimeError(
-                    "Запрос имеет статус исполненного, но не задана транзакция оплаты"
-                )
-
             # Сохраняем результаты генерации заголовка
             if generated_title:
                 query_log_item.generated_title = generated_title
@@ -69,29 +195,79 @@ class MLhistory:
                 query_log_item.model_version = model_version
 
             query_log_item.transaction_id = transaction.id
+            await self.__bump_daily_stats(
+                query_log_item,
+                completed=1,
+                total_cost=query_log_item.price or 0,
+                confidence_sum=query_log_item.confidence_score or 0.0,
+            )
 
         elif status == MLstatus.CANCELED:
-            query_log_item.status = status
             query_log_item.completed_at = datetime.now()
             query_log_item.error_message = "Ошибка генерации заголовка"
+            await self.__bump_daily_stats(query_log_item, failed=1)
 
         await self.__session.commit()
+        await self.__notify(query_log_item)
+        return True
 
-    async def cancel(self, query_log_id: int) -> None:
-        """Отменяет запрос на генерацию заголовка"""
+    async def cancel(self, query_log_id: int) -> bool:
+        """Отменяет запрос на генерацию заголовка. Возвращает False, если запрос
+        уже выполнен или отменен"""
         query_log_item = await self.get_by_id(query_log_id)
-        query_log_item.status = MLstatus.CANCELED
+        if not await self.__change_status(query_log_item, MLstatus.CANCELED):
+            return False
         query_log_item.completed_at = datetime.now()
+        await self.__bump_daily_stats(query_log_item, failed=1)
         await self.__session.commit()
+        await self.__notify(query_log_item)
+        return True
 
     async def get_for_user(
+            self,
+            user: User,
+            start_date: Optional[date] = None,
+            end_date: Optional[date] = None,
+            query_type: str = "title_generation",
+            cursor: Optional[Tuple[datetime, int]] = None,
+            limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Возвращает историю запросов пользователя на генерацию заголовков между заданными датами.
+        Для постраничного вывода задаются limit и cursor - ключ (timestamp, id) последней
+        записи предыдущей страницы. Выбираются только нужные колонки, без загрузки ORM объектов"""
+        q = self.__history_query(user, start_date, end_date, query_type)
+        if cursor is not None:
+            q = q.filter(tuple_(Mllog.timestamp, Mllog.id) < cursor)
+        if limit is not None:
+            q = q.limit(limit)
+
+        result = await self.__session.execute(q)
+        return [_history_item(row) for row in result.all()]
+
+    async def stream_for_user(
             self,
             user: User,
             start_date: Optional[date] = None,
             end_date: Optional[date] = None,
             query_type: str = "title_generation"
-    ) -> List[Mllog]:
-        """Возвращает историю запросов пользователя на генерацию заголовков между заданными датами"""
+    ) -> AsyncIterator[RowMapping]:
+        """Возвращает историю запросов пользователя между заданными датами построчно,
+        читая ее из серверного курсора порциями по EXPORT_BATCH_SIZE"""
+        q = self.__history_query(user, start_date, end_date, query_type).execution_options(
+            yield_per=EXPORT_BATCH_SIZE
+        )
+        result = await self.__session.stream(q)
+        async for row in result.mappings():
+            yield row
+
+    def __history_query(
+            self,
+            user: User,
+            start_date: Optional[date],
+            end_date: Optional[date],
+            query_type: str
+    ) -> Select:
+        """Формирует запрос истории запросов пользователя за период"""
         if start_date is None:
             start_date = date(2025, 1, 1)
         if end_date is None:
@@ -101,19 +277,28 @@ class MLhistory:
             end_date, time(hour=23, minute=59, second=59, microsecond=999999)
         )
 
-        q = (
-            select(Mllog)
+        return (
+            select(
+                Mllog.id,
+                Mllog.timestamp,
+                Mllog.query_text,
+                Mllog.status,
+                Mllog.result_dict,
+                Mllog.generated_title,
+                Transaction.id.label("transaction_id"),
+                Transaction.timestamp.label("transaction_timestamp"),
+                Transaction.amount.label("transaction_amount"),
+                Transaction.balance.label("transaction_balance"),
+            )
+            .outerjoin(Transaction, Mllog.transaction_id == Transaction.id)
             .filter(
                 Mllog.user_id == user.id,
-                Mllog.query_text == query_type,
+                Mllog.query_type == query_type,
                 Mllog.timestamp.between(start_date, end_datetime),
             )
-            .order_by(Mllog.timestamp.desc())  # Сначала новые
+            .order_by(Mllog.timestamp.desc(), Mllog.id.desc())  # Сначала новые
         )
 
-        result = await self.__session.execute(q)
-        return result.scalars().all()
-
     async def get_by_id(self, query_log_id: int) -> Mllog:
         """Возвращает запись из журнала запросов по ее id"""
         q = select(Mllog).filter_by(id=query_log_id)
@@ -129,34 +314,120 @@ class MLhistory:
             user: User,
             days: int = 30
     ) -> Dict[str, Any]:
-        """Возвращает статистику пользователя по генерации заголовков"""
+        """Возвращает статистику пользователя по генерации заголовков. Агрегаты
+        считаются в БД одним запросом с группировкой по статусу"""
         from_date = datetime.now() - timedelta(days=days)
 
         q = (
-            select(Mllog)
+            select(
+                Mllog.status,
+                func.count().label("count"),
+                func.coalesce(func.sum(Mllog.price), 0).label("total_cost"),
+                func.coalesce(func.sum(Mllog.confidence_score), 0).label("confidence_sum"),
+            )
             .filter(
                 Mllog.user_id == user.id,
                 Mllog.query_type == "title_generation",
                 Mllog.timestamp >= from_date,
             )
+            .group_by(Mllog.status)
         )
 
-        result = self.__session.execute(q)
-        queries = result.scalars().all()
+        result = await self.__session.execute(q)
+        by_status = {row.status: row for row in result.all()}
 
-        completed = [q for q in queries if q.status == MLstatus.COMPLETED]
-        failed = [q for q in queries if q.status == MLstatus.CANCELED   ]
-        total_cost = sum(q.price for q in completed if q.price is not None)
+        total = sum(row.count for row in by_status.values())
+        completed = by_status.get(MLstatus.COMPLETED)
+        failed = by_status.get(MLstatus.CANCELED)
+        completed_count = completed.count if completed else 0
 
         return {
-            "total_queries": len(queries),
-            "completed": len(completed),
-            "failed": len(failed),
-            "success_rate": len(completed) / len(queries) * 100 if queries else 0,
-            "total_cost": total_cost,
-            "avg_confidence": sum(q.confidence_score for q in completed if q.confidence_score) / len(
-                completed) if completed else 0
+            "total_queries": total,
+            "completed": completed_count,
+            "failed": failed.count if failed else 0,
+            "success_rate": completed_count / total * 100 if total else 0,
+            "total_cost": completed.total_cost if completed else 0,
+            "avg_confidence": completed.confidence_sum / completed_count if completed_count else 0
         }
 
+    async def get_daily_stats(
+            self,
+            user: User,
+            days: int = 30,
+            query_type: str = "title_generation"
+    ) -> List[MllogDailyStats]:
+        """Возвращает предварительно агрегированную статистику пользователя по дням"""
+        from_date = date.today() - timedelta(days=days)
+        q = (
+            select(MllogDailyStats)
+            .filter(
+                MllogDailyStats.user_id == user.id,
+                MllogDailyStats.query_type == query_type,
+                MllogDailyStats.day >= from_date,
+            )
+            .order_by(MllogDailyStats.day)
+        )
+        result = await self.__session.execute(q)
+        return result.scalars().all()
+
+    async def __change_status(self, query_log_item: Mllog, status: MLstatus) -> bool:
+        """Переводит запись в статус status одним условным UPDATE, если текущий
+        статус допускает такой переход. Возвращает False, если статус не изменен"""
+        q = (
+            update(Mllog)
+            .where(Mllog.id == query_log_item.id, Mllog.status.in_(_PREVIOUS_STATUSES[status]))
+            .values(status=status)
+            .execution_options(synchronize_session=False)
+        )
+        if (await self.__session.execute(q)).rowcount != 1:
+            return False
+        query_log_item.status = status
+        return True
+
+    async def __notify(self, query_log_item: Mllog) -> None:
+        """Сообщает подписчикам пользователя об изменении статуса запроса"""
+        await get_notifier().publish(
+            query_log_item.user_id,
+            {
+                "id": query_log_item.id,
+                "status": query_log_item.status.value,
+                "transaction_id": query_log_item.transaction_id,
+            },
+        )
+
+    async def __bump_daily_stats(self, query_log_item: Mllog, **counters) -> None:
+        """Увеличивает счетчики дневной статистики за день создания запроса.
+        Изменения фиксируются вместе с изменениями журнала"""
+        await self.__bump_daily_stats_for(
+            query_log_item.user_id,
+            query_log_item.query_type,
+            query_log_item.timestamp.date(),
+            **counters,
+        )
+
+    async def __bump_daily_stats_for(
+            self, user_id: int, query_type: str, day: date, **counters
+    ) -> None:
+        """Увеличивает счетчики дневной статистики пользователя за заданный день"""
+        upsert = dialect_insert(self.__session)
+        q = upsert(MllogDailyStats).values(
+            user_id=user_id,
+            query_type=query_type,
+            day=day,
+            **counters,
+        )
+        q = q.on_conflict_do_update(
+            index_elements=[
+                MllogDailyStats.user_id,
+                MllogDailyStats.query_type,
+                MllogDailyStats.day,
+            ],
+            set_={
+                name: getattr(MllogDailyStats, name) + q.excluded[name]
+                for name in counters
+            },
+        )
+        await self.__session.execute(q)
+
     def __init__(self, session: AsyncSession):
         self.__session = session
\ No newline at end of file
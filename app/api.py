@@ -1,30 +1,103 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
+import asyncio
+import logging
 import uvicorn
 
-from app.database.database import init_db
+from app.database.config import get_settings
+from app.database.database import engine, init_db
+from app.hashing import get_password_hasher
 from app.models.base import Base
+from app.mlworkerproxy import sweep_expired_holds
+from app.mqpublisher import get_publisher
+from app.notifications import get_notifier
+from app.rpcclient import get_rpc_client
+from app.titlechain import get_title_chain
 from app.routes.Balance import balance_router
+from app.routes.Metrics import metrics_router
 from app.routes.ML import ml_router
 from app.routes.User import user_router
 
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 app.include_router(balance_router, prefix="/balance")
 app.include_router(user_router, prefix="/user")
 app.include_router(ml_router, prefix="/ml")
+app.include_router(metrics_router, prefix="/metrics")
 
 app.mount("/view", StaticFiles(directory="app/view"), name="view")
 
 
+@app.on_event("startup")
+def build_title_chain():
+    # Цепочку генерации заголовков собираем заранее, а не при первом запросе
+    if get_settings().TITLE_GENERATION_BACKEND == "local":
+        get_title_chain()
+
+
+@app.on_event("startup")
+async def start_hold_sweeper():
+    # Резервы запросов, результат которых так и не пришел, снимаются в фоне
+    app.state.hold_sweeper = asyncio.create_task(sweep_expired_holds())
+
+
+@app.on_event("shutdown")
+def stop_hold_sweeper():
+    app.state.hold_sweeper.cancel()
+
+
+@app.on_event("startup")
+async def start_notifier():
+    await get_notifier().start()
+
+
+@app.on_event("shutdown")
+async def close_notifier():
+    await get_notifier().close()
+
+
+@app.on_event("startup")
+def declare_task_queue():
+    # Очередь задач объявляется при старте, чтобы задачи не терялись до первой публикации.
+    # Если брокер еще недоступен, издатель подключится при первой публикации
+    try:
+        get_publisher().connect()
+    except Exception as e:
+        logger.error(f"Не удалось подключиться к RabbitMQ при старте: {e}")
+
+
+@app.on_event("shutdown")
+def close_publisher():
+    # Издатель закрываем, только если он был создан
+    if get_publisher.cache_info().currsize:
+        get_publisher().close()
+
+
+@app.on_event("shutdown")
+async def close_rpc_client():
+    if get_rpc_client.cache_info().currsize:
+        await get_rpc_client().close()
+
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    await engine.dispose()
+
+
+@app.on_event("shutdown")
+def close_password_hasher():
+    get_password_hasher().close()
+
+
 @app.get("/")
 def root():
     return RedirectResponse(url="/view/base.html")
 
 
 if __name__ == "__main__":
-    init_db(Base, drop_all=True)
-    #init_db(Base, drop_all=True)
+    asyncio.run(init_db(Base, drop_all=True))
+    #asyncio.run(init_db(Base, drop_all=True))
     uvicorn.run("api:app", host="0.0.0.0", port=8080, reload=True)
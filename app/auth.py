@@ -1,9 +1,14 @@
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, Request, Response, status
+from functools import lru_cache
 from jose import jwt
 from pydantic_settings import BaseSettings, SettingsConfigDict
+import secrets
+import time
 
-from app.database.database import get_session
+from app.cache import LRUCache
+from app.database.config import get_settings
+from app.database.database import get_async_session
 from app.models.User import User
 from app.Admin import Admin
 
@@ -20,6 +25,9 @@ class AuthSettings(BaseSettings):
 
 auth_settings = AuthSettings()  # type: ignore
 
+# Заголовок, в котором воркер передает общий секрет WORKER_API_TOKEN
+WORKER_TOKEN_HEADER = "X-Worker-Token"
+
 def add_access_token_to_cookie(access_token: str, response: Response):
     """Добавляет JWT токен к HTTP ответу"""
     response.set_cookie(
@@ -42,21 +50,50 @@ def create_access_token(user: User) -> str:
     access_token = jwt.encode(payload, auth_settings.JWT_SECRET_KEY, algorithm="HS256")
     return access_token
 
-def access_token_user(request: Request, session=Depends(get_session)) -> User:
+@lru_cache()
+def get_token_cache() -> LRUCache[int]:
+    """Кэш проверенных токенов: токен -> user_id"""
+    settings = get_settings()
+    return LRUCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE)
+
+def verify_access_token(access_token: str) -> int:
+    """Проверяет JWT токен и возвращает user_id. Результат проверки кэшируется
+    на AUTH_TOKEN_CACHE_TTL секунд, но не дольше срока действия токена"""
+    token_cache = get_token_cache()
+    user_id = token_cache.get(access_token)
+    if user_id is not None:
+        return user_id
+    # jwt.decode() автоматически проверяет в числе прочего срок действия токена,
+    # если установлен exp, поэтому вручную этого можно не делать
+    claims = jwt.decode(access_token, auth_settings.JWT_SECRET_KEY, algorithms=["HS256"])
+    user_id = claims["user_id"]
+    ttl = get_settings().AUTH_TOKEN_CACHE_TTL
+    if "exp" in claims:
+        ttl = min(ttl, claims["exp"] - time.time())
+    token_cache.put(access_token, user_id, expires_at=time.monotonic() + ttl)
+    return user_id
+
+async def access_token_user(
+    request: Request, session=Depends(get_async_session)
+) -> User:
     """Берет из куки JWT токен, проверяет его, находит и возвращает пользователя.
     Если что-то пошло не так (отсутствует токен, он просрочен, является некорректным
     по какой-либо еще причине и т.д.) возвращает 403 код (клиентская часть при его
     получении выполняет редирект на страницу логина)"""
-    # jwt.decode() автоматически проверяет в числе прочего срок действия токена,
-    # если установлен exp, поэтому вручную этого можно не делать
     users_manager = Admin(session)
     try:
         access_token_cookie = request.cookies[auth_settings.JWT_TOKEN_COOKIE_KEY]
         access_token = access_token_cookie[len("Bearer ") :]
-        claims = jwt.decode(
-            access_token, auth_settings.JWT_SECRET_KEY, algorithms=["HS256"]
-        )
-        user_id = claims["user_id"]
-        return users_manager.find_by_id(user_id)
+        user_id = verify_access_token(access_token)
+        return await users_manager.find_by_id(user_id)
     except:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+def worker_access(request: Request) -> None:
+    """Проверяет, что запрос отправлен воркером: заголовок X-Worker-Token должен
+    совпадать с WORKER_API_TOKEN. Если секрет не задан, эндпоинты воркера
+    недоступны. В ином случае возвращает 403 код"""
+    expected = get_settings().WORKER_API_TOKEN
+    token = request.headers.get(WORKER_TOKEN_HEADER, "")
+    if not expected or not secrets.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
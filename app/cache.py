@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+import threading
+import time
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """Потокобезопасный LRU кэш ограниченного размера. Если задан ttl, записи
+    считаются устаревшими через ttl секунд после добавления. Для отдельной записи
+    можно задать собственный срок действия при добавлении"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__data: "OrderedDict[Hashable, Tuple[V, Optional[float]]]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Возвращает значение по ключу или None, если его нет или оно устарело"""
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self.__data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.__data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: V, expires_at: Optional[float] = None) -> None:
+        """Добавляет значение. expires_at задается по шкале time.monotonic()"""
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.monotonic() + self.ttl
+        with self.__lock:
+            self.__data[key] = (value, expires_at)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Удаляет значение по ключу, если оно есть"""
+        with self.__lock:
+            self.__data.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__data.clear()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {"size": len(self.__data), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self.__data)
@@ -10,14 +10,47 @@ class Settings(BaseSettings):
     DB_USER: Optional[str] = None  # Имя пользователя БД
     DB_PASS: Optional[str] = None  # Пароль пользователя БД
     DB_NAME: Optional[str] = None  # Название базы данных
+    DB_POOL_SIZE: int = 20  # Количество постоянных соединений в пуле
+    DB_MAX_OVERFLOW: int = 20  # Количество дополнительных соединений сверх пула
+    DB_POOL_TIMEOUT: float = 30  # Время ожидания свободного соединения, с
+    DB_POOL_RECYCLE: int = 3600  # Время жизни соединения, с
+    DB_POOL_LIVENESS: str = "pre_ping"  # pre_ping, idle_ping или none
+    DB_POOL_IDLE_PING_AFTER: float = 30  # Простой, после которого idle_ping проверяет соединение, с
     JWT_SECRET_KEY: Optional[str] = None
     JWT_TOKEN_COOKIE_KEY: Optional[str] = None
+    WORKER_API_TOKEN: Optional[str] = None  # Общий секрет воркера для отправки результатов
+    AUTH_TOKEN_CACHE_SIZE: int = 10_000  # Количество проверенных токенов в кэше
+    AUTH_TOKEN_CACHE_TTL: float = 60  # Время хранения проверенного токена, с
+    USER_CACHE_SIZE: int = 10_000  # Количество пользователей в кэше
+    USER_CACHE_TTL: float = 10  # Время хранения данных пользователя, с (кэш локален для процесса)
+    BCRYPT_ROUNDS: int = 12  # cost factor bcrypt для новых хэшей паролей
+    BCRYPT_WORKERS: int = 2  # Количество процессов для хэширования паролей
+    BCRYPT_MAX_PENDING: int = 32  # Максимум одновременных задач хэширования
 
     # Настройки приложения
     APP_NAME: Optional[str] = None  # Название приложения
     DEBUG: Optional[bool] = None  # Режим отладки
     API_VERSION: Optional[str] = None  # Версия API
 
+    # Настройки генерации заголовков
+    TITLE_GENERATION_BACKEND: str = "rpc"  # rpc - через RPC воркер, local - LLM в процессе API
+    RPC_TIMEOUT: float = 30  # Время ожидания ответа RPC воркера, с
+    TITLE_MODEL_NAME: str = "mistral:7b-instruct"  # Модель для режима local
+    TITLE_MODEL_POOL_SIZE: int = 4  # Количество клиентов модели в пуле
+    RETRIEVAL_CACHE_SIZE: int = 1024  # Количество текстов, для которых кэшируется контекст
+    RETRIEVAL_TIMEOUT: float = 2.0  # Время ожидания векторного хранилища, с
+    PRICE_CACHE_SIZE: int = 4096  # Количество текстов, для которых кэшируется цена
+    PRICE_CACHE_MAX_AGE: int = 3600  # Время хранения цены в кэше браузера и nginx, с
+    PRICE_BATCH_MAX_SIZE: int = 100  # Максимум текстов в одном запросе цен
+    ML_BATCH_MAX_SIZE: int = 100  # Максимум текстов в одном пакете запросов
+    HOLD_TIMEOUT: float = 900  # Время, после которого невыполненный запрос отменяется, с
+    HOLD_SWEEP_INTERVAL: float = 60  # Интервал проверки просроченных резервов, с
+
+    # Настройки уведомлений о статусе запросов
+    NOTIFICATIONS_BACKEND: str = "local"  # local - в пределах процесса, rabbitmq - между процессами
+    NOTIFICATIONS_QUEUE_SIZE: int = 100  # Количество непрочитанных событий на подключение
+    NOTIFICATIONS_KEEPALIVE: float = 15  # Интервал комментариев keep-alive в потоке SSE, с
+
     @property
     def DATABASE_URL_asyncpg(self):
         """Формирует URL подключения для asyncpg"""
@@ -28,10 +61,14 @@ class Settings(BaseSettings):
         """Формирует URL подключения для psycopg"""
         return f'postgresql+psycopg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}'
 
+    # Путь к файлу задан относительно корня репозитория (рабочий каталог
+    # приложения, тестов и нагрузочного теста), как и в AuthSettings. В .env корня
+    # хранятся параметры docker-compose, поэтому лишние ключи игнорируются
     model_config = SettingsConfigDict(
-        env_file=".env",
+        env_file="app/.env",
         env_file_encoding="utf-8",
-        case_sensitive=True
+        case_sensitive=True,
+        extra="ignore",
     )
 
     def validate(self) -> None:
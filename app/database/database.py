@@ -1,33 +1,56 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, Engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
 from .config import get_settings
+from .pool import LIVENESS_PRE_PING, InstrumentedPool, instrument_engine
 
-def get_engine():
+def get_engine() -> AsyncEngine:
     settings = get_settings()
 
-    engine = create_engine(
-        url=settings.DATABASE_URL_psycopg,
+    engine = create_async_engine(
+        url=settings.DATABASE_URL_asyncpg,
         echo=settings.DEBUG,
-        pool_size=5,
-        max_overflow=10,
-        pool_pre_ping=True,
-        pool_recycle=3600
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_LIVENESS == LIVENESS_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
     )
+    instrument_engine(engine, settings.DB_POOL_LIVENESS, settings.DB_POOL_IDLE_PING_AFTER)
     return engine
 
 
 engine = get_engine()
 
+# expire_on_commit=False: после commit атрибуты объектов остаются загруженными,
+# иначе обращение к ним потребовало бы неявного (невозможного в async) запроса к БД
+async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
-def get_session():
-    with Session(engine) as session:
+
+async def get_async_session():
+    async with async_session_maker() as session:
         yield session
 
 
-def init_db(base_cls, drop_all: bool = False) -> Engine:
-    engine = get_engine()
-    if drop_all:
-        base_cls.metadata.drop_all(engine)
-    base_cls.metadata.create_all(engine)
+async def init_db(base_cls, drop_all: bool = False) -> AsyncEngine:
+    async with engine.begin() as connection:
+        if drop_all:
+            await connection.run_sync(base_cls.metadata.drop_all)
+        await connection.run_sync(base_cls.metadata.create_all)
+    # Соединения пула привязаны к циклу событий, в котором были созданы,
+    # поэтому не оставляем их для цикла событий приложения
+    await engine.dispose()
     return engine
+
+
+def dialect_insert(session: AsyncSession):
+    """Возвращает конструктор INSERT диалекта БД сессии (для INSERT ... ON CONFLICT)"""
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError, TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# Стратегии проверки живости соединений при выдаче из пула
+LIVENESS_PRE_PING = "pre_ping"  # SELECT 1 при каждой выдаче соединения
+LIVENESS_IDLE_PING = "idle_ping"  # проверка только соединений, долго простоявших в пуле
+LIVENESS_NONE = "none"  # полагаемся на pool_recycle и обработку ошибок разрыва
+LIVENESS_STRATEGIES = (LIVENESS_PRE_PING, LIVENESS_IDLE_PING, LIVENESS_NONE)
+
+WAIT_SAMPLES = 1024  # Количество последних ожиданий для расчета перцентилей
+
+
+class PoolMetrics:
+    """Счетчики пула соединений. Обновляются обработчиками событий пула,
+    которые могут вызываться из разных потоков, поэтому защищены блокировкой"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__waits = deque(maxlen=WAIT_SAMPLES)
+        self.reset()
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.soft_invalidations = 0
+            self.timeouts = 0
+            self.idle_pings = 0
+            self.ping_failures = 0
+            self.overflow_peak = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.__waits.clear()
+
+    def observe_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self.__lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.__waits.append(seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def observe_checkout(self, overflow: int) -> None:
+        with self.__lock:
+            self.checkouts += 1
+            self.overflow_peak = max(self.overflow_peak, overflow)
+
+    def increment(self, counter: str) -> None:
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает значения счетчиков и перцентили времени ожидания соединения"""
+        with self.__lock:
+            waits = sorted(self.__waits)
+            counters = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "timeouts": self.timeouts,
+                "idle_pings": self.idle_pings,
+                "ping_failures": self.ping_failures,
+                "overflow_peak": self.overflow_peak,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+            }
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        counters["wait_p50"] = percentile(0.50)
+        counters["wait_p95"] = percentile(0.95)
+        counters["wait_p99"] = percentile(0.99)
+        return counters
+
+
+# Движок в процессе один, поэтому и счетчики общие для процесса
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий время ожидания свободного соединения (включая
+    создание нового соединения в пределах max_overflow)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            pool_metrics.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.observe_wait(time.perf_counter() - started)
+        return connection
+
+
+def instrument_engine(
+    engine: AsyncEngine, liveness: str = LIVENESS_PRE_PING, idle_ping_after: float = 30
+) -> None:
+    """Подписывает счетчики pool_metrics на события пула движка. При стратегии
+    idle_ping соединение проверяется только если оно пролежало в пуле дольше
+    idle_ping_after секунд: под нагрузкой соединения возвращаются в пул часто,
+    и лишний запрос к БД на каждую выдачу не делается"""
+    if liveness not in LIVENESS_STRATEGIES:
+        raise ValueError(f"Неизвестная стратегия проверки соединений: {liveness}")
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_metrics.increment("connects")
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.observe_checkout(max(sync_engine.pool.overflow(), 0))
+        checked_in_at = connection_record.info.pop("checked_in_at", None)
+        if liveness != LIVENESS_IDLE_PING or checked_in_at is None:
+            return
+        if time.monotonic() - checked_in_at < idle_ping_after:
+            return
+        pool_metrics.increment("idle_pings")
+        try:
+            alive = sync_engine.dialect.do_ping(dbapi_connection)
+        except Exception as e:
+            logger.warning(f"Idle connection ping failed: {e}")
+            alive = False
+        if not alive:
+            pool_metrics.increment("ping_failures")
+            # Пул заменит соединение новым и повторит выдачу
+            raise DisconnectionError("Соединение с БД разорвано")
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_metrics.increment("checkins")
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.increment("invalidations")
+
+    @event.listens_for(sync_engine, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.increment("soft_invalidations")
+
+
+def pool_status(engine: AsyncEngine) -> Dict[str, Any]:
+    """Текущее состояние пула вместе с накопленными счетчиками"""
+    pool = engine.sync_engine.pool
+    status = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    status.update(pool_metrics.snapshot())
+    return status
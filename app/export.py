@@ -0,0 +1,69 @@
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+import io
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, List, Mapping
+
+# Поддерживаемые форматы выгрузки и соответствующие им типы содержимого
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Количество строк, получаемых из курсора БД за одно обращение
+EXPORT_BATCH_SIZE = 1000
+
+
+def _plain(value: Any) -> Any:
+    """Приводит значение из БД к типу, который можно записать в JSON или CSV"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class _RowEncoder:
+    """Кодирует строки выборки по одной в NDJSON или CSV"""
+
+    def __init__(self, fields: List[str], format: str):
+        self.__fields = fields
+        self.__format = format
+        self.__buffer = io.StringIO()
+        self.__writer = csv.writer(self.__buffer)
+
+    def header(self) -> str:
+        if self.__format != "csv":
+            return ""
+        return self.__csv_line(self.__fields)
+
+    def encode(self, row: Mapping[str, Any]) -> str:
+        values = [_plain(row[field]) for field in self.__fields]
+        if self.__format == "csv":
+            return self.__csv_line(
+                json.dumps(v) if isinstance(v, (dict, list)) else v for v in values
+            )
+        return json.dumps(dict(zip(self.__fields, values)), ensure_ascii=False) + "\n"
+
+    def __csv_line(self, values: Iterable[Any]) -> str:
+        self.__writer.writerow(values)
+        line = self.__buffer.getvalue()
+        self.__buffer.seek(0)
+        self.__buffer.truncate()
+        return line
+
+
+async def aencode_rows(
+    rows: AsyncIterable[Mapping[str, Any]], fields: List[str], format: str
+) -> AsyncIterator[str]:
+    """Построчно кодирует выборку, не накапливая ее в памяти"""
+    encoder = _RowEncoder(fields, format)
+    header = encoder.header()
+    if header:
+        yield header
+    async for row in rows:
+        yield encoder.encode(row)
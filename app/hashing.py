@@ -0,0 +1,77 @@
+import asyncio
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from app.database.config import get_settings
+
+
+class HashingOverloaded(Exception):
+    """Исключение для случая, когда очередь хэширования паролей переполнена"""
+    pass
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(password: bytes, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed_password)
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """Возвращает cost factor, с которым был получен хэш вида $2b$12$..."""
+    return int(hashed_password.split(b"$")[2])
+
+
+class PasswordHasher:
+    """Выполняет bcrypt в отдельном пуле процессов, чтобы хэширование не занимало
+    ни цикл событий, ни пул потоков обработчиков запросов. Число одновременно
+    принятых задач ограничено: при переполнении выбрасывается HashingOverloaded,
+    а не растет очередь ожидания"""
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        self.rounds = rounds
+        self.__workers = workers
+        self.__max_pending = max_pending
+        # Счетчик меняется только из цикла событий, поэтому блокировка не нужна
+        self.__pending = 0
+        self.__executor: Optional[ProcessPoolExecutor] = None
+
+    async def hash(self, password: str) -> bytes:
+        return await self.__run(_hash, password.encode("utf-8"), self.rounds)
+
+    async def check(self, password: str, hashed_password: bytes) -> bool:
+        return await self.__run(_check, password.encode("utf-8"), hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """Хэш получен с другим cost factor и должен быть пересчитан"""
+        return hash_rounds(hashed_password) != self.rounds
+
+    async def __run(self, fn, *args):
+        if self.__pending >= self.__max_pending:
+            raise HashingOverloaded("Слишком много одновременных запросов, повторите позже")
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(max_workers=self.__workers)
+        self.__pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, fn, *args)
+        finally:
+            self.__pending -= 1
+
+    def close(self) -> None:
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+            self.__executor = None
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    settings = get_settings()
+    return PasswordHasher(
+        workers=settings.BCRYPT_WORKERS,
+        max_pending=settings.BCRYPT_MAX_PENDING,
+        rounds=settings.BCRYPT_ROUNDS,
+    )
@@ -1,15 +1,25 @@
+from datetime import datetime, timedelta
+import asyncio
 import json
-import pika
-from typing import Optional
+import logging
+import uuid
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
 
+from app.database.config import get_settings
+from app.database.database import async_session_maker
+from app.models.Transaction import Transaction
 from app.models.User import User
-from rabbitmq.settings import RabbitMQSettings
+from app.mqpublisher import get_publisher
 from app.Balance import Balance, BalanceError
+from app.HoldStatus import HoldStatus
 from app.ML import ML
 from app.MLstatus import MLstatus
 from app.MLhistory import MLhistory
 from app.Prediction import Prediction
 
+logger = logging.getLogger(__name__)
+
 
 class MLWorkerProxy:
     """Класс, обеспечивающий отправку взаимодействие с воркером, а также выполняющий
@@ -17,54 +27,206 @@ class MLWorkerProxy:
     запросов"""
 
     def publish_to_mq(self, body):
-        QUEUE_NAME = "queries_queue"
-        connection = pika.BlockingConnection(
-            self.__rabbitmq_settings.connection_parameters
-        )
-        channel = connection.channel()
-        channel.queue_declare(queue=QUEUE_NAME, durable=True)
-        channel.basic_publish(
-            exchange="",
-            routing_key=QUEUE_NAME,
-            body=body,
-            properties=pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent),
-        )
-        connection.close()
-
-    def send(self, user: User, query: ML) -> None:
+        """Публикует задачу в очередь через общий для процесса канал"""
+        get_publisher().publish(body)
+
+    def publish_batch_to_mq(self, bodies: List[str]):
+        """Публикует несколько задач в очередь через общий для процесса канал"""
+        get_publisher().publish_batch(bodies)
+
+    async def send(self, user: User, query: ML) -> None:
         """Отправляет запрос на исполнение воркеру. Предварительно проверяет есть ли
         у пользователя достаточно денег на счету (если нет - выбрасывается исключение
-        BalanceError) и вносит запись в журнал запросов со статусом WAITING"""
-        if self.__balance[user] < query.price:
-            raise BalanceError("Недостаточно денег на балансе для выполнения запроса!")
-        query_log_item = self.__query_log_handler.add_new(user, query)
-        body = json.dumps({"query_log_id": query_log_item.id, "query_text": query.text})
-        self.publish_to_mq(body)
-
-    def recieve(
-        self, query_log_id: int, status: MLstatus, result: Optional[Prediction] = None
+        BalanceError) и вносит запись в журнал запросов со статусом WAITING.
+        Стоимость запроса резервируется в той же транзакции БД, что и запись журнала.
+        Резерв выполняется первым: при недостатке средств в БД ничего не записано,
+        и сессию не нужно откатывать"""
+        await self.__balance.reserve(user, query.price)
+        try:
+            query_log_item = await self.__query_log_handler.add_new(user, query)
+            await self.__balance.add_holds(user, [(query_log_item.id, query.price)])
+            await self.__session.commit()
+        except Exception:
+            await self.__session.rollback()
+            raise
+        body = json.dumps({"task_id": query_log_item.id, "question": query.text})
+        # Публикация через pika блокирующая, поэтому выполняется в пуле потоков
+        try:
+            await run_in_threadpool(self.publish_to_mq, body)
+        except Exception:
+            await self.__abandon([query_log_item.id])
+            raise
+
+    async def send_batch(self, user: User, queries: List[ML]) -> Tuple[str, List[int]]:
+        """Отправляет пакет запросов воркеру. Общая стоимость пакета резервируется
+        одним условным UPDATE, записи журнала добавляются одним INSERT, а сообщения
+        публикуются через один канал с подтверждениями. Возвращает id пакета,
+        по которому отслеживается его выполнение, и id записей журнала"""
+        batch_id = uuid.uuid4().hex
+        await self.__balance.reserve(user, sum(query.price for query in queries))
+        try:
+            query_log_ids = await self.__query_log_handler.add_batch(user, queries, batch_id)
+            await self.__balance.add_holds(
+                user,
+                [(query_log_id, query.price) for query_log_id, query in zip(query_log_ids, queries)],
+            )
+            await self.__session.commit()
+        except Exception:
+            await self.__session.rollback()
+            raise
+        bodies = [
+            json.dumps({"task_id": query_log_id, "question": query.text})
+            for query_log_id, query in zip(query_log_ids, queries)
+        ]
+        try:
+            await run_in_threadpool(self.publish_batch_to_mq, bodies)
+        except Exception:
+            await self.__abandon(query_log_ids)
+            raise
+        return batch_id, query_log_ids
+
+    async def __abandon(self, query_log_ids: List[int]) -> None:
+        """Снимает резервы и отменяет запросы, которые не удалось опубликовать"""
+        for query_log_id in query_log_ids:
+            await self.__balance.release(query_log_id)
+            await self.__query_log_handler.cancel(query_log_id)
+
+    async def recieve(
+        self,
+        query_log_id: int,
+        status: MLstatus,
+        result: Optional[Prediction] = None,
+        generated_title: Optional[str] = None,
     ) -> None:
         """Обрабатывает данные, полученные от воркера"""
         if status == MLstatus.RUNNING:
-            self.__query_log_handler.update(query_log_id, status)
+            await self.__query_log_handler.update(query_log_id, status)
         elif status == MLstatus.COMPLETED:
-            query_log_item = self.__query_log_handler.get_by_id(query_log_id)
-            user = query_log_item.user
-            query = ML(query_log_item.query_text)
-            # Здесь снова проверяем баланс, так как после отправки запроса пользователем
-            # и до получения результата от воркера пользователем могли быть сделаны другие
-            # запросы и баланс стал меньше необходимого. В этом случае будем считать
-            # запрос отмененным (у него будет установлен статус CANCELED)
-            if self.__balance[user] < query.price:
-                self.__query_log_handler.cancel(query_log_id)
+            query_log_item = await self.__query_log_handler.get_by_id(query_log_id)
+            if query_log_item.status in (MLstatus.COMPLETED, MLstatus.CANCELED):
+                # Повторная доставка результата или результат отмененного запроса
+                logger.info(f"Результат задачи {query_log_id} уже не требуется, пропускаем")
+                return
+            hold_status = await self.__balance.hold_status(query_log_id)
+            if hold_status is None:
+                # Запрос отправлен до появления резервов
+                transaction = await self.__pay_without_hold(query_log_item)
+            elif hold_status == HoldStatus.ACTIVE:
+                # Стоимость была зарезервирована при отправке запроса, поэтому списание
+                # резерва не требует проверки баланса и не может завершиться неудачей.
+                # Если резерв успел списать или снять параллельный запрос, capture вернет None
+                transaction = await self.__balance.capture(query_log_item.user, query_log_id)
+            else:
+                # CAPTURED - результат уже применен; RELEASED - запрос отменен
+                # по таймауту и деньги возвращены, поздний результат отбрасывается
+                logger.info(f"Резерв задачи {query_log_id} уже {hold_status.name}, пропускаем")
+                transaction = None
+            if transaction is None:
                 return
-            transaction = self.__balance.pay(user, query.price)
-            self.__query_log_handler.update(query_log_id, status, result, transaction)
+            try:
+                # Списание резерва фиксируется вместе с изменением статуса запроса
+                if not await self.__query_log_handler.update(
+                    query_log_id, status, result, transaction, generated_title=generated_title
+                ):
+                    await self.__session.rollback()
+            except Exception:
+                await self.__session.rollback()
+                raise
+
+        elif status == MLstatus.CANCELED:
+            await self.__balance.release(query_log_id)
+            await self.__query_log_handler.cancel(query_log_id)
+
+    async def recieve_batch(self, results: List[Tuple[int, str]]) -> Tuple[List[int], List[int]]:
+        """Обрабатывает пакет результатов от воркера: резервы списываются, а записи
+        журнала обновляются в одной транзакции БД. Обработка идемпотентна: результаты
+        уже выполненных или отмененных запросов пропускаются без повторного списания.
+        Возвращает id задач, которых нет в журнале, и id задач, результат которых
+        не удалось применить (их воркер может отправить повторно)"""
+        titles = dict(results)
+        statuses = await self.__query_log_handler.get_statuses(list(titles))
+        pending = [
+            query_log_id for query_log_id, status in statuses.items()
+            if status in (MLstatus.WAITING, MLstatus.RUNNING)
+        ]
+        try:
+            transactions = await self.__balance.capture_batch(pending)
+            query_log_items = await self.__query_log_handler.complete_batch(
+                {
+                    query_log_id: (titles[query_log_id], transaction)
+                    for query_log_id, transaction in transactions.items()
+                }
+            )
+            await self.__session.commit()
+        except Exception:
+            await self.__session.rollback()
+            raise
+        await self.__query_log_handler.notify(query_log_items)
+
+        # Запросы без активного резерва обрабатываются по одному, как и раньше.
+        # Ошибка в одном из них не должна приводить к повторной отправке всего пакета
+        skipped = [query_log_id for query_log_id in titles if query_log_id not in statuses]
+        failed = []
+        for query_log_id in pending:
+            if query_log_id in transactions:
+                continue
+            try:
+                await self.recieve(
+                    query_log_id, MLstatus.COMPLETED, generated_title=titles[query_log_id]
+                )
+            except ValueError:
+                skipped.append(query_log_id)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке результата задачи {query_log_id}: {e}")
+                failed.append(query_log_id)
+        return skipped, failed
+
+    async def __pay_without_hold(self, query_log_item) -> Optional[Transaction]:
+        """Оплачивает запрос, под который нет активного резерва (запрос отправлен
+        до появления резервов или резерв снят по таймауту). Если денег не хватило,
+        запрос считается отмененным (у него будет установлен статус CANCELED)"""
+        # Для записей, созданных до появления колонки price, цена вычисляется по тексту
+        query_log_id = query_log_item.id
+        price = query_log_item.price
+        if price is None:
+            price = ML(query_log_item.query_text).price
+        try:
+            return await self.__balance.pay(query_log_item.user, price)
+        except BalanceError:
+            await self.__query_log_handler.cancel(query_log_id)
+            return None
+
+    async def expire_holds(self, timeout: float) -> int:
+        """Снимает резервы запросов, не выполненных за timeout секунд, и отменяет
+        сами запросы. Возвращает количество отмененных запросов"""
+        expired = await self.__balance.expired_holds(datetime.now() - timedelta(seconds=timeout))
+        canceled = 0
+        for query_log_id in expired:
+            if await self.__balance.release(query_log_id):
+                await self.__query_log_handler.cancel(query_log_id)
+                canceled += 1
+        return canceled
 
     def __init__(
         self,
         session,
     ):
+        self.__session = session
         self.__balance = Balance(session)
         self.__query_log_handler = MLhistory(session)
-        self.__rabbitmq_settings = RabbitMQSettings()
+
+
+async def sweep_expired_holds() -> None:
+    """Периодически отменяет запросы, результат которых не пришел за HOLD_TIMEOUT,
+    и снимает их резервы. Снятие резерва условно, поэтому одновременная работа
+    нескольких процессов API безопасна"""
+    settings = get_settings()
+    while True:
+        await asyncio.sleep(settings.HOLD_SWEEP_INTERVAL)
+        try:
+            async with async_session_maker() as session:
+                canceled = await MLWorkerProxy(session).expire_holds(settings.HOLD_TIMEOUT)
+            if canceled:
+                logger.warning(f"Отменено запросов по таймауту: {canceled}")
+        except Exception as e:
+            logger.error(f"Ошибка при снятии просроченных резервов: {e}")
@@ -0,0 +1,20 @@
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class AccountBalance(Base):
+    """Класс, представляющий таблицу с текущими балансами пользователей. Строка
+    обновляется в одной транзакции БД с каждой записью в таблицу transaction
+    (операции необходимо выполнять посредством класса Balance), поэтому текущий
+    баланс читается одним поиском по первичному ключу"""
+
+    __tablename__ = "account_balance"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    balance: Mapped[Decimal]  # Текущий остаток на счету
+    held: Mapped[Decimal] = mapped_column(default=Decimal(0))  # Сумма активных резервов
+    updated_at: Mapped[datetime]
@@ -0,0 +1,29 @@
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+
+from app.HoldStatus import HoldStatus
+from app.models.base import Base
+
+
+class BalanceHold(Base):
+    """Класс, представляющий таблицу резервов средств под запросы к ML модели.
+    Резерв создается при отправке запроса, а при его выполнении списывается или
+    снимается. Сумма активных резервов пользователя хранится в account_balance.held
+    и меняется в одной транзакции БД с этой таблицей (операции необходимо выполнять
+    посредством класса Balance)"""
+
+    __tablename__ = "balance_hold"
+    __table_args__ = (
+        Index("ix_balance_hold_status_created_at", "status", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    mllog_id: Mapped[int] = mapped_column(ForeignKey("mllog.id"), unique=True)
+    amount: Mapped[Decimal]
+    status: Mapped[HoldStatus] = mapped_column(default=HoldStatus.ACTIVE)
+    created_at: Mapped[datetime]
+    resolved_at: Mapped[Optional[datetime]]
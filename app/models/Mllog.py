@@ -1,6 +1,7 @@
 from datetime import datetime
+from decimal import Decimal
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.types import JSON
@@ -18,6 +19,12 @@ class Mllog(Base):
     QueryLogHandler)"""
 
     __tablename__ = "mllog"
+    __table_args__ = (
+        Index(
+            "ix_mllog_user_id_query_type_timestamp",
+            "user_id", "query_type", "timestamp", "id",
+        ),
+    )
 
     # Колонки transaction_id и result_json заполняются только после того как от воркера
     # будет получен результата работы модели
@@ -27,7 +34,16 @@ class Mllog(Base):
     transaction_id: Mapped[Optional[int]] = mapped_column(ForeignKey("transaction.id"))
     timestamp: Mapped[datetime]
     query_text: Mapped[str]
+    query_type: Mapped[str] = mapped_column(default="title_generation")
+    price: Mapped[Optional[Decimal]]  # Стоимость запроса, рассчитанная при его создании
+    confidence_score: Mapped[Optional[float]]
+    generated_title: Mapped[Optional[str]]  # Заголовок, полученный от воркера
+    batch_id: Mapped[Optional[str]] = mapped_column(index=True)  # Пакет, в составе которого отправлен запрос
     status: Mapped[MLstatus]
+    started_at: Mapped[Optional[datetime]]  # Время начала обработки воркером
+    completed_at: Mapped[Optional[datetime]]  # Время выполнения или отмены запроса
+    error_message: Mapped[Optional[str]]  # Причина отмены запроса
+    model_version: Mapped[Optional[str]]  # Версия модели, сгенерировавшей заголовок
     result_dict: Mapped[Optional[Dict[str, float]]] = mapped_column(
         JSON().with_variant(JSONB, "postgresql")
     )
@@ -0,0 +1,24 @@
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class MllogDailyStats(Base):
+    """Класс, представляющий таблицу с предварительно агрегированной по дням
+    статистикой запросов пользователей. Счетчики увеличиваются в одной транзакции БД
+    с изменениями журнала запросов (операции необходимо выполнять посредством класса
+    MLhistory), поэтому статистика за любой период читается без обращения к mllog"""
+
+    __tablename__ = "mllog_daily_stats"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    query_type: Mapped[str] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    total_queries: Mapped[int] = mapped_column(default=0)
+    completed: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+    total_cost: Mapped[Decimal] = mapped_column(default=Decimal(0))
+    confidence_sum: Mapped[float] = mapped_column(default=0.0)
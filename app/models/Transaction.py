@@ -1,6 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.models.base import Base
@@ -12,6 +12,10 @@ class Transaction(Base):
     и их валидацию необходимо выполнять посредством класса Balance)"""
 
     __tablename__ = "transaction"
+    __table_args__ = (
+        Index("ix_transaction_user_id_id", "user_id", "id"),
+        Index("ix_transaction_user_id_timestamp", "user_id", "timestamp", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
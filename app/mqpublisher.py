@@ -0,0 +1,111 @@
+from functools import lru_cache
+from typing import Iterable, Optional
+import logging
+import threading
+
+import pika
+from pika.adapters.blocking_connection import BlockingChannel
+
+from rabbitmq.settings import get_rabbitmq_settings
+
+logger = logging.getLogger(__name__)
+
+# Очередь задач, которую слушает MLWorker
+QUEUE_NAME = "ml_task_queue"
+
+
+class MQPublisher:
+    """Долгоживущий издатель сообщений в очередь задач. Держит одно соединение и
+    канал на процесс, объявляет очередь один раз при подключении и переподключается
+    при разрыве соединения. Канал работает в режиме подтверждений публикации
+    (publisher confirms), поэтому publish() возвращает управление только после того,
+    как брокер принял сообщение"""
+
+    def __init__(
+        self,
+        connection_parameters: pika.ConnectionParameters,
+        queue_name: str = QUEUE_NAME,
+        max_attempts: int = 2,
+    ):
+        self.__connection_parameters = connection_parameters
+        self.__queue_name = queue_name
+        self.__max_attempts = max_attempts
+        self.__connection: Optional[pika.BlockingConnection] = None
+        self.__channel: Optional[BlockingChannel] = None
+        # BlockingConnection не потокобезопасен, а синхронные эндпоинты FastAPI
+        # выполняются в пуле потоков
+        self.__lock = threading.Lock()
+
+    def publish(self, body: str) -> None:
+        """Публикует одно сообщение в очередь задач"""
+        self.publish_batch([body])
+
+    def publish_batch(self, bodies: Iterable[str]) -> None:
+        """Публикует несколько сообщений через один канал. При разрыве соединения
+        переподключается и продолжает с первого неподтвержденного сообщения"""
+        bodies = list(bodies)
+        with self.__lock:
+            published = 0
+            for attempt in range(self.__max_attempts):
+                try:
+                    channel = self.__get_channel()
+                    for body in bodies[published:]:
+                        channel.basic_publish(
+                            exchange="",
+                            routing_key=self.__queue_name,
+                            body=body,
+                            properties=pika.BasicProperties(
+                                delivery_mode=pika.DeliveryMode.Persistent
+                            ),
+                            mandatory=True,
+                        )
+                        published += 1
+                    return
+                except (
+                    pika.exceptions.AMQPConnectionError,
+                    pika.exceptions.AMQPChannelError,
+                ) as e:
+                    logger.error(f"Ошибка публикации в RabbitMQ: {e}")
+                    self.__reset()
+                    if attempt == self.__max_attempts - 1:
+                        raise
+
+    def connect(self) -> None:
+        """Подключается к брокеру и объявляет очередь задач, не дожидаясь первой публикации"""
+        with self.__lock:
+            self.__get_channel()
+
+    def close(self) -> None:
+        """Закрывает соединение с брокером"""
+        with self.__lock:
+            self.__reset()
+
+    def __get_channel(self) -> BlockingChannel:
+        """Возвращает открытый канал, при необходимости переподключаясь"""
+        if self.__connection is not None and self.__connection.is_open:
+            # Соединение простаивает между запросами, поэтому обрабатываем
+            # накопившиеся heartbeat-кадры (или узнаем о разрыве соединения)
+            self.__connection.process_data_events(time_limit=0)
+        if self.__channel is None or not self.__channel.is_open:
+            self.__reset()
+            self.__connection = pika.BlockingConnection(self.__connection_parameters)
+            self.__channel = self.__connection.channel()
+            self.__channel.confirm_delivery()
+            self.__channel.queue_declare(queue=self.__queue_name, durable=True)
+        return self.__channel
+
+    def __reset(self) -> None:
+        """Закрывает текущее соединение, не обращая внимания на ошибки"""
+        try:
+            if self.__connection is not None and self.__connection.is_open:
+                self.__connection.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии соединения с RabbitMQ: {e}")
+        self.__connection = None
+        self.__channel = None
+
+
+@lru_cache()
+def get_publisher() -> MQPublisher:
+    """Возвращает общий для процесса экземпляр MQPublisher"""
+    return MQPublisher(get_rabbitmq_settings().connection_parameters)
@@ -0,0 +1,146 @@
+import asyncio
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Set
+import json
+import logging
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractIncomingMessage, AbstractRobustConnection
+
+from app.database.config import get_settings
+from rabbitmq.settings import get_rabbitmq_settings
+
+logger = logging.getLogger(__name__)
+
+# Fanout exchange, через который события расходятся по всем процессам API
+EVENTS_EXCHANGE_NAME = "ml_events"
+
+
+class Notifier:
+    """Внутрипроцессный pub/sub событий пользователей. Каждое подключение клиента
+    получает свою ограниченную очередь; если клиент не успевает читать, старые
+    события вытесняются новыми, а публикующий код никогда не ждет.
+
+    Если задан мост (bridge), события публикуются через брокер и доставляются
+    подписчикам всех процессов API, в том числе текущего"""
+
+    def __init__(self, queue_size: int = 100, bridge: Optional["RabbitMQBridge"] = None):
+        self.__queue_size = queue_size
+        self.__subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self.__bridge = bridge
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.__queue_size)
+        self.__subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        subscribers = self.__subscribers.get(user_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.__subscribers[user_id]
+
+    async def publish(self, user_id: int, event: Dict[str, Any]) -> None:
+        """Отправляет событие подписчикам пользователя. Ошибки доставки только
+        логируются: уведомление не должно срывать операцию, которая его вызвала"""
+        if self.__bridge is not None:
+            try:
+                await self.__bridge.publish(user_id, event)
+                return
+            except Exception as e:
+                logger.error(f"Не удалось опубликовать событие через брокер: {e}")
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id: int, event: Dict[str, Any]) -> None:
+        """Кладет событие в очереди подписчиков пользователя в текущем процессе"""
+        for queue in self.__subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def start(self) -> None:
+        """Подключает мост к брокеру, чтобы получать события других процессов
+        еще до первой собственной публикации"""
+        if self.__bridge is None:
+            return
+        try:
+            await self.__bridge.connect()
+        except Exception as e:
+            logger.error(f"Не удалось подключиться к брокеру событий: {e}")
+
+    async def close(self) -> None:
+        if self.__bridge is not None:
+            await self.__bridge.close()
+
+
+class RabbitMQBridge:
+    """Связывает экземпляры Notifier разных процессов через fanout exchange:
+    каждый процесс читает эксклюзивную очередь, привязанную к exchange, и передает
+    полученные события своему Notifier"""
+
+    def __init__(self, url: str, exchange_name: str = EVENTS_EXCHANGE_NAME):
+        self.__url = url
+        self.__exchange_name = exchange_name
+        self.__notifier: Optional[Notifier] = None
+        self.__connection: Optional[AbstractRobustConnection] = None
+        self.__channel: Optional[AbstractChannel] = None
+        self.__exchange: Optional[AbstractExchange] = None
+        self.__lock: Optional[asyncio.Lock] = None
+
+    def attach(self, notifier: Notifier) -> None:
+        self.__notifier = notifier
+
+    async def publish(self, user_id: int, event: Dict[str, Any]) -> None:
+        await self.connect()
+        body = json.dumps({"user_id": user_id, "event": event}, default=str).encode()
+        await self.__exchange.publish(aio_pika.Message(body=body), routing_key="")
+
+    async def connect(self) -> None:
+        """Подключается к брокеру и начинает получать события других процессов"""
+        if self.__exchange is not None:
+            return
+        # Блокировка создается внутри цикла событий, в котором будет использоваться
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            if self.__exchange is not None:
+                return
+            connection = await aio_pika.connect_robust(self.__url)
+            channel = await connection.channel()
+            exchange = await channel.declare_exchange(
+                self.__exchange_name, aio_pika.ExchangeType.FANOUT
+            )
+            queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+            await queue.bind(exchange)
+            await queue.consume(self.__on_message, no_ack=True)
+            self.__connection = connection
+            self.__channel = channel
+            self.__exchange = exchange
+
+    async def __on_message(self, message: AbstractIncomingMessage) -> None:
+        data = json.loads(message.body)
+        if self.__notifier is not None:
+            self.__notifier.deliver(data["user_id"], data["event"])
+
+    async def close(self) -> None:
+        if self.__connection is not None:
+            await self.__connection.close()
+        self.__connection = None
+        self.__channel = None
+        self.__exchange = None
+
+
+@lru_cache()
+def get_notifier() -> Notifier:
+    """Возвращает общий для процесса Notifier. При NOTIFICATIONS_BACKEND=rabbitmq
+    события доставляются подписчикам во всех процессах API"""
+    settings = get_settings()
+    bridge = None
+    if settings.NOTIFICATIONS_BACKEND == "rabbitmq":
+        bridge = RabbitMQBridge(get_rabbitmq_settings().amqp_url)
+    notifier = Notifier(settings.NOTIFICATIONS_QUEUE_SIZE, bridge)
+    if bridge is not None:
+        bridge.attach(notifier)
+    return notifier
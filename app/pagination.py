@@ -0,0 +1,31 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+# Размер страницы истории по умолчанию и максимально допустимый
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Заголовок ответа, в котором передается курсор следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class IncorrectCursor(Exception):
+    """Исключение для курсора, который не удалось разобрать"""
+    pass
+
+
+def encode_cursor(timestamp: datetime, id: int) -> str:
+    """Формирует непрозрачный курсор по ключу (timestamp, id) последней записи
+    страницы"""
+    raw = f"{timestamp.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Разбирает курсор, сформированный encode_cursor"""
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(id)
+    except Exception:
+        raise IncorrectCursor("Некорректный курсор страницы")
@@ -0,0 +1,79 @@
+from concurrent.futures import Future
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import hashlib
+import threading
+
+from app.cache import LRUCache
+from app.database.config import get_settings
+from app.ML import ML, IncorrectML
+
+# Результат расчета: цена или текст ошибки валидации (ошибки тоже детерминированы
+# и кэшируются наравне с ценами)
+PriceResult = Tuple[Optional[Decimal], Optional[str]]
+
+
+def price_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def price_etag(price: Decimal) -> str:
+    """ETag ответа с ценой: совпадает у всех текстов с одинаковой ценой"""
+    return '"' + hashlib.sha256(str(price).encode()).hexdigest()[:16] + '"'
+
+
+class PriceCache:
+    """Кэш цен запросов по хэшу текста. Одновременные запросы с одинаковым текстом
+    объединяются: цену считает первый из них, остальные ждут его результата"""
+
+    def __init__(self, maxsize: int):
+        self.__cache: LRUCache[PriceResult] = LRUCache(maxsize=maxsize)
+        self.__in_flight: Dict[str, Future] = {}
+        self.__lock = threading.Lock()
+        self.coalesced = 0
+
+    def get(self, text: str) -> PriceResult:
+        key = price_key(text)
+        result = self.__cache.get(key)
+        if result is not None:
+            return result
+
+        with self.__lock:
+            future = self.__in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.__in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self.__compute(text)
+            self.__cache.put(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.__lock:
+                del self.__in_flight[key]
+
+    @staticmethod
+    def __compute(text: str) -> PriceResult:
+        try:
+            return ML(text).price, None
+        except IncorrectML as iq:
+            return None, str(iq)
+
+    def stats(self) -> dict:
+        stats = self.__cache.stats()
+        stats["coalesced"] = self.coalesced
+        return stats
+
+
+@lru_cache()
+def get_price_cache() -> PriceCache:
+    return PriceCache(get_settings().PRICE_CACHE_SIZE)
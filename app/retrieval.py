@@ -0,0 +1,69 @@
+import asyncio
+from functools import lru_cache
+import hashlib
+import logging
+
+from app.cache import LRUCache
+from app.database.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def _docs_to_text(docs_obj) -> str:
+    """Приводит результат ретривера к строке контекста для промпта"""
+    if isinstance(docs_obj, (list, tuple)):
+        return "\n\n".join(getattr(d, "page_content", None) or str(d) for d in docs_obj)
+    return str(docs_obj)
+
+
+class ContextRetriever:
+    """Асинхронное получение контекста для генерации заголовка с LRU кэшем по хэшу
+    текста и ограничением времени ожидания векторного хранилища"""
+
+    def __init__(self, retriever, cache_size: int = 1024, timeout: float = 2.0):
+        self.__retriever = retriever
+        self.__timeout = timeout
+        self.__cache: LRUCache[str] = LRUCache(cache_size)
+
+    async def aget_context(self, abstract: str) -> str:
+        """Возвращает контекст для текста. Если хранилище недоступно или не ответило
+        за отведенное время, возвращает пустую строку (генерация работает и без
+        контекста), при этом результат не кэшируется"""
+        if self.__retriever is None:
+            return ""
+        key = hashlib.sha256(abstract.encode("utf-8")).hexdigest()
+        docs = self.__cache.get(key)
+        if docs is not None:
+            return docs
+        try:
+            docs_obj = await asyncio.wait_for(
+                self.__retriever.ainvoke(abstract), self.__timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Ретривер не ответил за {self.__timeout} с, контекст не используется")
+            return ""
+        except Exception as e:
+            logger.warning(f"Ошибка ретривера, контекст не используется: {e}")
+            return ""
+        docs = _docs_to_text(docs_obj)
+        self.__cache.put(key, docs)
+        return docs
+
+    def cache_stats(self) -> dict:
+        return self.__cache.stats()
+
+
+@lru_cache()
+def get_context_retriever() -> ContextRetriever:
+    """Возвращает общий для процесса экземпляр ContextRetriever"""
+    settings = get_settings()
+    # Векторное хранилище подключается только при первом обращении и необязательно:
+    # без него (например, в тестах и нагрузочном тесте) генерация работает без контекста
+    try:
+        from app.vectordb import retriever
+    except ImportError as e:
+        logger.warning(f"Векторное хранилище недоступно, контекст не используется: {e}")
+        retriever = None
+    return ContextRetriever(
+        retriever, settings.RETRIEVAL_CACHE_SIZE, settings.RETRIEVAL_TIMEOUT
+    )
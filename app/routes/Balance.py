@@ -1,23 +1,33 @@
 from datetime import date
 from decimal import Decimal
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
 
 from app.auth import access_token_user
-from app.database.database import get_session
+from app.database.database import get_async_session
 from app.Balance import Balance, BalanceError
+from app.export import EXPORT_FORMATS, aencode_rows
 from app.models.User import User
+from app.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    IncorrectCursor,
+    decode_cursor,
+    encode_cursor,
+)
 from app.shemas.Transactiondata import TransactionData
 
 balance_router = APIRouter()
 
 
 @balance_router.get("/", summary="Возвращает текущий баланс пользователя")
-def get_current_balance(
-    user: User = Depends(access_token_user), session=Depends(get_session)
+async def get_current_balance(
+    user: User = Depends(access_token_user), session=Depends(get_async_session)
 ) -> Decimal:
     balance = Balance(session)
-    return balance[user].quantize(Decimal("0.01"))
+    return (await balance[user]).quantize(Decimal("0.01"))
 
 
 @balance_router.get(
@@ -25,27 +35,67 @@ def get_current_balance(
     response_model=List[TransactionData],
     summary="Возвращает историю транзакций пользователя",
 )
-def get_transactions_history(
+async def get_transactions_history(
+    response: Response,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user: User = Depends(access_token_user),
+    session=Depends(get_async_session),
+):
+    # Если записей больше, чем помещается на страницу, курсор следующей страницы
+    # возвращается в заголовке ответа
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except IncorrectCursor as ic:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(ic))
+    balance = Balance(session)
+    transactions = await balance.transactions_history(
+        user, start_date, end_date, after, limit
+    )
+    if len(transactions) == limit:
+        last = transactions[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.timestamp, last.id)
+    return transactions
+
+
+@balance_router.get(
+    "/history/export",
+    summary="Выгружает всю историю транзакций пользователя в NDJSON или CSV",
+)
+async def export_transactions_history(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
     user: User = Depends(access_token_user),
-    session=Depends(get_session),
+    session=Depends(get_async_session),
 ):
+    # Строки читаются из серверного курсора и кодируются по одной по мере отправки,
+    # поэтому расход памяти не зависит от длины истории. Сессия закрывается
+    # после отправки ответа
     balance = Balance(session)
-    return balance.transactions_history(user, start_date, end_date)
+    rows = balance.stream_transactions_history(user, start_date, end_date)
+    return StreamingResponse(
+        aencode_rows(rows, ["id", "timestamp", "amount", "balance"], format),
+        media_type=EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="transactions.{format}"'
+        },
+    )
 
 
 @balance_router.post(
     "/replenish", summary="Пополняет баланс пользователя на заданную сумму"
 )
-def replenish_balance(
+async def replenish_balance(
     amount: int,
     user: User = Depends(access_token_user),
-    session=Depends(get_session),
+    session=Depends(get_async_session),
 ):
     balance = Balance(session)
     try:
-        balance.replenish(user, Decimal(amount))
-        return balance[user]
+        transaction = await balance.replenish(user, Decimal(amount))
+        return transaction.balance
     except BalanceError as be:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, str(be))
@@ -1,24 +1,47 @@
 from datetime import date
 from decimal import Decimal
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Literal, Optional
+import asyncio
 import json
+import logging
 import os
+import time
 
-from app.auth import access_token_user
-from app.database.database import get_session
+from app.auth import access_token_user, worker_access
+from app.Balance import BalanceError
+from app.database.config import get_settings
+from app.database.database import get_async_session
+from app.export import EXPORT_FORMATS, aencode_rows
 from app.ML import ML, IncorrectML
 from app.MLstatus import MLstatus
 from app.mlworkerproxy import MLWorkerProxy
 from app.models.User import User
 from app.MLhistory import MLhistory
 from app.Prediction import Prediction
-from app.shemas.Mllogdata import MLlogdata
+from app.notifications import get_notifier
+from app.pricing import get_price_cache, price_etag
+from app.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    IncorrectCursor,
+    decode_cursor,
+    encode_cursor,
+)
+from app.shemas.Mlbatchdata import MLbatchdata, MLbatchprogressdata, MLbatchsubmitdata
+from app.shemas.Mllogdata import MLlogdata, MLloghistorydata
 from app.shemas.Mllogupdatedata import MLlogupdatedata
+from app.shemas.Mlpricedata import MLpricedata
+from app.shemas.Mltaskresultdata import MLtaskresultdata
+from app.shemas.Mlstatsdata import MLdailystatsdata, MLstatsdata
 from app.Admin import Admin, UserNotFound
-from langchain.prompts.chat import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from app.vectordb import retriever
+from app.rpcclient import RPCError, RPCTimeout, RPCUnavailable, get_rpc_client
+from app.retrieval import get_context_retriever
+from app.titlechain import get_title_chain
+
+logger = logging.getLogger(__name__)
 
 ml_router = APIRouter()
 
@@ -26,76 +49,342 @@ ml_router = APIRouter()
 
 
 @ml_router.post("/generate-title")
-def generate_title(req: MLlogdata):
-    # Импорты предполагаются выше:
-    # from langchain_core.prompts import ChatPromptTemplate
-    # from langchain_community.llms import Ollama as OllamaLLM
-    # (или ваша конкретная обёртка для OllamaLLM)
-
-    model = OllamaLLM(model="mistral:7b-instruct")
-
-    # Чёткие placeholder'ы под передаваемые переменные:
-    template = """You are an expert in generating good titles for research papers.
-Generate a {style}, {title_length} title from the user's abstract.
----
-context: {docs}
----
-Here is the abstract from the user: {abstract}
----
-Output ONLY the generated title and nothing else.
-Title: """
-
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
-
-    # Безопасно получаем контекст
+async def generate_title(req: MLlogdata, response: Response):
+    # По умолчанию генерация выполняется RPC воркером: запрос уходит в rpc_queue,
+    # а обработчик ждет ответа, не занимая поток и не блокируя цикл событий
+    if get_settings().TITLE_GENERATION_BACKEND == "rpc":
+        return await _generate_title_rpc(req, response)
+    return await _generate_title_locally(req, response)
+
+
+def _set_server_timing(response: Response, timings: Dict[str, float]) -> None:
+    """Возвращает время этапов генерации заголовка в заголовке Server-Timing"""
+    response.headers["Server-Timing"] = ", ".join(
+        f"{stage};dur={duration * 1000:.1f}" for stage, duration in timings.items()
+    )
+    logger.info(f"generate-title timings: {timings}")
+
+
+async def _generate_title_rpc(req: MLlogdata, response: Response):
+    """Генерирует заголовок RPC воркером. Время этапов (получение контекста,
+    публикация, ожидание ответа и его разбор) возвращается в заголовке Server-Timing"""
+    started = time.perf_counter()
+    # Воркеру передаются те же параметры, что использует локальная генерация
+    context = await get_context_retriever().aget_context(req.abstract)
+    retrieved = time.perf_counter()
+    payload = json.dumps(
+        {
+            "abstract": req.abstract,
+            "style": req.style,
+            "title_length": req.title_length,
+            "context": context,
+        },
+        ensure_ascii=False,
+    )
+    timings = {"retrieval": retrieved - started}
     try:
-        docs_obj = retriever.invoke(req.abstract)  # если retriever есть
-        # Нормализуем в строку
-        if isinstance(docs_obj, (list, tuple)):
-            docs = "\n\n".join(str(d) for d in docs_obj)
-        else:
-            docs = str(docs_obj)
-    except Exception:
-        docs = ""  # работаем и без ретривера
-
-    # <-- ВАЖНО: передаём ВСЕ переменные из шаблона
-    output = chain.invoke({
-        "docs": docs,
-        "abstract": req.abstract,
-        "style": getattr(req, "style", "concise"),
-        "title_length": getattr(req, "title_length", "short"),
-    })
-
-    title = str(output).strip()
-    # Если LLM вдруг вернул префикс 'Title:'
-    if "Title:" in title:
-        title = title.split("Title:", 1)[-1].strip()
+        title = await get_rpc_client().call(payload, timings=timings)
+    except RPCTimeout as rt:
+        raise HTTPException(status.HTTP_504_GATEWAY_TIMEOUT, str(rt))
+    except RPCUnavailable as ru:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, str(ru))
+    except RPCError as rpc_error:
+        raise HTTPException(status.HTTP_502_BAD_GATEWAY, str(rpc_error))
+    timings["total"] = time.perf_counter() - started
+    _set_server_timing(response, timings)
+    return {"title": title.strip()}
+
+
+async def _generate_title_locally(req: MLlogdata, response: Response):
+    """Генерирует заголовок моделью, вызываемой прямо из процесса API. Время этапов
+    возвращается в заголовке Server-Timing"""
+    started = time.perf_counter()
+    # Контекст запрашиваем сразу, пока параллельно готовятся остальные данные
+    context_task = asyncio.create_task(get_context_retriever().aget_context(req.abstract))
+    chain = get_title_chain()
+    style = getattr(req, "style", "concise")
+    title_length = getattr(req, "title_length", "short")
+
+    docs = await context_task
+    retrieved = time.perf_counter()
 
+    title = await chain.agenerate(
+        abstract=req.abstract,
+        docs=docs,
+        style=style,
+        title_length=title_length,
+    )
+    generated = time.perf_counter()
+
+    _set_server_timing(
+        response,
+        {
+            "retrieval": retrieved - started,
+            "generation": generated - retrieved,
+            "total": generated - started,
+        },
+    )
     return {"title": title}
 
 
+@ml_router.post("/execute", summary="Отправляет текст на генерацию заголовка воркеру")
+async def execute_query(
+        text: str,
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    try:
+        query = ML(text)
+        await MLWorkerProxy(session).send(user, query)
+    except (IncorrectML, BalanceError) as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+
+@ml_router.post(
+    "/execute/batch",
+    response_model=MLbatchsubmitdata,
+    summary="Отправляет пакет текстов на генерацию заголовков",
+)
+async def execute_queries_batch(
+        batch: MLbatchdata,
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    max_size = get_settings().ML_BATCH_MAX_SIZE
+    if not 0 < len(batch.texts) <= max_size:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, f"Пакет должен содержать от 1 до {max_size} текстов"
+        )
+    # Все тексты проверяются до отправки: пакет принимается целиком или не принимается
+    queries, errors = [], []
+    for i, text in enumerate(batch.texts):
+        try:
+            queries.append(ML(text))
+        except IncorrectML as iq:
+            errors.append(f"Текст {i + 1}: {iq}")
+    if errors:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "; ".join(errors))
+    try:
+        batch_id, task_ids = await MLWorkerProxy(session).send_batch(user, queries)
+    except BalanceError as be:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(be))
+    return {
+        "batch_id": batch_id,
+        "task_ids": task_ids,
+        "total_price": sum(query.price for query in queries),
+    }
+
+
+@ml_router.get(
+    "/batch/{batch_id}",
+    response_model=MLbatchprogressdata,
+    summary="Возвращает ход выполнения пакета запросов",
+)
+async def get_batch_progress(
+        batch_id: str,
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    progress = await MLhistory(session).get_batch_progress(user, batch_id)
+    if not progress["total"]:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Пакет запросов не найден")
+    return {"batch_id": batch_id, **progress}
+
+
+@ml_router.post(
+    "/send_task_result",
+    summary="Принимает результат задачи от воркера",
+    dependencies=[Depends(worker_access)],
+)
+async def send_task_result(
+        task_id: int,
+        result: str,
+        session=Depends(get_async_session),
+):
+    # Эндпоинт вызывается воркером из внутренней сети: вместо токена пользователя
+    # проверяется общий секрет воркера
+    try:
+        await MLWorkerProxy(session).recieve(task_id, MLstatus.COMPLETED, generated_title=result)
+    except ValueError as ve:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, str(ve))
+
+
+@ml_router.post(
+    "/send_task_results",
+    summary="Принимает пакет результатов задач от воркера",
+    dependencies=[Depends(worker_access)],
+)
+async def send_task_results(
+        results: List[MLtaskresultdata],
+        session=Depends(get_async_session),
+):
+    # Эндпоинт вызывается воркером из внутренней сети: вместо токена пользователя
+    # проверяется общий секрет воркера. Весь пакет применяется в одной транзакции БД,
+    # повторно присланные результаты повторно не оплачиваются
+    skipped, failed = await MLWorkerProxy(session).recieve_batch(
+        [(result.task_id, result.result) for result in results]
+    )
+    if skipped:
+        logger.warning(f"Results for unknown tasks skipped: {skipped}")
+    return {
+        "applied": len({result.task_id for result in results}) - len(skipped) - len(failed),
+        "skipped": skipped,
+        "failed": failed,
+    }
+
+
+@ml_router.get("/events", summary="Поток событий об изменении статуса запросов (SSE)")
+async def query_events(
+        request: Request,
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    # Клиент узнает о готовности заголовка из потока событий, а не опрашивая /history.
+    # Соединение с БД на время потока не нужно, поэтому сразу возвращаем его в пул
+    await session.close()
+    notifier = get_notifier()
+    queue = notifier.subscribe(user.id)
+    keepalive = get_settings().NOTIFICATIONS_KEEPALIVE
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    # Комментарий не дает прокси закрыть простаивающее соединение
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+        finally:
+            notifier.unsubscribe(user.id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 @ml_router.get("/price", summary="Возвращает стоимость выполнения запроса")
 def get_query_price(
-        text: str
+        text: str,
+        request: Request,
+        response: Response,
 ) -> Decimal:
-    try:
-        return ML(text).price
-    except IncorrectML as iq:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(iq))
+    # Цена зависит только от текста, поэтому повторные запросы может обслужить
+    # кэш браузера или nginx, а при If-None-Match тело не передается
+    price, error = get_price_cache().get(text)
+    if error is not None:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, error)
+    etag = price_etag(price)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={get_settings().PRICE_CACHE_MAX_AGE}",
+    }
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return price
+
+
+@ml_router.post(
+    "/price/batch",
+    response_model=List[MLpricedata],
+    summary="Возвращает стоимость выполнения запросов для нескольких текстов",
+)
+def get_queries_prices(texts: List[str] = Body(...)):
+    if len(texts) > get_settings().PRICE_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Не более {get_settings().PRICE_BATCH_MAX_SIZE} текстов в одном запросе",
+        )
+    price_cache = get_price_cache()
+    return [
+        MLpricedata(price=price, error=error)
+        for price, error in map(price_cache.get, texts)
+    ]
 
 
 @ml_router.get(
     "/history",
-    response_model=List[MLlogdata],
+    response_model=List[MLloghistorydata],
     summary="Возвращает историю запросов к ML модели",
 )
 async def get_queries_history(
+        response: Response,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        cursor: Optional[str] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    # Если записей больше, чем помещается на страницу, курсор следующей страницы
+    # возвращается в заголовке ответа
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except IncorrectCursor as ic:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(ic))
+    query_log_handler = MLhistory(session)
+    history = await query_log_handler.get_for_user(
+        user, start_date, end_date, cursor=after, limit=limit
+    )
+    if len(history) == limit:
+        last = history[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last["timestamp"], last["id"])
+    return history
+
+
+@ml_router.get(
+    "/stats",
+    response_model=MLstatsdata,
+    summary="Возвращает статистику запросов пользователя за последние дни",
+)
+async def get_queries_stats(
+        days: int = Query(30, ge=1, le=366),
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    query_log_handler = MLhistory(session)
+    return await query_log_handler.get_user_stats(user, days)
+
+
+@ml_router.get(
+    "/stats/daily",
+    response_model=List[MLdailystatsdata],
+    summary="Возвращает статистику запросов пользователя по дням",
+)
+async def get_queries_daily_stats(
+        days: int = Query(30, ge=1, le=366),
+        user: User = Depends(access_token_user),
+        session=Depends(get_async_session),
+):
+    query_log_handler = MLhistory(session)
+    return await query_log_handler.get_daily_stats(user, days)
+
+
+@ml_router.get(
+    "/history/export",
+    summary="Выгружает всю историю запросов к ML модели в NDJSON или CSV",
+)
+async def export_queries_history(
         start_date: Optional[date] = None,
         end_date: Optional[date] = None,
+        format: Literal["ndjson", "csv"] = "ndjson",
         user: User = Depends(access_token_user),
-        session=Depends(get_session),
+        session=Depends(get_async_session),
 ):
+    # Строки читаются из серверного курсора и кодируются по одной по мере отправки,
+    # поэтому расход памяти не зависит от длины истории
     query_log_handler = MLhistory(session)
-    return await query_log_handler.get_for_user(user, start_date, end_date)
\ No newline at end of file
+    rows = query_log_handler.stream_for_user(user, start_date, end_date)
+    fields = [
+        "id", "timestamp", "query_text", "status", "result_dict", "generated_title",
+        "transaction_id", "transaction_amount",
+    ]
+    return StreamingResponse(
+        aencode_rows(rows, fields, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="queries.{format}"'},
+    )
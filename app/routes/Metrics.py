@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+
+from app.auth import worker_access
+from app.database.database import engine
+from app.database.pool import pool_status
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get(
+    "/db-pool",
+    summary="Возвращает состояние и счетчики пула соединений с БД",
+    dependencies=[Depends(worker_access)],
+)
+def get_db_pool_metrics():
+    # Метрики доступны только по токену внутренних сервисов (X-Worker-Token)
+    # Рост wait_p95/timeouts при checked_out == size + overflow означает,
+    # что запросы ждут соединения, а не выполняются в БД
+    return pool_status(engine)
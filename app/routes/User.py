@@ -6,9 +6,10 @@ from app.auth import (
     access_token_user,
     delete_access_token_from_cookie,
 )
-from app.database.database import get_session
+from app.database.database import get_async_session
 from app.models.User import User
 from app.Admin import Admin, IncorectUserData, AuthenticationFail
+from app.hashing import HashingOverloaded
 from app.shemas.Userdata import UserDataForSignin, UserDataForSignup, UserDataForBaseView
 
 user_router = APIRouter()
@@ -17,27 +18,35 @@ user_router = APIRouter()
 @user_router.post(
     "/signup", status_code=status.HTTP_201_CREATED, summary="Регистрирует пользователя"
 )
-def signup(
-    user_data: UserDataForSignup, response: Response, session=Depends(get_session)
+async def signup(
+    user_data: UserDataForSignup, response: Response, session=Depends(get_async_session)
 ):
     users_manager = Admin(session)
     try:
-        new_user = users_manager.signup(**dict(user_data))
+        new_user = await users_manager.signup(**dict(user_data))
         token = create_access_token(new_user)
         add_access_token_to_cookie(token, response)
     except IncorectUserData as iud:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, str(iud))
+    except HashingOverloaded as ho:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS, str(ho), headers={"Retry-After": "1"}
+        )
 
 
 @user_router.post("/signin", summary="Осуществляет аутентификацию пользователя")
-def signin(
-    user_data: UserDataForSignin, response: Response, session=Depends(get_session)
+async def signin(
+    user_data: UserDataForSignin, response: Response, session=Depends(get_async_session)
 ):
     users_manager = Admin(session)
     try:
-        user = users_manager.signin(**dict(user_data))
+        user = await users_manager.signin(**dict(user_data))
     except AuthenticationFail as af:
         raise HTTPException(status.HTTP_403_FORBIDDEN, str(af))
+    except HashingOverloaded as ho:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS, str(ho), headers={"Retry-After": "1"}
+        )
     token = create_access_token(user)
     add_access_token_to_cookie(token, response)
 
@@ -53,5 +62,5 @@ def exit(response: Response):
     response_model=UserDataForBaseView,
     summary="Возвращает данные пользователя для его личной страницы",
 )
-def about_me(user: User = Depends(access_token_user)):
+async def about_me(user: User = Depends(access_token_user)):
     return user
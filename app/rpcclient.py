@@ -0,0 +1,145 @@
+import asyncio
+from functools import lru_cache
+from typing import Dict, Optional
+import logging
+import time
+import uuid
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractRobustConnection
+from aio_pika.exceptions import AMQPError
+
+from app.database.config import get_settings
+from rabbitmq.settings import get_rabbitmq_settings
+
+logger = logging.getLogger(__name__)
+
+# Очередь, которую слушает RPCWorker
+RPC_QUEUE_NAME = "rpc_queue"
+# Заголовок, которым RPC воркер помечает ответ с ошибкой
+RPC_ERROR_HEADER = "x-rpc-error"
+
+
+class RPCTimeout(Exception):
+    """Исключение для случая, когда RPC воркер не ответил за отведенное время"""
+    pass
+
+
+class RPCError(Exception):
+    """Исключение для случая, когда RPC воркер не смог выполнить запрос"""
+    pass
+
+
+class RPCUnavailable(Exception):
+    """Исключение для случая, когда не удалось связаться с брокером сообщений"""
+    pass
+
+
+class RPCClient:
+    """Асинхронный клиент RPC воркера. Все вызовы процесса используют одно
+    соединение и одну эксклюзивную очередь ответов, а ответы сопоставляются
+    с ожидающими вызовами по correlation_id, поэтому одновременно может
+    выполняться сколько угодно вызовов, не блокируя цикл событий"""
+
+    def __init__(self, url: str, queue_name: str = RPC_QUEUE_NAME, timeout: float = 30):
+        self.__url = url
+        self.__queue_name = queue_name
+        self.__timeout = timeout
+        self.__connection: Optional[AbstractRobustConnection] = None
+        self.__channel: Optional[AbstractChannel] = None
+        self.__callback_queue_name: Optional[str] = None
+        self.__futures: Dict[str, asyncio.Future] = {}
+        self.__lock: Optional[asyncio.Lock] = None
+
+    async def call(
+        self,
+        text: str,
+        timeout: Optional[float] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> str:
+        """Отправляет текст RPC воркеру и возвращает его ответ. Если ответ не пришел
+        за timeout секунд (по умолчанию - заданный при создании клиента), выбрасывает
+        исключение RPCTimeout, при ошибке соединения с брокером - RPCUnavailable,
+        а если воркер не смог выполнить запрос - RPCError. Если передан словарь
+        timings, в него записывается время этапов вызова в секундах: publish
+        (подключение и публикация), wait (ожидание ответа) и deserialize"""
+        if timings is None:
+            timings = {}
+        started = time.perf_counter()
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.__futures[correlation_id] = future
+        try:
+            await self.__connect()
+            await self.__channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=text.encode(),
+                    correlation_id=correlation_id,
+                    reply_to=self.__callback_queue_name,
+                ),
+                routing_key=self.__queue_name,
+            )
+            published = time.perf_counter()
+            timings["publish"] = published - started
+            body = await asyncio.wait_for(future, timeout or self.__timeout)
+            received = time.perf_counter()
+            timings["wait"] = received - published
+            result = body.decode()
+            timings["deserialize"] = time.perf_counter() - received
+            return result
+        except asyncio.TimeoutError:
+            raise RPCTimeout("RPC воркер не ответил за отведенное время")
+        except (AMQPError, ConnectionError) as e:
+            logger.error(f"Ошибка соединения с RabbitMQ: {e}")
+            raise RPCUnavailable("Сервис генерации заголовков временно недоступен")
+        finally:
+            self.__futures.pop(correlation_id, None)
+
+    async def close(self) -> None:
+        """Закрывает соединение и отменяет ожидающие вызовы"""
+        for future in self.__futures.values():
+            if not future.done():
+                future.cancel()
+        self.__futures.clear()
+        if self.__connection is not None:
+            await self.__connection.close()
+        self.__connection = None
+        self.__channel = None
+
+    async def __connect(self) -> None:
+        """Подключается к брокеру при первом вызове"""
+        if self.__channel is not None:
+            return
+        # Блокировка создается внутри цикла событий, в котором будет использоваться
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            if self.__channel is not None:
+                return
+            connection = await aio_pika.connect_robust(self.__url)
+            channel = await connection.channel()
+            callback_queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+            await callback_queue.consume(self.__on_response, no_ack=True)
+            self.__connection = connection
+            self.__callback_queue_name = callback_queue.name
+            self.__channel = channel
+
+    async def __on_response(self, message: AbstractIncomingMessage) -> None:
+        """Передает ответ воркера ожидающему его вызову"""
+        future = self.__futures.get(message.correlation_id)
+        if future is None:
+            logger.warning(f"Получен ответ на неизвестный RPC вызов {message.correlation_id}")
+            return
+        if future.done():
+            return
+        if (message.headers or {}).get(RPC_ERROR_HEADER):
+            future.set_exception(RPCError(message.body.decode()))
+        else:
+            # Ответ декодируется в call, где учитывается время этого этапа
+            future.set_result(message.body)
+
+
+@lru_cache()
+def get_rpc_client() -> RPCClient:
+    """Возвращает общий для процесса экземпляр RPCClient"""
+    return RPCClient(get_rabbitmq_settings().amqp_url, timeout=get_settings().RPC_TIMEOUT)
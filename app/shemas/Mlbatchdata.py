@@ -0,0 +1,28 @@
+from decimal import Decimal
+from pydantic import BaseModel
+from typing import List
+
+
+class MLbatchdata(BaseModel):
+    """Пакет текстов для генерации заголовков"""
+
+    texts: List[str]
+
+
+class MLbatchsubmitdata(BaseModel):
+    """Результат отправки пакета запросов"""
+
+    batch_id: str
+    task_ids: List[int]
+    total_price: Decimal
+
+
+class MLbatchprogressdata(BaseModel):
+    """Ход выполнения пакета запросов: количество запросов в каждом статусе"""
+
+    batch_id: str
+    total: int
+    waiting: int
+    running: int
+    completed: int
+    canceled: int
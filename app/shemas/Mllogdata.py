@@ -21,3 +21,15 @@ class MLlogdata(BaseModel):
     title_length: str
     style: str
     model_config = {"from_attributes": True}
+
+
+class MLloghistorydata(BaseModel):
+    """Запись истории запросов, возвращаемая пользователю"""
+
+    id: int
+    transaction: Optional[TransactionData]
+    timestamp: datetime
+    query_text: str
+    status: int
+    result_dict: Optional[Dict[str, float]]
+    generated_title: Optional[str] = None
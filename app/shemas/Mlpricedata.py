@@ -0,0 +1,11 @@
+from decimal import Decimal
+from pydantic import BaseModel
+from typing import Optional
+
+
+class MLpricedata(BaseModel):
+    """Цена запроса для одного текста из пакета (или причина, по которой текст
+    не может быть принят)"""
+
+    price: Optional[Decimal] = None
+    error: Optional[str] = None
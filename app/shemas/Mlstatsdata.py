@@ -0,0 +1,26 @@
+from datetime import date
+from decimal import Decimal
+from pydantic import BaseModel
+
+
+class MLstatsdata(BaseModel):
+    """Статистика запросов пользователя за период"""
+
+    total_queries: int
+    completed: int
+    failed: int
+    success_rate: float
+    total_cost: Decimal
+    avg_confidence: float
+
+
+class MLdailystatsdata(BaseModel):
+    """Статистика запросов пользователя за один день"""
+
+    day: date
+    total_queries: int
+    completed: int
+    failed: int
+    total_cost: Decimal
+
+    model_config = {"from_attributes": True}
@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+class MLtaskresultdata(BaseModel):
+    """Результат выполнения задачи, возвращаемый воркером"""
+
+    task_id: int
+    result: str
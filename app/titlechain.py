@@ -0,0 +1,59 @@
+from functools import lru_cache
+from itertools import cycle
+from typing import List
+
+from langchain.prompts.chat import ChatPromptTemplate
+from langchain_ollama.llms import OllamaLLM
+
+from app.database.config import get_settings
+
+# Чёткие placeholder'ы под передаваемые переменные:
+TEMPLATE = """You are an expert in generating good titles for research papers.
+Generate a {style}, {title_length} title from the user's abstract.
+---
+context: {docs}
+---
+Here is the abstract from the user: {abstract}
+---
+Output ONLY the generated title and nothing else.
+Title: """
+
+# Шаблон разбирается один раз при импорте модуля
+PROMPT = ChatPromptTemplate.from_template(TEMPLATE)
+
+
+class TitleChain:
+    """Пул заранее собранных цепочек prompt | model для генерации заголовков.
+    Цепочки создаются один раз и используются всеми запросами по очереди"""
+
+    def __init__(self, model_name: str, pool_size: int = 1):
+        self.__chains: List = [
+            PROMPT | OllamaLLM(model=model_name) for _ in range(max(pool_size, 1))
+        ]
+        self.__next_chain = cycle(self.__chains)
+
+    async def agenerate(
+        self, abstract: str, docs: str, style: str, title_length: str
+    ) -> str:
+        """Генерирует заголовок по тексту и контексту, не блокируя цикл событий"""
+        chain = next(self.__next_chain)
+        # <-- ВАЖНО: передаём ВСЕ переменные из шаблона
+        output = await chain.ainvoke({
+            "docs": docs,
+            "abstract": abstract,
+            "style": style,
+            "title_length": title_length,
+        })
+
+        title = str(output).strip()
+        # Если LLM вдруг вернул префикс 'Title:'
+        if "Title:" in title:
+            title = title.split("Title:", 1)[-1].strip()
+        return title
+
+
+@lru_cache()
+def get_title_chain() -> TitleChain:
+    """Возвращает общий для процесса экземпляр TitleChain"""
+    settings = get_settings()
+    return TitleChain(settings.TITLE_MODEL_NAME, settings.TITLE_MODEL_POOL_SIZE)
@@ -0,0 +1,149 @@
+from collections import defaultdict, deque
+from threading import Condition, Event, Thread, Timer
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional
+import itertools
+import time
+
+
+class InMemoryBroker:
+    """
+    Замена RabbitMQ для нагрузочных тестов: очереди хранятся в памяти процесса.
+
+    Поддерживает то, чем пользуются MLWorker и издатель приложения: публикацию
+    в очередь по имени, выдачу сообщений потребителю с ограничением числа
+    неподтвержденных (prefetch), ack/nack/reject и повторную постановку.
+    Для очередей с x-message-ttl и x-dead-letter-routing-key сообщение по
+    истечении TTL перекладывается в указанную очередь, как у очередей повторных попыток.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, deque] = defaultdict(deque)
+        self._arguments: Dict[str, dict] = {}
+        self._condition = Condition()
+        self.published = 0
+
+    def declare(self, queue_name: str, arguments: Optional[dict] = None) -> None:
+        self._arguments[queue_name] = arguments or {}
+
+    def publish(self, queue_name: str, body, properties=None) -> None:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        arguments = self._arguments.get(queue_name, {})
+        if 'x-message-ttl' in arguments:
+            target = arguments.get('x-dead-letter-routing-key', queue_name)
+            timer = Timer(arguments['x-message-ttl'] / 1000, self.publish, (target, body, properties))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._condition:
+            self._queues[queue_name].append((body, properties))
+            self.published += 1
+            self._condition.notify_all()
+
+    def get(self, queue_name: str, timeout: float):
+        """Забирает сообщение из очереди, ожидая его не дольше timeout секунд"""
+        with self._condition:
+            if not self._queues[queue_name]:
+                self._condition.wait(timeout)
+            if self._queues[queue_name]:
+                return self._queues[queue_name].popleft()
+        return None
+
+    def depth(self, queue_name: str) -> int:
+        with self._condition:
+            return len(self._queues[queue_name])
+
+
+class InMemoryChannel:
+    """Канал с подмножеством методов pika.channel.Channel"""
+
+    def __init__(self, broker: InMemoryBroker, connection: 'InMemoryConnection'):
+        self._broker = broker
+        self._connection = connection
+        self._unacked: Dict[int, tuple] = {}
+        self._tags = itertools.count(1)
+        self.acks = 0
+        self.nacks = 0
+        self.rejects = 0
+
+    def queue_declare(self, queue: str, durable: bool = False, arguments: Optional[dict] = None):
+        self._broker.declare(queue, arguments)
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, mandatory=False):
+        self._broker.publish(routing_key, body, properties)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        self._unacked.pop(delivery_tag, None)
+        self.acks += 1
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        message = self._unacked.pop(delivery_tag, None)
+        self.nacks += 1
+        if requeue and message:
+            self._broker.publish(*message)
+
+    def basic_reject(self, delivery_tag: int, requeue: bool = True):
+        message = self._unacked.pop(delivery_tag, None)
+        self.rejects += 1
+        if requeue and message:
+            self._broker.publish(*message)
+
+    def deliver(self, queue_name: str, on_message: Callable, prefetch: int) -> bool:
+        """Передает потребителю одно сообщение, если не превышен prefetch"""
+        if len(self._unacked) >= prefetch:
+            return False
+        message = self._broker.get(queue_name, timeout=0.005)
+        if message is None:
+            return False
+        body, properties = message
+        delivery_tag = next(self._tags)
+        self._unacked[delivery_tag] = (queue_name, body, properties)
+        method = SimpleNamespace(delivery_tag=delivery_tag, routing_key=queue_name, redelivered=False)
+        on_message(self, method, properties or SimpleNamespace(headers=None), body)
+        return True
+
+
+class InMemoryConnection:
+    """
+    Соединение с подмножеством методов pika.BlockingConnection.
+
+    Как и в pika, все операции с каналом выполняются в одном потоке соединения:
+    колбэки из других потоков передаются через add_callback_threadsafe.
+    """
+
+    def __init__(self, broker: InMemoryBroker):
+        self._broker = broker
+        self._callbacks: deque = deque()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+        self.is_open = True
+
+    def channel(self) -> InMemoryChannel:
+        return InMemoryChannel(self._broker, self)
+
+    def add_callback_threadsafe(self, callback: Callable) -> None:
+        self._callbacks.append(callback)
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        while self._callbacks:
+            self._callbacks.popleft()()
+
+    def consume(self, channel: InMemoryChannel, queue_name: str,
+                on_message: Callable, prefetch: int) -> None:
+        """Запускает поток соединения, выдающий сообщения потребителю"""
+        def loop():
+            while not self._stopped.is_set():
+                self.process_data_events()
+                if not channel.deliver(queue_name, on_message, prefetch):
+                    time.sleep(0.001)
+            self.process_data_events()
+
+        self._thread = Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.is_open = False
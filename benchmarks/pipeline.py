@@ -0,0 +1,340 @@
+"""
+Нагрузочный тест конвейера submit -> воркер -> результат без внешних сервисов.
+
+Приложение запускается uvicorn в отдельном потоке на SQLite (или на БД из
+--database-url), модель заменяется StubLLMServer, RabbitMQ - InMemoryBroker.
+MLWorker - настоящий, с пулом задач, кэшем и отправкой результата по HTTP.
+Для каждого уровня конкурентности отправляется --requests запросов на
+/ml/execute и измеряются задержки по этапам:
+
+    submit    - обработка /ml/execute (запись в журнал и публикация)
+    queue     - ожидание в очереди до начала обработки воркером
+    generate  - генерация заголовка (обращение к модели)
+    result    - отправка результата и его применение в приложении
+    e2e       - от отправки запроса до применения результата
+
+Запуск из корня репозитория (настройки приложения читаются из app/.env):
+
+    python -m benchmarks.pipeline --levels 1 4 16 --requests 100 --save bench.json
+    python -m benchmarks.pipeline --baseline bench.json --tolerance 0.2
+
+При сравнении с --baseline код возврата 1 означает регрессию: p95 e2e вырос
+или пропускная способность упала больше чем на --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+# Настройки приложения читаются при импорте модулей app, поэтому задаются заранее
+for key, value in {
+    "DB_HOST": "localhost", "DB_PORT": "5432", "DB_USER": "bench",
+    "DB_PASS": "bench", "DB_NAME": "bench",
+    "JWT_SECRET_KEY": "bench-secret", "JWT_TOKEN_COOKIE_KEY": "access_token",
+    "BCRYPT_ROUNDS": "4",
+    "RABBITMQ_HOST": "localhost", "RABBITMQ_PORT": "5672",
+    "RABBITMQ_USER": "bench", "RABBITMQ_PASS": "bench",
+}.items():
+    os.environ.setdefault(key, value)
+
+import httpx
+import uvicorn
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.api import app
+from app.Admin import Admin
+from app.auth import auth_settings, create_access_token
+from app.Balance import Balance
+from app.database.config import get_settings
+from app.database.database import get_async_session
+from app.mlworkerproxy import MLWorkerProxy
+from app.models.base import Base
+from app.mqpublisher import QUEUE_NAME
+from ml_worker import llm
+from ml_worker.rmq.rmqconf import RabbitMQConfig
+from ml_worker.rmq.rmqworker import MLWorker
+
+from benchmarks.inmemory_mq import InMemoryBroker, InMemoryConnection
+from benchmarks.stub_llm import StubLLMServer
+
+STAGES = ("submit", "queue", "generate", "result", "e2e")
+LEVEL_TIMEOUT = 300  # Максимальное время ожидания результатов одного уровня, с
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class Recorder:
+    """Отметки времени по этапам для каждого текста запроса. Отметки ставятся
+    из цикла событий драйвера, потоков приложения и потоков воркера"""
+
+    def __init__(self):
+        self.marks: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.task_texts: Dict[int, str] = {}
+        self.__done = 0
+        self.__condition = threading.Condition()
+
+    def mark(self, text: str, event: str) -> None:
+        self.marks[text][event] = time.perf_counter()
+
+    def published(self, body: str) -> None:
+        data = json.loads(body)
+        self.task_texts[data["task_id"]] = data["question"]
+        self.mark(data["question"], "published")
+
+    def done(self, task_id: int) -> None:
+        self.mark(self.task_texts[task_id], "done")
+        with self.__condition:
+            self.__done += 1
+            self.__condition.notify_all()
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__done >= count, timeout)
+
+    def stages(self, texts: List[str]) -> Dict[str, List[float]]:
+        stages = defaultdict(list)
+        for text in texts:
+            m = self.marks[text]
+            if "done" not in m:
+                continue
+            stages["submit"].append(m["submitted"] - m["started"])
+            stages["queue"].append(m["picked"] - m["published"])
+            stages["generate"].append(m["generated"] - m["picked"])
+            stages["result"].append(m["done"] - m["generated"])
+            stages["e2e"].append(m["done"] - m["started"])
+        return stages
+
+
+class BenchWorker(MLWorker):
+    """MLWorker, отмечающий начало и конец генерации и отправку результата"""
+
+    def __init__(self, config: RabbitMQConfig, recorder: Recorder):
+        super().__init__(config)
+        self.recorder = recorder
+
+    def process_text(self, text: str) -> str:
+        self.recorder.mark(text, "picked")
+        result = super().process_text(text)
+        self.recorder.mark(text, "generated")
+        return result
+
+    def send_result(self, task_id, result: str) -> bool:
+        ok = super().send_result(task_id, result)
+        if ok:
+            self.recorder.done(task_id)
+        return ok
+
+
+class AppServer(uvicorn.Server):
+    """uvicorn в фоновом потоке, без перехвата сигналов основного потока"""
+
+    def install_signal_handlers(self):
+        pass
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        while not self.started:
+            time.sleep(0.01)
+        return thread
+
+
+async def prepare_database(database_url: str):
+    engine = create_async_engine(database_url, pool_size=20, max_overflow=20) \
+        if database_url.startswith("postgresql") \
+        else create_async_engine(database_url, connect_args={"timeout": 30})
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_maker() as session:
+        user = await Admin(session).signup(
+            username="bench_user", password="bench_password", email="bench@example.com"
+        )
+        await Balance(session).replenish(user, Decimal(10 ** 9))
+    # Соединения привязаны к циклу событий, а запросы будет выполнять цикл uvicorn
+    await engine.dispose()
+    return session_maker, create_access_token(user)
+
+
+async def run_level(base_url: str, token: str, recorder: Recorder,
+                    concurrency: int, requests: int, level: int) -> dict:
+    """Отправляет requests запросов не более чем concurrency одновременно
+    и ждет применения всех результатов"""
+    texts = [
+        f"Нагрузочный тест уровня {level}, запрос номер {i}. Текст для генерации заголовка."
+        for i in range(requests)
+    ]
+    pending = iter(texts)
+    errors = 0
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        for text in pending:
+            recorder.mark(text, "started")
+            response = await client.post("/ml/execute", params={"text": text})
+            recorder.mark(text, "submitted")
+            if response.status_code != 200:
+                errors += 1
+
+    already_done = sum(1 for m in recorder.marks.values() if "done" in m)
+    started = time.perf_counter()
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        client.cookies.set(auth_settings.JWT_TOKEN_COOKIE_KEY, f"Bearer {token}")
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    completed = await asyncio.to_thread(
+        recorder.wait_for, already_done + requests - errors, LEVEL_TIMEOUT
+    )
+    elapsed = time.perf_counter() - started
+
+    stages = recorder.stages(texts)
+    report = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "completed": len(stages["e2e"]),
+        "timed_out": not completed,
+        "throughput": len(stages["e2e"]) / elapsed,
+    }
+    for stage in STAGES:
+        for p in (0.50, 0.95, 0.99):
+            report[f"{stage}_p{int(p * 100)}_ms"] = percentile(stages[stage], p) * 1000
+    return report
+
+
+def print_report(reports: List[dict]) -> None:
+    print(f"{'conc':>5} {'done':>6} {'rps':>8}  " + "  ".join(f"{s + ' p50/p95/p99 ms':>30}" for s in STAGES))
+    for r in reports:
+        cells = "  ".join(
+            f"{r[f'{s}_p50_ms']:>8.1f}/{r[f'{s}_p95_ms']:>9.1f}/{r[f'{s}_p99_ms']:>9.1f}" for s in STAGES
+        )
+        print(f"{r['concurrency']:>5} {r['completed']:>6} {r['throughput']:>8.1f}  {cells}")
+
+
+def check_regressions(reports: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """Сравнивает p95 e2e и пропускную способность с базовым прогоном"""
+    previous = {r["concurrency"]: r for r in baseline}
+    regressions = []
+    for r in reports:
+        base = previous.get(r["concurrency"])
+        if base is None:
+            continue
+        if r["e2e_p95_ms"] > base["e2e_p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"concurrency={r['concurrency']}: e2e p95 {r['e2e_p95_ms']:.1f} ms "
+                f"> {base['e2e_p95_ms']:.1f} ms * {1 + tolerance:.2f}"
+            )
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"concurrency={r['concurrency']}: throughput {r['throughput']:.1f} rps "
+                f"< {base['throughput']:.1f} rps * {1 - tolerance:.2f}"
+            )
+        if r["errors"] or r["timed_out"]:
+            regressions.append(f"concurrency={r['concurrency']}: {r['errors']} errors, timed_out={r['timed_out']}")
+    return regressions
+
+
+async def main(args) -> int:
+    stub = StubLLMServer(ttft=args.ttft, token_delay=args.token_delay, tokens=args.tokens).start()
+    llm.client.url = stub.url
+
+    database_url = args.database_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db"
+    session_maker, token = await prepare_database(database_url)
+
+    async def get_session_override():
+        async with session_maker() as session:
+            yield session
+    app.dependency_overrides[get_async_session] = get_session_override
+
+    recorder = Recorder()
+    broker = InMemoryBroker()
+    # Воркер отправляет результаты с общим секретом, как и в docker-compose
+    worker_token = secrets.token_hex(16)
+    get_settings().WORKER_API_TOKEN = worker_token
+
+    def publish_to_mq(self, body):
+        recorder.published(body)
+        broker.publish(QUEUE_NAME, body)
+    MLWorkerProxy.publish_to_mq = publish_to_mq
+
+    server = AppServer(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_thread = server.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    worker = BenchWorker(
+        RabbitMQConfig(
+            concurrency=args.worker_concurrency,
+            batch_size=args.batch_size,
+            worker_api_token=worker_token,
+        ),
+        recorder,
+    )
+    worker.results.endpoint = f"{base_url}/ml/send_task_results"
+    worker.connection = InMemoryConnection(broker)
+    worker.channel = worker.connection.channel()
+    worker.declare_retry_queues()
+    worker.connection.consume(
+        worker.channel, QUEUE_NAME, worker.process_message, worker.executor.concurrency
+    )
+
+    reports = []
+    try:
+        for level, concurrency in enumerate(args.levels):
+            reports.append(
+                await run_level(base_url, token, recorder, concurrency, args.requests, level)
+            )
+    finally:
+        worker.connection.close()
+        worker.executor.shutdown()
+        server.should_exit = True
+        server_thread.join()
+        stub.stop()
+
+    print_report(reports)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(reports, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = check_regressions(reports, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16],
+                        help="уровни конкурентности клиентов")
+    parser.add_argument("--requests", type=int, default=100, help="запросов на уровень")
+    parser.add_argument("--ttft", type=float, default=0.05, help="задержка первого токена, с")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="задержка между токенами, с")
+    parser.add_argument("--tokens", type=int, default=12, help="токенов в ответе модели")
+    parser.add_argument("--worker-concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--database-url", help="URL БД (по умолчанию временный файл SQLite)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON с результатами базового прогона")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="допустимое ухудшение относительно базового прогона")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
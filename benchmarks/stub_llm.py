@@ -0,0 +1,78 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import json
+import time
+
+
+class StubLLMServer:
+    """
+    Заглушка сервера Ollama для нагрузочных тестов.
+
+    Отвечает на POST /api/generate потоком NDJSON того же формата, что читает
+    ml_worker/llm.py: по одному объекту {"response": ...} на токен и
+    завершающий объект {"done": true}. Ответ передается chunked-кодированием,
+    поэтому keep-alive соединения клиента переиспользуются, как и с реальной моделью.
+
+    Атрибуты:
+        ttft: Задержка перед первым токеном в секундах
+        token_delay: Задержка между токенами в секундах
+        tokens: Количество токенов в ответе (не больше num_predict запроса)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 ttft: float = 0.05, token_delay: float = 0.01, tokens: int = 12):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/generate'
+
+    def start(self) -> 'StubLLMServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                num_predict = payload.get('options', {}).get('num_predict', stub.tokens)
+                stub.requests += 1
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                time.sleep(stub.ttft)
+                for i in range(min(stub.tokens, num_predict)):
+                    if i:
+                        time.sleep(stub.token_delay)
+                    self._write_line({'model': payload.get('model'), 'response': f'слово{i} ', 'done': False})
+                self._write_line({'model': payload.get('model'), 'response': '', 'done': True})
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _write_line(self, obj):
+                data = json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
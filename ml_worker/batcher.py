@@ -0,0 +1,97 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple
+import logging
+import queue
+import threading
+import time
+
+from ml_worker.llm import LLMResponse, OllamaClient
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Собирает тексты, поступающие из разных потоков, в пакеты и отправляет их
+    модели вместе.
+
+    Пакет отправляется, когда в нем набралось max_batch_size текстов или с момента
+    поступления первого текста прошло max_wait секунд. В режиме 'prompt' весь пакет
+    отправляется модели одним промптом, в режиме 'parallel' - параллельными
+    запросами через общий пул соединений клиента.
+    """
+
+    MODES = ('prompt', 'parallel')
+
+    def __init__(self, client: OllamaClient, max_batch_size: int = 8,
+                 max_wait: float = 0.05, mode: str = 'parallel'):
+        """
+        Args:
+            client: Клиент LLM модели
+            max_batch_size: Максимальный размер пакета
+            max_wait: Максимальное время ожидания заполнения пакета в секундах
+            mode: Режим отправки пакета ('prompt' или 'parallel')
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown batch mode: {mode}")
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.mode = mode
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        # Пакеты обрабатываются в отдельном пуле, чтобы пока модель занята одним
+        # пакетом, уже собирался следующий. Запросы режима 'parallel' выполняются
+        # в своем пуле, иначе пакеты могли бы занять все потоки в ожидании запросов
+        self._batches = ThreadPoolExecutor(max_workers=2, thread_name_prefix='batch')
+        self._requests = ThreadPoolExecutor(max_workers=max_batch_size, thread_name_prefix='batch-request')
+        self._thread = threading.Thread(target=self._collect, name='batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> "Future[LLMResponse]":
+        """
+        Ставит текст в очередь на генерацию.
+
+        Returns:
+            Future: Завершится результатом генерации для этого текста
+        """
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _collect(self) -> None:
+        """Цикл сборки пакетов (выполняется в отдельном потоке)."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._batches.submit(self._process, batch)
+
+    def _process(self, batch: List[Tuple[str, Future]]) -> None:
+        """Отправляет пакет модели и раздает результаты по ожидающим задачам."""
+        texts = [text for text, _ in batch]
+        started = time.perf_counter()
+        try:
+            if self.mode == 'prompt':
+                results = self.client.generate_batch(texts)
+            else:
+                results = list(self._requests.map(self.client.generate, texts))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - started
+        tokens = sum(result.tokens for result in results)
+        logger.info(
+            f"Processed batch of {len(batch)} texts in {elapsed:.3f}s "
+            f"({tokens / elapsed if elapsed else 0:.1f} tokens/s)"
+        )
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
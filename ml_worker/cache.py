@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+from ml_worker.llm import LLMResponse, MODEL_NAME, PROMPT_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Кэш результатов генерации, адресуемый содержимым запроса.
+
+    Ключ - хэш нормализованного текста, названия модели и шаблона промпта, поэтому
+    смена модели или промпта автоматически делает старые записи недоступными.
+    Первый уровень - LRU словарь в памяти процесса, второй (необязательный) -
+    таблица SQLite на диске с ограничением времени жизни и количества записей.
+    Кэшируются только успешные результаты модели.
+    """
+
+    # Раз в сколько записей на диск выполняется очистка просроченных и лишних записей
+    CLEANUP_INTERVAL = 100
+
+    def __init__(self, max_size: int = 1024, db_path: Optional[str] = None,
+                 ttl: float = 86400, max_db_rows: int = 100_000):
+        """
+        Args:
+            max_size: Максимальное количество записей в памяти
+            db_path: Путь к файлу SQLite (None - дисковый уровень отключен)
+            ttl: Время жизни записи на диске в секундах
+            max_db_rows: Максимальное количество записей на диске
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_db_rows = max_db_rows
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_writes = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)')
+            self._db.commit()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        """Формирует ключ кэша для текста (пробельные символы нормализуются)."""
+        normalized = ' '.join(text.split())
+        payload = '\0'.join((MODEL_NAME, PROMPT_TEMPLATE, normalized))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[str]:
+        """Возвращает закэшированный результат для текста или None."""
+        key = self.make_key(text)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters['hits'] += 1
+                return value
+
+            value = self._db_get(key)
+            if value is not None:
+                self._counters['hits'] += 1
+                self._counters['disk_hits'] += 1
+                self._memory_put(key, value)
+                return value
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, text: str, result: str) -> None:
+        """Сохраняет результат генерации для текста."""
+        key = self.make_key(text)
+        with self._lock:
+            self._memory_put(key, result)
+            self._db_put(key, result)
+
+    def get_or_generate(self, text: str, generate: Callable[[str], LLMResponse]) -> str:
+        """
+        Возвращает результат из кэша, а при его отсутствии вызывает generate
+        и сохраняет успешный результат.
+        """
+        cached = self.get(text)
+        if cached is not None:
+            return cached
+        response = generate(text)
+        if response.ok:
+            self.put(text, response.text)
+        return response.text
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий, промахов и вытеснений."""
+        with self._lock:
+            return dict(self._counters, size=len(self._memory))
+
+    def _memory_put(self, key: str, value: str) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _db_get(self, key: str) -> Optional[str]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                'SELECT value, created_at FROM results WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if created_at < time.time() - self.ttl:
+                self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                self._db.commit()
+                self._counters['evictions'] += 1
+                return None
+            return value
+        except sqlite3.Error as e:
+            logger.error(f"Cache read error: {e}")
+            return None
+
+    def _db_put(self, key: str, value: str) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                'INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)',
+                (key, value, time.time())
+            )
+            self._db_writes += 1
+            if self._db_writes % self.CLEANUP_INTERVAL:
+                self._db.commit()
+                return
+            # Удаляем просроченные записи и самые старые сверх лимита
+            expired = self._db.execute(
+                'DELETE FROM results WHERE created_at < ?', (time.time() - self.ttl,)
+            ).rowcount
+            overflow = self._db.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_db_rows,)
+            ).rowcount
+            self._db.commit()
+            self._counters['evictions'] += expired + overflow
+        except sqlite3.Error as e:
+            logger.error(f"Cache write error: {e}")
@@ -1,13 +1,32 @@
 import requests
 import logging
 import json
-from typing import Optional
+import time
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from typing import Iterable, List, Optional
 
 # Константы
 OLLAMA_URL = 'http://ollama:11434/api/generate'
 MODEL_NAME = "qwen2.5:7b-instruct"
 NUM_PREDICT = 30  # количество токенов для предсказания
 REQUEST_TIMEOUT = 20  # seconds
+POOL_SIZE = 10  # максимальное число keep-alive соединений с сервером модели
+PROMPT_TEMPLATE = "Сгенерируй 1 краткий и цепляющий заголовок (до 8 слов) без кавычек.\n\nТекст:\n{text}\n\nЗаголовок:"
+# Шаблон для запросов с заданными стилем, длиной заголовка и контекстом (RPC)
+STYLED_PROMPT_TEMPLATE = (
+    "You are an expert in generating good titles for research papers.\n"
+    "Generate a {style}, {title_length} title from the user's abstract.\n---\n"
+    "context: {context}\n---\n"
+    "Here is the abstract from the user: {abstract}\n---\n"
+    "Output ONLY the generated title and nothing else.\nTitle: "
+)
+# Шаблон для пакетной генерации: один запрос к модели на несколько текстов
+BATCH_PROMPT_TEMPLATE = (
+    "Для каждого из {count} текстов ниже сгенерируй 1 краткий и цепляющий заголовок "
+    "(до 8 слов) без кавычек. Ответ дай строго в виде {count} строк формата "
+    "\"<номер>. <заголовок>\" без пояснений.\n\n{texts}\n\nЗаголовки:"
+)
 
 # Настраиваем общий уровень логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -15,19 +34,215 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 
-def _parse_response(response_text: str) -> str:
-    """Парсит ответ от LLM модели."""
-    full_response = ''
-    for line in response_text.strip().split('\n'):
+@dataclass
+class LLMResponse:
+    """
+    Результат обращения к LLM модели.
+
+    Атрибуты:
+        text: Сгенерированный текст (или сообщение об ошибке, если ok=False)
+        ok: Признак успешной генерации
+        tokens: Количество полученных фрагментов ответа (токенов)
+        ttft: Время до получения первого токена в секундах
+        latency: Полное время выполнения запроса в секундах
+    """
+    text: str
+    ok: bool = True
+    tokens: int = 0
+    ttft: Optional[float] = None
+    latency: float = 0.0
+
+
+class GenerationError(Exception):
+    """Исключение для неудачного обращения к модели (таймаут, ошибка сервера и т.п.)"""
+
+
+def _split_batch_response(text: str, count: int) -> Optional[List[str]]:
+    """
+    Разбирает ответ на пакетный запрос вида "1. заголовок" построчно.
+    Возвращает None, если не удалось найти заголовок для каждого текста.
+    """
+    titles = {}
+    for line in text.splitlines():
+        number, sep, title = line.strip().partition('.')
+        if sep and number.strip().isdigit() and title.strip():
+            titles.setdefault(int(number), title.strip())
+    if any(i not in titles for i in range(1, count + 1)):
+        return None
+    return [titles[i] for i in range(1, count + 1)]
+
+
+def _parse_stream(lines: Iterable[bytes], num_predict: int, started: float) -> LLMResponse:
+    """
+    Инкрементально разбирает NDJSON поток от LLM модели.
+
+    Чтение прекращается, как только пришел объект с done=true или
+    израсходован бюджет num_predict токенов.
+    """
+    parts = []
+    ttft = None
+    for line in lines:
         if not line:
             continue
         try:
             response_obj = json.loads(line)
-            if 'response' in response_obj:
-                full_response += response_obj['response']
         except json.JSONDecodeError as e:
             logger.error(f"Error parsing JSON line: {e}")
-    return full_response.strip()
+            continue
+        if response_obj.get('response'):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(response_obj['response'])
+        if response_obj.get('done') or len(parts) >= num_predict:
+            break
+    return LLMResponse(
+        text=''.join(parts).strip(),
+        tokens=len(parts),
+        ttft=ttft,
+        latency=time.perf_counter() - started
+    )
+
+
+class OllamaClient:
+    """
+    Клиент LLM модели с пулом keep-alive соединений.
+    Один экземпляр переиспользуется всеми задачами процесса.
+    """
+
+    def __init__(self, url: str = OLLAMA_URL, model: str = MODEL_NAME,
+                 num_predict: int = NUM_PREDICT, timeout: float = REQUEST_TIMEOUT,
+                 pool_size: int = POOL_SIZE):
+        """
+        Args:
+            url: Адрес эндпоинта генерации
+            model: Название модели
+            num_predict: Максимальное количество токенов в ответе
+            timeout: Таймаут запроса в секундах
+            pool_size: Размер пула соединений
+        """
+        self.url = url
+        self.model = model
+        self.num_predict = num_predict
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def generate(self, text: str) -> LLMResponse:
+        """
+        Генерирует заголовок для текста, читая ответ модели потоково.
+
+        Args:
+            text: Входящий текст для обработки
+
+        Returns:
+            LLMResponse: Результат генерации с метриками задержки
+        """
+        return self._complete(PROMPT_TEMPLATE.format(text=text), self.num_predict)
+
+    def generate_styled(self, abstract: str, style: str = 'concise',
+                        title_length: str = 'short', context: str = '') -> LLMResponse:
+        """
+        Генерирует заголовок заданного стиля и длины с учетом контекста.
+
+        Args:
+            abstract: Текст, для которого генерируется заголовок
+            style: Стиль заголовка
+            title_length: Длина заголовка
+            context: Контекст, найденный по тексту (может быть пустым)
+
+        Returns:
+            LLMResponse: Результат генерации с метриками задержки
+        """
+        prompt = STYLED_PROMPT_TEMPLATE.format(
+            abstract=abstract, style=style, title_length=title_length, context=context
+        )
+        response = self._complete(prompt, self.num_predict)
+        # Модель может вернуть префикс 'Title:' вопреки инструкции
+        if response.ok and 'Title:' in response.text:
+            response.text = response.text.split('Title:', 1)[-1].strip()
+        return response
+
+    def generate_batch(self, texts: List[str]) -> List[LLMResponse]:
+        """
+        Генерирует заголовки для нескольких текстов одним запросом к модели.
+        Если ответ модели не удалось разделить по текстам, каждый текст
+        обрабатывается отдельным запросом.
+
+        Args:
+            texts: Входящие тексты для обработки
+
+        Returns:
+            List[LLMResponse]: Результаты в порядке входящих текстов
+        """
+        if len(texts) == 1:
+            return [self.generate(texts[0])]
+
+        numbered = '\n\n'.join(f"{i}. Текст:\n{text}" for i, text in enumerate(texts, start=1))
+        prompt = BATCH_PROMPT_TEMPLATE.format(count=len(texts), texts=numbered)
+        response = self._complete(prompt, self.num_predict * len(texts))
+        titles = _split_batch_response(response.text, len(texts)) if response.ok else None
+        if titles is None:
+            logger.warning(f"Batch response could not be split into {len(texts)} titles, falling back")
+            return [self.generate(text) for text in texts]
+
+        # Токены общего ответа условно делим поровну между текстами пакета
+        tokens = response.tokens // len(texts)
+        return [
+            LLMResponse(title, tokens=tokens, ttft=response.ttft, latency=response.latency)
+            for title in titles
+        ]
+
+    def _complete(self, prompt: str, num_predict: int) -> LLMResponse:
+        """Отправляет промпт модели и потоково читает ответ."""
+        started = time.perf_counter()
+        try:
+            with self.session.post(
+                self.url,
+                json={
+                    'model': self.model,
+                    'prompt': prompt,
+                    'stream': True,
+                    'options': {
+                        'num_predict': num_predict
+                    }
+                },
+                timeout=self.timeout,
+                stream=True
+            ) as response:
+                logger.info(f"Response status code: {response.status_code}")
+
+                if response.status_code == 404:
+                    return LLMResponse('Модель не найдена! Читайте README файл!', ok=False)
+
+                if response.status_code != 200:
+                    return LLMResponse(f'Ошибка сервера: {response.status_code}', ok=False)
+
+                result = _parse_stream(response.iter_lines(), num_predict, started)
+
+            logger.info(
+                f"Generated {result.tokens} tokens: ttft={result.ttft}s, latency={result.latency:.3f}s"
+            )
+            return result
+
+        except requests.Timeout:
+            logger.error("Request timed out")
+            return LLMResponse('Превышено время ожидания ответа', ok=False)
+        except requests.RequestException as e:
+            logger.error(f"Request error: {e}")
+            return LLMResponse('Ошибка при выполнении запроса', ok=False)
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return LLMResponse('Неожиданная ошибка при обработке', ok=False)
+
+    def close(self) -> None:
+        """Закрывает все соединения пула."""
+        self.session.close()
+
+
+# Общий для процесса клиент модели
+client = OllamaClient()
 
 
 def do_task(text: str) -> str:
@@ -40,36 +255,4 @@ def do_task(text: str) -> str:
     Returns:
         str: Краткое продолжение текста (не более 10 токенов)
     """
-    try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                'model': MODEL_NAME,
-                'prompt': f"Сгенерируй 1 краткий и цепляющий заголовок (до 8 слов) без кавычек.\n\nТекст:\n{text}\n\nЗаголовок:",
-                'options': {
-                    'num_predict': NUM_PREDICT
-                }
-            },
-            timeout=REQUEST_TIMEOUT
-        )
-
-        logger.info(f"Response status code: {response.status_code}")
-        logger.debug(f"Response content: {response.content}")
-
-        if response.status_code == 404:
-            return 'Модель не найдена! Читайте README файл!'
-
-        if response.status_code == 200:
-            return _parse_response(response.text)
-
-        return f'Ошибка сервера: {response.status_code}'
-
-    except requests.Timeout:
-        logger.error("Request timed out")
-        return 'Превышено время ожидания ответа'
-    except requests.RequestException as e:
-        logger.error(f"Request error: {e}")
-        return 'Ошибка при выполнении запроса'
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return 'Неожиданная ошибка при обработке'
\ No newline at end of file
+    return client.generate(text).text
@@ -0,0 +1,99 @@
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from typing import List, Optional, Tuple
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class ResultSender:
+    """
+    Собирает результаты задач, поступающие из разных потоков, и отправляет их
+    в приложение пакетами одним POST запросом с JSON телом.
+
+    Пакет отправляется, когда в нем набралось max_batch_size результатов или
+    с момента поступления первого результата прошло max_wait секунд. Запросы
+    идут через общий пул keep-alive соединений и подписываются общим секретом воркера.
+    """
+
+    TOKEN_HEADER = 'X-Worker-Token'
+
+    def __init__(self, endpoint: str, max_batch_size: int = 32, max_wait: float = 0.05,
+                 timeout: float = 10, pool_size: int = 4, token: Optional[str] = None):
+        """
+        Args:
+            endpoint: Адрес эндпоинта приема пакета результатов
+            max_batch_size: Максимальный размер пакета
+            max_wait: Максимальное время ожидания заполнения пакета в секундах
+            timeout: Таймаут запроса в секундах
+            pool_size: Размер пула соединений
+            token: Общий секрет воркера (WORKER_API_TOKEN приложения)
+        """
+        self.endpoint = endpoint
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if token:
+            self.session.headers[self.TOKEN_HEADER] = token
+        self._queue: "queue.Queue[Tuple[dict, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._collect, name='result-sender', daemon=True)
+        self._thread.start()
+
+    def submit(self, task_id: int, result: str) -> "Future[bool]":
+        """
+        Ставит результат задачи в очередь на отправку.
+
+        Returns:
+            Future: Завершится признаком того, что приложение приняло результат
+        """
+        future: Future = Future()
+        self._queue.put(({'task_id': task_id, 'result': result}, future))
+        return future
+
+    def _collect(self) -> None:
+        """Цикл сборки пакетов (выполняется в отдельном потоке)."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch: List[Tuple[dict, Future]]) -> None:
+        """
+        Отправляет пакет и раздает признак успеха ожидающим задачам. Задачи,
+        которые приложение не смогло применить (failed в ответе), считаются
+        неуспешными, остальные задачи пакета - успешными.
+        """
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.endpoint, json=[record for record, _ in batch], timeout=self.timeout
+            )
+            response.raise_for_status()
+            failed = set(response.json().get('failed', []))
+            logger.info(f"Sent {len(batch)} results in {time.perf_counter() - started:.3f}s")
+        except Exception as e:
+            logger.error(f"Failed to send {len(batch)} results: {e}")
+            failed = None
+        for record, future in batch:
+            future.set_result(failed is not None and record['task_id'] not in failed)
+
+    def close(self) -> None:
+        """Закрывает все соединения пула."""
+        self.session.close()
@@ -0,0 +1,70 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+import logging
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+# Обработчик завершения задачи: (результат, исключение или None)
+DoneCallback = Callable[[Any, Optional[BaseException]], None]
+
+
+class TaskExecutor:
+    """
+    Выполняет задачи воркера в пуле потоков.
+
+    Сама задача (обращение к LLM и т.п.) выполняется в потоке пула, а обработчик
+    завершения - в потоке соединения pika через add_callback_threadsafe, так как
+    BlockingConnection и его каналы не являются потокобезопасными. При
+    concurrency=1 задача выполняется прямо в callback-е потребителя.
+    """
+
+    def __init__(self, concurrency: int = 1):
+        """
+        Аргументы:
+            concurrency: Количество одновременно выполняемых задач
+        """
+        self.concurrency = max(concurrency, 1)
+        self.pool: Optional[ThreadPoolExecutor] = None
+        if self.concurrency > 1:
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.concurrency,
+                thread_name_prefix='task'
+            )
+
+    def submit(self, connection: pika.BlockingConnection,
+               task: Callable[[], Any], on_done: DoneCallback) -> None:
+        """
+        Запускает задачу и по ее завершении вызывает on_done в потоке соединения.
+
+        Аргументы:
+            connection: Соединение, в потоке которого нужно вызвать on_done
+            task: Функция без аргументов, выполняющая работу
+            on_done: Обработчик результата (подтверждение, ответ и т.п.)
+        """
+        if self.pool is None:
+            try:
+                result = task()
+            except Exception as e:
+                on_done(None, e)
+            else:
+                on_done(result, None)
+            return
+
+        def done(future: Future) -> None:
+            callback = partial(on_done, None, future.exception()) if future.exception() \
+                else partial(on_done, future.result(), None)
+            try:
+                connection.add_callback_threadsafe(callback)
+            except Exception as e:
+                # Соединение уже закрыто - брокер повторно доставит неподтвержденное сообщение
+                logger.error(f"Не удалось передать результат задачи в поток соединения: {e}")
+
+        self.pool.submit(task).add_done_callback(done)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Останавливает пул потоков."""
+        if self.pool:
+            self.pool.shutdown(wait=wait)
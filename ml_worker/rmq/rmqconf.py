@@ -1,4 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
+import os
 import pika
 
 
@@ -17,6 +19,25 @@ class RabbitMQConfig:
         rpc_queue_name: Название очереди для RPC-запросов
         heartbeat: Интервал проверки соединения в секундах
         connection_timeout: Таймаут подключения в секундах
+        concurrency: Количество задач, одновременно выполняемых одним процессом
+            (prefetch_count канала устанавливается равным этому значению)
+        batch_size: Максимальный размер пакета текстов для модели (1 - без пакетов);
+            имеет смысл не больше concurrency
+        batch_wait: Время ожидания заполнения пакета в секундах
+        batch_mode: Режим отправки пакета: 'prompt' - одним промптом,
+            'parallel' - параллельными запросами
+        cache_size: Количество результатов, кэшируемых в памяти
+        cache_db_path: Путь к файлу SQLite для дискового кэша (None - отключен)
+        cache_ttl: Время жизни результата в дисковом кэше в секундах
+        cache_db_max_rows: Максимальное количество результатов в дисковом кэше
+        result_batch_size: Максимальное количество результатов в одном запросе к приложению
+        result_batch_wait: Время ожидания заполнения пакета результатов в секундах
+        worker_api_token: Общий секрет для отправки результатов в приложение
+            (по умолчанию берется из переменной окружения WORKER_API_TOKEN)
+        max_retries: Количество повторных попыток обработки сообщения, после
+            которых оно переносится в очередь недоставленных сообщений
+        retry_delay: Задержка перед первой повторной попыткой в секундах
+        retry_backoff: Множитель задержки для каждой следующей попытки
     """
     # Параметры подключения
     host: str = 'rabbitmq'
@@ -35,6 +56,41 @@ class RabbitMQConfig:
     heartbeat: int = 30
     connection_timeout: int = 2
 
+    # Параметры обработки
+    concurrency: int = 4
+    batch_size: int = 1
+    batch_wait: float = 0.05
+    batch_mode: str = 'parallel'
+
+    # Параметры кэша результатов
+    cache_size: int = 1024
+    cache_db_path: Optional[str] = None
+    cache_ttl: int = 86400
+    cache_db_max_rows: int = 100_000
+
+    # Параметры отправки результатов
+    result_batch_size: int = 32
+    result_batch_wait: float = 0.05
+    worker_api_token: Optional[str] = field(default_factory=lambda: os.environ.get('WORKER_API_TOKEN'))
+
+    # Параметры повторных попыток
+    max_retries: int = 3
+    retry_delay: float = 0.5
+    retry_backoff: float = 2.0
+
+    @property
+    def dead_letter_queue_name(self) -> str:
+        """Очередь сообщений, для которых исчерпаны повторные попытки."""
+        return f'{self.queue_name}.dlq'
+
+    def retry_queue_name(self, attempt: int) -> str:
+        """Очередь ожидания перед повторной попыткой с номером attempt."""
+        return f'{self.queue_name}.retry.{attempt}'
+
+    def retry_delay_ms(self, attempt: int) -> int:
+        """Задержка перед повторной попыткой с номером attempt (экспоненциальная) в мс."""
+        return int(self.retry_delay * self.retry_backoff ** (attempt - 1) * 1000)
+
     def get_connection_params(self) -> pika.ConnectionParameters:
         """Создает параметры подключения к RabbitMQ."""
         return pika.ConnectionParameters(
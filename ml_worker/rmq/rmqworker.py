@@ -1,8 +1,13 @@
 from ml_worker.rmq.rmqconf import RabbitMQConfig
-from ml_worker.llm import do_task
+from ml_worker.rmq.executor import TaskExecutor
+from ml_worker.batcher import MicroBatcher
+from ml_worker.cache import ResultCache
+from ml_worker.llm import GenerationError, LLMResponse, client
+from ml_worker.results import ResultSender
+from functools import partial
+from typing import Optional
 import pika
 import time
-import requests
 import logging
 import json
 
@@ -22,9 +27,9 @@ class MLWorker:
     Обеспечивает подключение к очереди и обработку поступающих сообщений.
     """
     # Константы класса
-    MAX_RETRIES = 3
     RETRY_DELAY = 0.5
-    RESULT_ENDPOINT = 'http://app:8080/api/ml/send_task_result'
+    RETRY_HEADER = 'x-retry-count'
+    RESULT_ENDPOINT = 'http://app:8080/ml/send_task_results'
 
     def __init__(self, config: RabbitMQConfig):
         """
@@ -39,7 +44,21 @@ class MLWorker:
         self.connection = None
         # Инициализируем канал как None
         self.channel = None
-        self.retry_count = 0
+        # Пул, в котором одновременно выполняется до config.concurrency задач
+        self.executor = TaskExecutor(config.concurrency)
+        # Сборщик пакетов для модели (если пакетная генерация включена)
+        self.batcher: Optional[MicroBatcher] = None
+        if config.batch_size > 1:
+            self.batcher = MicroBatcher(client, config.batch_size, config.batch_wait, config.batch_mode)
+        # Кэш результатов для повторно присылаемых текстов
+        self.cache = ResultCache(
+            config.cache_size, config.cache_db_path, config.cache_ttl, config.cache_db_max_rows
+        )
+        # Результаты отправляются в приложение пакетами через пул соединений
+        self.results = ResultSender(
+            self.RESULT_ENDPOINT, config.result_batch_size, config.result_batch_wait,
+            token=config.worker_api_token
+        )
 
     def connect(self) -> None:
         """
@@ -50,13 +69,38 @@ class MLWorker:
                 connection_params = self.config.get_connection_params()
                 self.connection = pika.BlockingConnection(connection_params)
                 self.channel = self.connection.channel()
-                self.channel.queue_declare(queue=self.config.queue_name)
+                # Очередь долговечная, как ее объявляет издатель на стороне приложения
+                self.channel.queue_declare(queue=self.config.queue_name, durable=True)
+                self.declare_retry_queues()
+                # Брокер выдает не больше сообщений, чем задач может выполняться одновременно
+                self.channel.basic_qos(prefetch_count=self.executor.concurrency)
                 logger.info("Successfully connected to RabbitMQ")
                 break
             except Exception as e:
                 logger.error(f"Failed to connect to RabbitMQ: {e}")
                 time.sleep(self.RETRY_DELAY)
 
+    def declare_retry_queues(self) -> None:
+        """
+        Объявление очередей повторных попыток и очереди недоставленных сообщений.
+
+        Для каждой попытки своя очередь без потребителей с x-message-ttl, равным
+        задержке этой попытки: по истечении TTL брокер возвращает сообщение в
+        основную очередь через обменник по умолчанию. Поскольку TTL у всех
+        сообщений очереди одинаковый, они истекают по порядку и не ждут друг друга.
+        """
+        for attempt in range(1, self.config.max_retries + 1):
+            self.channel.queue_declare(
+                queue=self.config.retry_queue_name(attempt),
+                durable=True,
+                arguments={
+                    'x-message-ttl': self.config.retry_delay_ms(attempt),
+                    'x-dead-letter-exchange': '',
+                    'x-dead-letter-routing-key': self.config.queue_name,
+                }
+            )
+        self.channel.queue_declare(queue=self.config.dead_letter_queue_name, durable=True)
+
     def cleanup(self):
         """Корректное закрытие соединений с RabbitMQ"""
         try:
@@ -64,27 +108,75 @@ class MLWorker:
                 self.channel.close()
             if self.connection:
                 self.connection.close()
+            self.results.close()
             logger.info("Соединения успешно закрыты")
         except Exception as e:
             logger.error(f"Ошибка при закрытии соединений: {e}")
 
-    def send_result(self, task_id: str, result: str) -> bool:
+    def send_result(self, task_id: int, result: str) -> bool:
         """
-        Отправка результатов обработки задачи на сервер.
+        Отправка результатов обработки задачи на сервер. Результат уходит в составе
+        пакета вместе с результатами других задач; метод ждет ответа приложения,
+        чтобы сообщение подтверждалось только после сохранения результата.
 
         Returns:
             bool: Признак успешности отправки результата
         """
-        try:
-            response = requests.post(
-                self.RESULT_ENDPOINT,
-                params={'task_id': task_id, 'result': result}
-            )
-            response.raise_for_status()
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send result: {e}")
-            return False
+        return self.results.submit(task_id, result).result()
+
+    def process_text(self, text: str) -> str:
+        """
+        Генерация заголовка для текста задачи.
+
+        Args:
+            text: Текст задачи
+
+        Returns:
+            str: Результат работы модели
+        """
+        result = self.cache.get_or_generate(text, self.generate)
+        logger.debug(f"Cache stats: {self.cache.stats()}")
+        return result
+
+    def generate(self, text: str) -> LLMResponse:
+        """
+        Обращение к модели для текста, отсутствующего в кэше.
+
+        Args:
+            text: Входящий текст для обработки
+
+        Returns:
+            LLMResponse: Результат генерации
+
+        Raises:
+            GenerationError: Если модель не вернула результат; сообщение при этом
+                уходит на повторную попытку, а не отправляется как заголовок
+        """
+        if self.batcher:
+            response = self.batcher.submit(text).result()
+        else:
+            response = client.generate(text)
+        if not response.ok:
+            raise GenerationError(response.text)
+        return response
+
+    def handle_task(self, body: bytes) -> None:
+        """
+        Выполнение задачи из сообщения и отправка результата на сервер.
+        Вызывается в потоке пула, с каналом RabbitMQ не работает.
+
+        Args:
+            body: Тело сообщения
+        """
+        # Декодируем bytes в строку и затем парсим JSON
+        data = json.loads(body.decode('utf-8'))
+
+        result = self.process_text(data['question'])
+
+        logger.info(f"Result: {result}")
+
+        if not self.send_result(data['task_id'], result):
+            raise Exception("Failed to send result")
 
     def process_message(self, ch, method, properties, body):
         """
@@ -97,37 +189,71 @@ class MLWorker:
             body: Тело сообщения
 
         Note:
-            Симулирует обработку задачи с задержкой в 3 секунды
+            Задача выполняется в пуле потоков, подтверждение отправляется
+            в on_task_done из потока соединения
         """
-        try:
-            # Логируем информацию о полученном сообщении
-            logger.info(f"Processing message: {body}")
+        # Логируем информацию о полученном сообщении
+        logger.info(f"Processing message: {body}")
 
-            # Декодируем bytes в строку и затем парсим JSON
-            data = json.loads(body.decode('utf-8'))
+        self.executor.submit(
+            self.connection,
+            partial(self.handle_task, body),
+            partial(self.on_task_done, ch, method.delivery_tag, properties, body)
+        )
 
-            result = do_task(data['question'])
+    def on_task_done(self, ch, delivery_tag: int, properties, body: bytes, result, error) -> None:
+        """
+        Подтверждение сообщения по итогам выполнения задачи.
 
-            logger.info(f"Result: {result}")
+        При ошибке копия сообщения с увеличенным счетчиком попыток в заголовке
+        публикуется в очередь ожидания следующей попытки, а после исчерпания
+        попыток - в очередь недоставленных сообщений. Исходное сообщение
+        подтверждается, поэтому колбэк не блокирует соединение ожиданием.
 
-            if self.send_result(data['task_id'], result):
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                self.retry_count = 0
-                logger.info("Task completed successfully")
-            else:
-                raise Exception("Failed to send result")
+        Args:
+            ch: Объект канала RabbitMQ
+            delivery_tag: Тег доставки сообщения
+            properties: Свойства сообщения
+            body: Тело сообщения
+            result: Результат задачи (не используется)
+            error: Исключение, возникшее при выполнении задачи, или None
+        """
+        if error is None:
+            ch.basic_ack(delivery_tag=delivery_tag)
+            logger.info("Task completed successfully")
+            return
 
+        logger.error(f"Error processing message: {error}")
+        headers = dict(getattr(properties, 'headers', None) or {})
+        attempt = int(headers.get(self.RETRY_HEADER, 0)) + 1
+        headers[self.RETRY_HEADER] = attempt
+
+        if attempt > self.config.max_retries:
+            logger.error("Max retries reached, moving message to dead letter queue")
+            headers['x-last-error'] = str(error)[:256]
+            routing_key = self.config.dead_letter_queue_name
+        else:
+            logger.info(f"Retry {attempt} in {self.config.retry_delay_ms(attempt)} ms")
+            routing_key = self.config.retry_queue_name(attempt)
+
+        try:
+            ch.basic_publish(
+                exchange='',
+                routing_key=routing_key,
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,
+                    content_type=getattr(properties, 'content_type', None),
+                    headers=headers
+                )
+            )
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            self.retry_count += 1
-
-            if self.retry_count >= self.MAX_RETRIES:
-                logger.error("Max retries reached, rejecting message")
-                ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
-                self.retry_count = 0
-            else:
-                time.sleep(self.RETRY_DELAY)
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            # Копию опубликовать не удалось - возвращаем исходное сообщение в очередь,
+            # чтобы оно не потерялось
+            logger.error(f"Failed to schedule retry: {e}")
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            return
+        ch.basic_ack(delivery_tag=delivery_tag)
 
     def start_consuming(self) -> None:
         """
@@ -1,8 +1,13 @@
 import pika
 import time
 import logging
+import json
 from ml_worker.rmq.rmqconf import RabbitMQConfig
-from ml_worker.llm import do_task
+from ml_worker.rmq.executor import TaskExecutor
+from ml_worker.batcher import MicroBatcher
+from ml_worker.cache import ResultCache
+from ml_worker.llm import GenerationError, LLMResponse, client
+from functools import partial
 from typing import Optional
 from pika.adapters.blocking_connection import BlockingChannel
 from pika.spec import Basic, BasicProperties
@@ -20,6 +25,8 @@ class RPCWorker:
     Рабочий класс для обработки RPC задач из RabbitMQ.
     Обеспечивает обработку текстовых запросов через RPC механизм.
     """
+    # Заголовок ответа, которым помечается ошибка обработки запроса
+    ERROR_HEADER = 'x-rpc-error'
 
     def __init__(self, config: RabbitMQConfig, max_retries: int = 3):
         """
@@ -35,6 +42,16 @@ class RPCWorker:
         # Канал для работы с RabbitMQ
         self.channel: Optional[BlockingChannel] = None
         self.max_retries = max_retries
+        # Пул, в котором одновременно выполняется до config.concurrency запросов
+        self.executor = TaskExecutor(config.concurrency)
+        # Сборщик пакетов для модели (если пакетная генерация включена)
+        self.batcher: Optional[MicroBatcher] = None
+        if config.batch_size > 1:
+            self.batcher = MicroBatcher(client, config.batch_size, config.batch_wait, config.batch_mode)
+        # Кэш результатов для повторно присылаемых текстов
+        self.cache = ResultCache(
+            config.cache_size, config.cache_db_path, config.cache_ttl, config.cache_db_max_rows
+        )
 
     def connect(self) -> None:
         """
@@ -81,12 +98,77 @@ class RPCWorker:
         Возвращает:
             str: Обработанный текст
         """
-        return do_task(text)
+        result = self.cache.get_or_generate(text, self.generate)
+        logger.debug(f"Cache stats: {self.cache.stats()}")
+        return result
+
+    def process_request(self, body: bytes) -> str:
+        """
+        Обработка RPC запроса. Запрос - либо просто текст, либо JSON объект
+        с полями abstract, style, title_length и context; во втором случае
+        заголовок генерируется с учетом заданных параметров.
+
+        Аргументы:
+            body: Тело сообщения
+
+        Возвращает:
+            str: Обработанный текст
+        """
+        text = body.decode()
+        try:
+            request = json.loads(text)
+        except json.JSONDecodeError:
+            request = None
+        if not isinstance(request, dict) or 'abstract' not in request:
+            return self.process_text(text)
+
+        params = {
+            'abstract': request['abstract'],
+            'style': request.get('style', 'concise'),
+            'title_length': request.get('title_length', 'short'),
+            'context': request.get('context', ''),
+        }
+        # Ключ кэша включает все параметры, так как от них зависит результат.
+        # Такие запросы идут в модель по одному: пакетный промпт не передает параметры
+        key = json.dumps(params, ensure_ascii=False, sort_keys=True)
+        result = self.cache.get_or_generate(
+            key, lambda _: self.check_response(client.generate_styled(**params))
+        )
+        logger.debug(f"Cache stats: {self.cache.stats()}")
+        return result
+
+    def generate(self, text: str) -> LLMResponse:
+        """
+        Обращение к модели для текста, отсутствующего в кэше.
+
+        Аргументы:
+            text: Входящий текст для обработки
+
+        Возвращает:
+            LLMResponse: Результат генерации
+        """
+        if self.batcher:
+            return self.check_response(self.batcher.submit(text).result())
+        return self.check_response(client.generate(text))
+
+    @staticmethod
+    def check_response(response: LLMResponse) -> LLMResponse:
+        """
+        Проверка результата генерации: текст ошибки модели не должен уйти
+        клиенту как заголовок.
+
+        Исключения:
+            GenerationError: Если модель не вернула результат
+        """
+        if not response.ok:
+            raise GenerationError(response.text)
+        return response
 
     def on_request(self, ch: BlockingChannel, method: Basic.Deliver,
                   props: BasicProperties, body: bytes) -> None:
         """
-        Обработчик входящих RPC запросов.
+        Обработчик входящих RPC запросов. Запрос выполняется в пуле потоков,
+        ответ отправляется в send_reply из потока соединения.
 
         Аргументы:
             ch: Канал RabbitMQ
@@ -94,24 +176,50 @@ class RPCWorker:
             props: Свойства сообщения
             body: Тело сообщения
         """
-        try:
-            text = body.decode()
-            logger.info(f"Получен RPC запрос: {text}")
+        logger.info(f"Получен RPC запрос: {body.decode()}")
 
-            response = self.process_text(text)
+        self.executor.submit(
+            self.connection,
+            partial(self.process_request, body),
+            partial(self.send_reply, ch, method, props)
+        )
 
+    def send_reply(self, ch: BlockingChannel, method: Basic.Deliver,
+                   props: BasicProperties, response: Optional[str],
+                   error: Optional[BaseException]) -> None:
+        """
+        Отправка ответа на RPC запрос и подтверждение сообщения. Если запрос
+        обработать не удалось, клиенту отправляется ответ с заголовком ошибки:
+        клиент ждет ответа синхронно, и повторять запрос за него бессмысленно.
+
+        Аргументы:
+            ch: Канал RabbitMQ
+            method: Информация о доставке сообщения
+            props: Свойства сообщения
+            response: Результат обработки текста
+            error: Исключение, возникшее при обработке, или None
+        """
+        headers = None
+        if error is not None:
+            logger.error(f"Ошибка при обработке RPC запроса: {error}")
+            headers = {self.ERROR_HEADER: True}
+            response = str(error)
+        try:
             # Отправляем ответ обратно
             ch.basic_publish(
                 exchange='',
                 routing_key=props.reply_to,
-                properties=pika.BasicProperties(correlation_id=props.correlation_id),
+                properties=pika.BasicProperties(
+                    correlation_id=props.correlation_id, headers=headers
+                ),
                 body=response.encode()
             )
             ch.basic_ack(delivery_tag=method.delivery_tag)
         except Exception as e:
-            logger.error(f"Ошибка при обработке RPC запроса: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag)
-            time.sleep(0.5)  # Небольшая задержка перед следующей попыткой
+            # Ответ отправить не удалось - запрос не возвращается в очередь, чтобы
+            # не обрабатывать его бесконечно; клиент получит таймаут
+            logger.error(f"Ошибка при отправке ответа на RPC запрос: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
     def start_consuming(self) -> None:
         """Запуск прослушивания RPC запросов."""
@@ -120,7 +228,8 @@ class RPCWorker:
                 self.connect()
 
             # Настраиваем очередь и начинаем прослушивание
-            self.channel.basic_qos(prefetch_count=1)
+            # Брокер выдает не больше запросов, чем может выполняться одновременно
+            self.channel.basic_qos(prefetch_count=self.executor.concurrency)
             self.channel.basic_consume(
                 queue=self.config.rpc_queue_name,
                 on_message_callback=self.on_request
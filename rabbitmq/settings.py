@@ -1,6 +1,6 @@
 import pika
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from functools import cached_property
+from functools import cached_property, lru_cache
 from typing import Optional
 
 
@@ -18,6 +18,11 @@ class RabbitMQSettings(BaseSettings):
         extra="ignore",
     )
 
+    @property
+    def amqp_url(self) -> str:
+        """Формирует URL подключения для aio-pika"""
+        return f"amqp://{self.RABBITMQ_USER}:{self.RABBITMQ_PASS}@{self.RABBITMQ_HOST}:{self.RABBITMQ_PORT}/"
+
     @cached_property
     def connection_parameters(self):
 
@@ -38,3 +43,9 @@ class RabbitMQSettings(BaseSettings):
                 username=self.RABBITMQ_USER, password=self.RABBITMQ_PASS
             ),
         )
+
+
+@lru_cache()
+def get_rabbitmq_settings() -> RabbitMQSettings:
+    """Получение настроек RabbitMQ с кэшированием"""
+    return RabbitMQSettings()
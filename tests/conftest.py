@@ -1,49 +1,46 @@
-from fastapi.testclient import TestClient
-import json
-from pathlib import Path
+import httpx
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.pool import StaticPool
-import sys
 
-# В Dockerfile.app в PYTHONPATH добавляется текущая рабочая директория (/ml_3),
-# из которой осуществляется запуск, чтобы сработали импорты к параллелльным модулям.
-# Сделаем то же самое и при тестировании
-sys.path.insert(0, str(Path.cwd()))
-
-from api import app
-from auth import auth_settings, create_access_token
-from database.database import get_session
-from mlworkerproxy import MLWorkerProxy
-from models.base import Base
-from Admin import Admin
+from app.api import app
+from app.auth import WORKER_TOKEN_HEADER, auth_settings, create_access_token, get_token_cache
+from app.database.config import get_settings
+from app.database.database import get_async_session
+from app.mlworkerproxy import MLWorkerProxy
+from app.models.base import Base
+from app.Admin import Admin, get_user_cache
 
 
 @pytest.fixture(name="db_session")
-def db_session_fixture():
-    engine = create_engine(
-        "sqlite:///:memory:",
+async def db_session_fixture():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
         connect_args={"check_same_thread": False},
         poolclass=StaticPool
     )
-    Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
-    with Session(engine) as session:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
+    await engine.dispose()
 
 
 @pytest.fixture(autouse=True)
 def dependencies_fixture(db_session):
-    def get_session_override():
-        return db_session
-    app.dependency_overrides[get_session] = get_session_override
+    async def get_session_override():
+        yield db_session
+    app.dependency_overrides[get_async_session] = get_session_override
     yield
     app.dependency_overrides.clear()
+    # В каждом тесте БД создается заново, и id пользователей повторяются
+    get_token_cache().clear()
+    get_user_cache().clear()
 
 
 @pytest.fixture(name="test_user")
-def test_user_fixture(db_session):
+async def test_user_fixture(db_session):
     users_manager = Admin(db_session)
     user_data = {
         "username": "test_user",
@@ -51,52 +48,46 @@ def test_user_fixture(db_session):
         "email": "test_user@gmail.com",
         "fullname": "Test User",
     }
-    test_user = users_manager.signup(**user_data)
+    test_user = await users_manager.signup(**user_data)
     return test_user
 
 
 @pytest.fixture(name="test_client")
-def test_client_fixture(test_user):
+async def test_client_fixture(test_user):
     # Используем пользователя, созданного test_user_fixture, для формирования токена,
     # применяемого в дальнейших тестах
-    test_client = TestClient(app)
-    test_client.cookies.set(
-        auth_settings.JWT_TOKEN_COOKIE_KEY,
-        f"Bearer {create_access_token(test_user)}"
-    )
-    return test_client
+    # TestClient из starlette следовал перенаправлениям (например, /balance -> /balance/),
+    # у httpx это нужно включить явно
+    async with httpx.AsyncClient(
+        app=app, base_url="http://test", follow_redirects=True
+    ) as test_client:
+        test_client.cookies.set(
+            auth_settings.JWT_TOKEN_COOKIE_KEY,
+            f"Bearer {create_access_token(test_user)}"
+        )
+        yield test_client
 
 
-@pytest.fixture(autouse=True)
-def mod_ml_worker_proxy(test_client):
-    # Используем monkey patching, чтобы изменить для целей тестирования поведение
-    # класса MLWorkerProxy
+@pytest.fixture(name="worker_headers")
+def worker_headers_fixture(monkeypatch):
+    # Заголовки, с которыми воркер отправляет результаты задач
+    monkeypatch.setattr(get_settings(), "WORKER_API_TOKEN", "test-worker-token")
+    return {WORKER_TOKEN_HEADER: "test-worker-token"}
+
+
+@pytest.fixture(name="published", autouse=True)
+def mod_ml_worker_proxy():
+    # Используем monkey patching, чтобы задачи не отправлялись в реальную очередь
+    # сообщений: опубликованные сообщения просто накапливаются в списке
+    published = []
     default_publish_to_mq = MLWorkerProxy.publish_to_mq
+    default_publish_batch_to_mq = MLWorkerProxy.publish_batch_to_mq
     def mod_publish_to_mq(self, body):
-        # Функция изобразит работу реального воркера, фактически не обращаясь
-        # к нему через очередь сообщений
-        RUNNING, COMPLETED = 1, 2
-        body = json.loads(body)
-        query_log_id = body["query_log_id"]
-        # Обвновим статус о том, что запрос в работе
-        test_client.put(
-            "/query/update",
-            json={"id": query_log_id, "status": RUNNING, "result_dict": None},
-        )
-        # Возвратим результат (для теста - нулевой) с соответствующим статусом
-        result = {
-            "anger": 0,
-            "disgust": 0,
-            "fear": 0,
-            "joy": 0,
-            "neutral": 0,
-            "sadness": 0,
-            "surprise": 0
-        }
-        test_client.put(
-            "/query/update",
-            json={"id": query_log_id, "status": COMPLETED, "result_dict": result},
-        )
+        published.append(body)
+    def mod_publish_batch_to_mq(self, bodies):
+        published.extend(bodies)
     MLWorkerProxy.publish_to_mq = mod_publish_to_mq
-    yield
+    MLWorkerProxy.publish_batch_to_mq = mod_publish_batch_to_mq
+    yield published
     MLWorkerProxy.publish_to_mq = default_publish_to_mq
+    MLWorkerProxy.publish_batch_to_mq = default_publish_batch_to_mq
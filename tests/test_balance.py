@@ -1,29 +1,33 @@
-from Balance import Balance
+from app.Balance import Balance, BalanceError
+from app.ML import ML
+from app.MLhistory import MLhistory
 from decimal import Decimal
+import json
+import pytest
 
 
-def test_balance_check(test_user, test_client, db_session):
+async def test_balance_check(test_user, test_client, db_session):
     """Проверим, что получение баланса работает корректно"""
     AMOUNT = Decimal(10_000)
     balance = Balance(db_session)
-    balance.replenish(test_user, AMOUNT)
-    response = test_client.get("/balance")
+    await balance.replenish(test_user, AMOUNT)
+    response = await test_client.get("/balance")
     # Значение типа Decimal сериализуется pydantic в строку, содержащую кавычки.
     # Так как в данном эндпоинте не используется JSON, убираем их вручную
     assert Decimal(response.text[1:-1]) == AMOUNT
 
 
-def test_balance_replenish(test_user, test_client, db_session):
+async def test_balance_replenish(test_user, test_client, db_session):
     """Проверим, что пополнение баланса работает корректно"""
     # Для проверки сделаем несколько пополнений и в конце проверим итоговый баланс
     balance = Balance(db_session)
     AMOUNTS = [1000, 500, 750]
     for amount in AMOUNTS:
-        test_client.post("/balance/replenish", params={"amount": amount})
-    assert balance[test_user] == sum(AMOUNTS)
+        await test_client.post("/balance/replenish", params={"amount": amount})
+    assert await balance[test_user] == sum(AMOUNTS)
 
 
-def test_balance_history(test_user, test_client, db_session):
+async def test_balance_history(test_user, test_client, db_session):
     """Проверим, что получение истории транзакций"""
     # Для проверки вручную занесем несколько транзакций и сравним их с тем,
     # что выдает api
@@ -31,11 +35,83 @@ def test_balance_history(test_user, test_client, db_session):
     AMOUNTS = [1000, 500, -1500]
     for amount in AMOUNTS:
         if amount > 0:
-            balance.replenish(test_user, Decimal(amount))
+            await balance.replenish(test_user, Decimal(amount))
         else:
-            balance.pay(test_user, Decimal(amount)*(-1))
-    response = test_client.get("/balance/history")
+            await balance.pay(test_user, Decimal(amount)*(-1))
+    response = await test_client.get("/balance/history")
     for transaction, amount in zip(response.json(), AMOUNTS):
         assert Decimal(transaction["amount"]) == amount
     # Также проверим итоговый баланс
-    assert balance[test_user] == sum(AMOUNTS)
+    assert await balance[test_user] == sum(AMOUNTS)
+
+
+async def test_balance_snapshot_matches_ledger(test_user, db_session):
+    """Проверим, что текущий баланс совпадает с остатком по последней транзакции"""
+    balance = Balance(db_session)
+    transactions = [
+        await balance.replenish(test_user, Decimal(300)),
+        await balance.pay(test_user, Decimal(120)),
+        await balance.replenish(test_user, Decimal(50)),
+    ]
+    assert await balance[test_user] == transactions[-1].balance == Decimal(230)
+
+
+async def test_balance_pay_insufficient(test_user, db_session):
+    """Проверим, что списание сверх остатка отклоняется и не меняет баланс"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(100))
+    with pytest.raises(BalanceError):
+        await balance.pay(test_user, Decimal(150))
+    assert await balance[test_user] == Decimal(100)
+    assert len(await balance.transactions_history(test_user)) == 1
+
+
+async def test_balance_history_pagination(test_user, test_client, db_session):
+    """Проверим постраничное получение истории транзакций"""
+    balance = Balance(db_session)
+    AMOUNTS = [100, 200, 300, 400, 500]
+    for amount in AMOUNTS:
+        await balance.replenish(test_user, Decimal(amount))
+    amounts = []
+    params = {"limit": 2}
+    while True:
+        response = await test_client.get("/balance/history", params=params)
+        amounts += [Decimal(transaction["amount"]) for transaction in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert amounts == AMOUNTS
+
+
+async def test_balance_history_export(test_user, test_client, db_session):
+    """Проверим выгрузку истории транзакций в NDJSON и CSV"""
+    balance = Balance(db_session)
+    AMOUNTS = [100, 200, 300]
+    for amount in AMOUNTS:
+        await balance.replenish(test_user, Decimal(amount))
+    response = await test_client.get("/balance/history/export")
+    lines = response.text.splitlines()
+    assert [Decimal(json.loads(line)["amount"]) for line in lines] == AMOUNTS
+    response = await test_client.get("/balance/history/export", params={"format": "csv"})
+    # Первая строка CSV - заголовок
+    assert len(response.text.splitlines()) == len(AMOUNTS) + 1
+
+
+async def test_balance_hold_capture_and_release(test_user, db_session):
+    """Проверим резервирование средств под запросы, списание резерва и его снятие"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(100))
+    history = MLhistory(db_session)
+    first = await history.add_new(test_user, ML("First query text"))
+    second = await history.add_new(test_user, ML("Second query text"))
+    await balance.hold(test_user, [(first.id, Decimal(30)), (second.id, Decimal(50))])
+    await db_session.commit()
+    # Зарезервированные средства нельзя ни потратить, ни зарезервировать повторно
+    with pytest.raises(BalanceError):
+        await balance.pay(test_user, Decimal(30))
+    transaction = await balance.capture(test_user, first.id)
+    assert transaction.amount == Decimal(-30)
+    assert await balance.release(second.id)
+    assert not await balance.release(second.id)
+    assert await balance[test_user] == Decimal(70)
+    await balance.pay(test_user, Decimal(70))
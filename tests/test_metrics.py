@@ -0,0 +1,8 @@
+async def test_db_pool_metrics_requires_worker_token(test_client, worker_headers):
+    """Проверим, что метрики пула соединений недоступны без токена"""
+    response = await test_client.get("/metrics/db-pool")
+    assert response.status_code == 403
+    response = await test_client.get("/metrics/db-pool", headers={"X-Worker-Token": "wrong"})
+    assert response.status_code == 403
+    response = await test_client.get("/metrics/db-pool", headers=worker_headers)
+    assert response.status_code == 200
@@ -1,16 +1,22 @@
-from Balance import Balance
+from app.Balance import Balance
+from app.ML import ML
+from app.MLhistory import MLhistory
+from app.MLstatus import MLstatus
+from app.mlworkerproxy import MLWorkerProxy
+from app.notifications import get_notifier
 from decimal import Decimal
+import json
 
 
-def test_ml_with_insufficient_balance(test_client):
+async def test_ml_with_insufficient_balance(test_client):
     """Проверим, чтобы при недостаточном балансе запрос не принимался"""
     # В тестовом окружении баланс нулевой, поэтому никакой запрос не должен проходить
     TEST_QUERY = "Some text for testing"
-    response = test_client.post("/query/execute", params={"text": TEST_QUERY})
+    response = await test_client.post("/ml/execute", params={"text": TEST_QUERY})
     assert response.status_code == 400
 
 
-def test_nl_with_incorrect_ml_text(test_client):
+async def test_nl_with_incorrect_ml_text(test_client):
     """Проверим, чтобы запросы с некорректными текстами не принимались"""
     INCORRECT_TEXTS = [
         "", # Пустой текст
@@ -18,28 +24,30 @@ def test_nl_with_incorrect_ml_text(test_client):
         "123abc", "123’abc", "’abc" # Некорректные составные тексты разного вида
     ]
     for incorrect_text in INCORRECT_TEXTS:
-        response = test_client.post("/query/execute", params={"text": incorrect_text})
+        response = await test_client.post("/ml/execute", params={"text": incorrect_text})
         assert response.status_code == 400
 
 
-def test_ml(test_user, test_client, db_session):
+async def test_ml(test_user, test_client, db_session, published):
     """Проверим, что нормальный запрос отравляется корректно"""
     # Чтобы запрос сработал, сначала вручную пополним баланс на заведомо большую
     # сумму, чем может пригодится
     balance = Balance(db_session)
-    balance.replenish(test_user, Decimal(1_000_000))
+    await balance.replenish(test_user, Decimal(1_000_000))
     # Теперь сам запрос
     TEST_QUERY = "Some text for testing"
-    response = test_client.post("/query/execute", params={"text": TEST_QUERY})
+    response = await test_client.post("/ml/execute", params={"text": TEST_QUERY})
     assert response.status_code == 200
+    # Задача должна быть опубликована в очередь ровно один раз
+    assert len(published) == 1
 
 
-def test_ml_history(test_user, test_client, db_session):
+async def test_ml_history(test_user, test_client, db_session):
     """Проверим, полученеи истории запросов"""
     # Чтобы запросы сработали, сначала вручную пополним баланс на заведомо большую
     # сумму, чем может пригодится
     balance = Balance(db_session)
-    balance.replenish(test_user, Decimal(1_000_000))
+    await balance.replenish(test_user, Decimal(1_000_000))
     TEXTS = [
         "First query",
         "Second query",
@@ -47,9 +55,191 @@ def test_ml_history(test_user, test_client, db_session):
     ]
     # Теперь сами запросы
     for text in TEXTS:
-        test_client.post("/query/execute", params={"text": text})
+        await test_client.post("/ml/execute", params={"text": text})
     # Поскольку вместо обращения к ML модели стоит "заглушка", здесь ограничимся
     # проверкой того, что количество записей в истории запросов соответствует реальному
     # количеству запросов
-    history = test_client.get("/query/history")
+    history = await test_client.get("/ml/history")
     assert len(history.json()) == len(TEXTS)
+
+
+async def test_ml_price_cached_with_etag(test_client):
+    """Проверим, что цена отдается с ETag, а повторный запрос с ним получает 304"""
+    TEST_QUERY = "Some text for testing"
+    response = await test_client.get("/ml/price", params={"text": TEST_QUERY})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = await test_client.get(
+        "/ml/price", params={"text": TEST_QUERY}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+
+async def test_ml_price_batch(test_client):
+    """Проверим расчет цен для нескольких текстов одним запросом"""
+    TEXTS = ["Some text for testing", "123", "Some text for testing"]
+    single = await test_client.get("/ml/price", params={"text": TEXTS[0]})
+    response = await test_client.post("/ml/price/batch", json=TEXTS)
+    prices = response.json()
+    assert len(prices) == len(TEXTS)
+    assert Decimal(prices[0]["price"]) == Decimal(single.json())
+    assert prices[1]["price"] is None and prices[1]["error"]
+    assert prices[2] == prices[0]
+
+
+async def test_ml_status_change_notifies_user(test_user, db_session):
+    """Проверим, что изменение статуса запроса публикуется подписчикам пользователя"""
+    notifier = get_notifier()
+    events = notifier.subscribe(test_user.id)
+    try:
+        query_log_handler = MLhistory(db_session)
+        query_log_item = await query_log_handler.add_new(test_user, ML("Some text for testing"))
+        await query_log_handler.update(query_log_item.id, MLstatus.RUNNING)
+        assert events.get_nowait() == {
+            "id": query_log_item.id,
+            "status": MLstatus.RUNNING.value,
+            "transaction_id": None,
+        }
+    finally:
+        notifier.unsubscribe(test_user.id, events)
+
+
+async def test_ml_repeated_status_counted_once(test_user, db_session):
+    """Проверим, что повторная отмена запроса не увеличивает дневную статистику"""
+    query_log_handler = MLhistory(db_session)
+    query_log_item = await query_log_handler.add_new(test_user, ML("Some text for testing"))
+    await db_session.commit()
+    assert await query_log_handler.cancel(query_log_item.id)
+    assert not await query_log_handler.cancel(query_log_item.id)
+    assert not await query_log_handler.update(query_log_item.id, MLstatus.RUNNING)
+    [daily_stats] = await query_log_handler.get_daily_stats(test_user)
+    assert daily_stats.total_queries == daily_stats.failed == 1
+
+
+async def test_ml_batch(test_user, test_client, db_session, published):
+    """Проверим отправку пакета запросов и получение хода его выполнения"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    TEXTS = ["First query text", "Second query text", "Yet another query"]
+    response = await test_client.post("/ml/execute/batch", json={"texts": TEXTS})
+    assert response.status_code == 200
+    batch = response.json()
+    assert len(batch["task_ids"]) == len(published) == len(TEXTS)
+    # Сообщения опубликованы в порядке текстов и с id соответствующих записей журнала
+    assert [json.loads(body)["task_id"] for body in published] == batch["task_ids"]
+    response = await test_client.get(f"/ml/batch/{batch['batch_id']}")
+    assert response.json()["waiting"] == response.json()["total"] == len(TEXTS)
+
+
+async def test_ml_batch_rejected_as_whole(test_user, test_client, db_session, published):
+    """Проверим, что пакет с некорректным текстом не принимается целиком"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    response = await test_client.post(
+        "/ml/execute/batch", json={"texts": ["First query text", "123"]}
+    )
+    assert response.status_code == 400
+    assert not published
+
+
+async def test_ml_results_batch(test_user, test_client, db_session, published, worker_headers):
+    """Проверим, что пакет результатов от воркера применяется и оплачивается"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    TEXTS = ["First query text", "Second query text"]
+    for text in TEXTS:
+        await test_client.post("/ml/execute", params={"text": text})
+    task_ids = [json.loads(body)["task_id"] for body in published]
+    UNKNOWN_TASK_ID = max(task_ids) + 100
+    results = [{"task_id": task_id, "result": f"Title {task_id}"} for task_id in task_ids]
+    results.append({"task_id": UNKNOWN_TASK_ID, "result": "Lost title"})
+    response = await test_client.post("/ml/send_task_results", json=results, headers=worker_headers)
+    assert response.json() == {"applied": len(TEXTS), "skipped": [UNKNOWN_TASK_ID], "failed": []}
+    # Повторная отправка того же пакета не меняет записи и не списывает деньги повторно
+    response = await test_client.post("/ml/send_task_results", json=results, headers=worker_headers)
+    assert response.json()["skipped"] == [UNKNOWN_TASK_ID]
+    history = (await test_client.get("/ml/history")).json()
+    assert all(log["status"] == MLstatus.COMPLETED.value for log in history)
+    assert {log["generated_title"] for log in history} == {f"Title {task_id}" for task_id in task_ids}
+    prices = sum(ML(text).price for text in TEXTS)
+    assert await balance[test_user] == Decimal(1_000_000) - prices
+    [daily_stats] = await MLhistory(db_session).get_daily_stats(test_user)
+    assert daily_stats.completed == len(TEXTS)
+
+
+async def test_ml_task_result_requires_worker_token(test_user, test_client, db_session, published, worker_headers):
+    """Проверим, что результат задачи принимается только с секретом воркера"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    await test_client.post("/ml/execute", params={"text": "Some text for testing"})
+    task_id = json.loads(published[0])["task_id"]
+    params = {"task_id": task_id, "result": "Title"}
+    response = await test_client.post("/ml/send_task_result", params=params)
+    assert response.status_code == 403
+    response = await test_client.post(
+        "/ml/send_task_result", params=params, headers={"X-Worker-Token": "wrong"}
+    )
+    assert response.status_code == 403
+    response = await test_client.post("/ml/send_task_result", params=params, headers=worker_headers)
+    assert response.status_code == 200
+
+
+async def test_ml_duplicate_result_charged_once(test_user, test_client, db_session, published, worker_headers):
+    """Проверим, что повторная доставка результата не списывает деньги повторно"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    TEXT = "Some text for testing"
+    await test_client.post("/ml/execute", params={"text": TEXT})
+    task_id = json.loads(published[0])["task_id"]
+    for _ in range(2):
+        response = await test_client.post(
+            "/ml/send_task_result", params={"task_id": task_id, "result": "Title"}, headers=worker_headers
+        )
+        assert response.status_code == 200
+    assert await balance[test_user] == Decimal(1_000_000) - ML(TEXT).price
+    [daily_stats] = await MLhistory(db_session).get_daily_stats(test_user)
+    assert daily_stats.completed == 1
+
+
+async def test_ml_late_result_after_timeout_dropped(test_user, test_client, db_session, published, worker_headers):
+    """Проверим, что результат запроса, отмененного по таймауту, не оплачивается"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    await test_client.post("/ml/execute", params={"text": "Some text for testing"})
+    task_id = json.loads(published[0])["task_id"]
+    assert await MLWorkerProxy(db_session).expire_holds(timeout=-1) == 1
+    await test_client.post(
+        "/ml/send_task_result", params={"task_id": task_id, "result": "Title"}, headers=worker_headers
+    )
+    assert await balance[test_user] == Decimal(1_000_000)
+    [log] = (await test_client.get("/ml/history")).json()
+    assert log["status"] == MLstatus.CANCELED.value
+
+
+async def test_ml_results_batch_requires_worker_token(test_user, test_client, db_session, published, worker_headers):
+    """Проверим, что пакет результатов без секрета воркера отклоняется"""
+    balance = Balance(db_session)
+    await balance.replenish(test_user, Decimal(1_000_000))
+    await test_client.post("/ml/execute", params={"text": "Some text for testing"})
+    results = [{"task_id": json.loads(published[0])["task_id"], "result": "Title"}]
+    response = await test_client.post("/ml/send_task_results", json=results)
+    assert response.status_code == 403
+    assert await balance[test_user] == Decimal(1_000_000)
+    [log] = (await test_client.get("/ml/history")).json()
+    assert log["status"] == MLstatus.WAITING.value
+
+
+async def test_ml_result_without_hold_insufficient_funds(test_user, test_client, db_session, worker_headers):
+    """Проверим, что запрос, отправленный до появления резервов, отменяется,
+    если на момент получения результата денег недостаточно"""
+    query_log_item = await MLhistory(db_session).add_new(test_user, ML("Some text for testing"))
+    await db_session.commit()
+    response = await test_client.post(
+        "/ml/send_task_result",
+        params={"task_id": query_log_item.id, "result": "Title"},
+        headers=worker_headers,
+    )
+    assert response.status_code == 200
+    [log] = (await test_client.get("/ml/history")).json()
+    assert log["status"] == MLstatus.CANCELED.value
+    assert await Balance(db_session)[test_user] == Decimal(0)
@@ -1,7 +1,9 @@
-from auth import auth_settings
-from Admin import Admin
+from app.auth import auth_settings
+from app.Admin import Admin, get_user_cache
+from app.hashing import get_password_hasher, hash_rounds
+import bcrypt
 
-def test_user_creation_with_correct_data(test_client, db_session):
+async def test_user_creation_with_correct_data(test_client, db_session):
     """Проверим, что регистрация пользователя с корректными данными проходит успешно"""
     users_manager = Admin(db_session)
     # Первый test_user создается в фикстуре, поэтому здесь test_user_2
@@ -11,13 +13,13 @@ def test_user_creation_with_correct_data(test_client, db_session):
         "email": "test_user_2@gmail.com",
         "fullname": "Test User #2",
     }
-    response = test_client.post("/user/signup", json=user_data)
+    response = await test_client.post("/user/signup", json=user_data)
     assert response.status_code == 201
     # Проверим, что пользователь действительно в БД, для этого вызовем метод signin().
     # Если пользователя не окажется, произойдет исключение и тест будет провален
-    users_manager.signin(username="test_user", password="qwerty123")
+    await users_manager.signin(username="test_user", password="qwerty123")
 
-def test_user_creation_with_incorrect_username(test_client):
+async def test_user_creation_with_incorrect_username(test_client):
     """Проверим, что регистрация пользователя с некорректными именем пользователя
     не проходит"""
     incorrect_usernames = [
@@ -31,10 +33,10 @@ def test_user_creation_with_incorrect_username(test_client):
             "password": "qwerty123",
             "email": "_____@gmail.com",
         }
-        response = test_client.post("/user/signup", json=user_data)
+        response = await test_client.post("/user/signup", json=user_data)
         assert response.status_code == 400
 
-def test_user_creation_with_incorrect_password(test_client):
+async def test_user_creation_with_incorrect_password(test_client):
     """Проверим, что регистрация пользователя с некорректными паролем не проходит"""
     incorrect_password = "1234567" # Меньше 8 символов
     user_data = {
@@ -43,10 +45,10 @@ def test_user_creation_with_incorrect_password(test_client):
         "password": incorrect_password,
         "email": "test_user_2@gmail.com",
     }
-    response = test_client.post("/user/signup", json=user_data)
+    response = await test_client.post("/user/signup", json=user_data)
     assert response.status_code == 400
 
-def test_user_creation_with_incorrect_email(test_client):
+async def test_user_creation_with_incorrect_email(test_client):
     """Проверим, что регистрация пользователя с некорректными адресом электронной почты
     не проходит"""
     incorrect_emails = [
@@ -65,10 +67,10 @@ def test_user_creation_with_incorrect_email(test_client):
             "password": "qwerty123",
             "email": incorrect_email,
         }
-        response = test_client.post("/user/signup", json=user_data)
+        response = await test_client.post("/user/signup", json=user_data)
         assert response.status_code == 400
 
-def test_user_signin(test_client):
+async def test_user_signin(test_client):
     """Проверим, что вход пользователя работает корректно"""
     # Пользователь с такими параметрами создан в фикистуре test_user,
     # которая вызывается test_client
@@ -76,7 +78,31 @@ def test_user_signin(test_client):
         "username": "test_user",
         "password": "qwerty123"
     }
-    response = test_client.post("/user/signin", json=user_data)
+    response = await test_client.post("/user/signin", json=user_data)
     # Если все нормально, будет присвоен токен. Если же токена не окажется,
     # здесь будет выброшено исключение и тест не пройдет
     response.cookies[auth_settings.JWT_TOKEN_COOKIE_KEY]
+
+async def test_user_cache_invalidated_on_change(test_user, test_client, db_session):
+    """Проверим, что после изменения пользователя не отдаются закэшированные данные"""
+    response = await test_client.get("/user/me")
+    assert response.json()["fullname"] == "Test User"
+    test_user.fullname = "Renamed User"
+    await db_session.commit()
+    response = await test_client.get("/user/me")
+    assert response.json()["fullname"] == "Renamed User"
+
+async def test_user_cache_without_password_hash(test_user, test_client):
+    """Проверим, что в кэш пользователей не попадает хэш пароля"""
+    response = await test_client.get("/user/me")
+    assert response.status_code == 200
+    cached = get_user_cache().get(test_user.id)
+    assert cached is not None and "hashed_password" not in cached
+
+async def test_user_password_rehashed_on_signin(test_user, db_session):
+    """Проверим, что хэш, полученный с другим cost factor, пересчитывается при входе"""
+    test_user.hashed_password = bcrypt.hashpw(b"qwerty123", bcrypt.gensalt(rounds=4))
+    await db_session.commit()
+    users_manager = Admin(db_session)
+    user = await users_manager.signin(username="test_user", password="qwerty123")
+    assert hash_rounds(user.hashed_password) == get_password_hasher().rounds
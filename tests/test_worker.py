@@ -0,0 +1,69 @@
+from benchmarks.inmemory_mq import InMemoryBroker, InMemoryConnection
+from ml_worker.llm import LLMResponse, client
+from ml_worker.rmq.rmqconf import RabbitMQConfig
+from ml_worker.rmq.rmqworker import MLWorker
+import json
+import pika
+import pytest
+
+
+@pytest.fixture(name="worker")
+def worker_fixture():
+    # Задачи выполняются прямо в колбэке, брокер - в памяти процесса. Очереди
+    # повторных попыток не объявляются, поэтому сообщения в них остаются
+    worker = MLWorker(RabbitMQConfig(concurrency=1))
+    worker.broker = InMemoryBroker()
+    worker.connection = InMemoryConnection(worker.broker)
+    worker.channel = worker.connection.channel()
+    yield worker
+    worker.results.close()
+    worker.executor.shutdown()
+
+
+@pytest.fixture(name="sent")
+def sent_fixture(worker, monkeypatch):
+    # Результаты, отправленные в приложение
+    sent = []
+    def send_result(task_id, result):
+        sent.append((task_id, result))
+        return True
+    monkeypatch.setattr(worker, "send_result", send_result)
+    return sent
+
+
+def deliver(worker, headers=None):
+    """Публикует задачу в очередь и передает ее воркеру"""
+    config = worker.config
+    properties = pika.BasicProperties(headers=headers) if headers else None
+    worker.broker.publish(
+        config.queue_name, json.dumps({"task_id": 1, "question": "Some text"}), properties
+    )
+    assert worker.channel.deliver(config.queue_name, worker.process_message, prefetch=1)
+
+
+def test_failed_generation_is_retried(worker, sent, monkeypatch):
+    """Проверим, что ошибка модели отправляет задачу на повторную попытку, а не как результат"""
+    monkeypatch.setattr(client, "generate", lambda text: LLMResponse("Ошибка сервера: 500", ok=False))
+    deliver(worker)
+    assert not sent
+    assert worker.channel.acks == 1
+    retry_queue = worker.config.retry_queue_name(1)
+    assert worker.broker.depth(retry_queue) == 1
+    _, properties = worker.broker.get(retry_queue, timeout=0)
+    assert properties.headers[MLWorker.RETRY_HEADER] == 1
+
+
+def test_exhausted_retries_go_to_dead_letter_queue(worker, sent, monkeypatch):
+    """Проверим, что после исчерпания попыток задача переносится в очередь недоставленных"""
+    monkeypatch.setattr(client, "generate", lambda text: LLMResponse("Ошибка сервера: 500", ok=False))
+    deliver(worker, headers={MLWorker.RETRY_HEADER: worker.config.max_retries})
+    assert not sent
+    assert worker.broker.depth(worker.config.dead_letter_queue_name) == 1
+
+
+def test_successful_generation_is_sent(worker, sent, monkeypatch):
+    """Проверим, что успешный результат отправляется в приложение"""
+    monkeypatch.setattr(client, "generate", lambda text: LLMResponse("Title"))
+    deliver(worker)
+    assert sent == [(1, "Title")]
+    assert worker.channel.acks == 1